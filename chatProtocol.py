@@ -0,0 +1,593 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the framing of the messages sent between the chat server
+(server.py) and the chat clients (client.py). Both sides use the same classes,
+so the format of a message on the wire is only defined in one place.
+
+Two versions of the protocol are supported:
+    Protocol 1: Each message is encoded with UTF-8 and ends with the end of
+    message code (END_OF_MSG). The receiver has to search the received bytes for
+    the end of message code, and a message can not contain the code.
+
+    Protocol 2: Each message starts with a header containing the length of the
+    message, the type of the frame and a sequence number. The receiver finds the
+    end of a message from the header, without searching the message.
+
+A connection starts with protocol 1. A client which supports protocol 2 adds
+PROTOCOL_OFFER to its username message. A client which can receive compressed
+data adds COMPRESSION_OFFER. A server answers with an acknowledgement (see
+ackMessage) containing the offers it accepted, framed with protocol 1, and uses
+them for the rest of the connection. The client waits for the first message from
+the server before it sends more messages. If the first message is not an
+acknowledgement, the server does not support the offers and the client
+continues with protocol 1.
+
+A compressed connection sends the frames from the server through a zlib stream 
+(StreamCompressor and StreamDecompressor). The stream is flushed each time data 
+is sent, so the client can decode every message it has received. The stream uses 
+a preset dictionary built from the messages of the host and the bots, which are 
+repeated often in the chat. The offer contains the checksum of the dictionary, 
+so compression is only used if both sides have the same dictionary.
+
+With protocol 2, the server sends the join, leave and kick notices and the line 
+between the old and the new messages as control frames (see FrameType). The 
+message of a control frame only contains the field of the event (e.g. the username), 
+so the client does not have to parse it. With protocol 1, the same events are sent 
+as text (LEGACY_TEXT), which can be turned into control frames with parseLegacy(). 
+The heartbeat frames (ping and pong) are only sent with protocol 2.
+
+The text is only decoded when a message is complete. A character which is split
+between two receive calls is therefore never decoded in two parts.
+
+Classes:
+    FrameEncoder and FrameEncoderV2 classes: Encode messages so that they can
+    be sent with protocol 1 and protocol 2.
+
+    FrameDecoder and FrameDecoderV2 classes: Receive bytes from a socket into a
+    preallocated buffer and return the complete messages as Frame tuples. Only the
+    bytes which arrived since the last call are searched for the end of message code.
+"""
+
+# Module used to pack and unpack the header of the protocol 2 frames
+import struct
+# Module used to compress the data sent to the clients
+import zlib
+# Module used to find the files of the application
+import os
+# Module used to measure the CPU time used for the compression
+import time
+# Module used to build the preset dictionary only once
+import functools
+# Regex library, used to recognize the control events sent with protocol 1
+import re
+# Module used to create the tuple returned for each received message
+from collections import namedtuple
+# The enum class is imported
+import enum
+
+# End of message code used to identify the end of each message sent between the server and the user
+END_OF_MSG = "::EOMsg::"
+
+# The versions of the protocol
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+# Added to the username message by a client that supports the given protocol
+PROTOCOL_OFFER = "protocol={}"
+# Added to the username message by a client that can receive compressed data. 
+# The checksum of the preset dictionary is inserted.
+COMPRESSION_OFFER = "compress=zlib:{:08x}"
+# Added to the username message by a client that chooses the number of old messages 
+# it receives when it joins the chat. Older messages are requested with /history.
+HISTORY_OFFER = "history={}"
+# Added to the username message by a client that reconnects. It contains the room of 
+# the client and the sequence number of the next message the client has not received.
+RESUME_OFFER = "resume={}:{}"
+# The pattern of the acknowledgement sent by the server
+ACK_PATTERN = re.compile("^::(.*)::$")
+
+# The size of the zlib window (2**COMPRESSION_WBITS bytes) and the memory level of the 
+# compressor. They are smaller than the defaults of zlib, because each connection has 
+# its own compressor. The preset dictionary is limited to the size of the window.
+COMPRESSION_WBITS = 13
+COMPRESSION_MEM_LEVEL = 5
+COMPRESSION_LEVEL = 6
+# The file containing the messages of the host
+INITIATORS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversationInitiators.txt")
+
+# The header of a protocol 2 frame: the length of the message (bytes), the type 
+# of the frame and the sequence number of the message.
+HEADER = struct.Struct("!IBQ")
+
+# A received message. The type and the sequence number are only sent with protocol 2.
+Frame = namedtuple("Frame", ["frameType", "sequence", "text"])
+
+
+class FrameType(enum.IntEnum):
+    """
+    The types of the protocol 2 frames.
+    """
+    # A chat message
+    chat = 1
+    # A user has joined the chat. The message is the username.
+    join = 2
+    # A user has left the chat. The message is the username.
+    leave = 3
+    # The receiver is removed from the chat by the host. The message is the reason.
+    kick = 4
+    # The following messages were sent after the receiver joined the chat. The message is empty. 
+    # The sequence number is the sequence number of the next message in the room.
+    historyStart = 5
+    # The end of a page of old messages requested with /history. The message is the sequence 
+    # number of the first message in the page, which is used to request the next page.
+    historyPage = 6
+    # The receiver has entered a room. The message is the name of the room.
+    room = 7
+    # A heartbeat sent by the server to a client which has not sent anything for a while. 
+    # The client answers with a pong frame. The message is empty.
+    ping = 8
+    pong = 9
+
+
+# The text sent with protocol 1 for each type of control frame. The message of the frame is inserted at {}.
+LEGACY_TEXT = {FrameType.join : "User {} has joined the chat!", 
+               FrameType.leave : "Host: User {} left the chat.", 
+               FrameType.kick : "Kicked by the host for {}", 
+               FrameType.historyStart : "------------[Start new messages]------------{}", 
+               FrameType.historyPage : "------------[End of old messages before {}]------------", 
+               FrameType.room : "Host: You are now in the room {}."}
+# The patterns used to recognize the control events received with protocol 1
+LEGACY_PATTERNS = {frameType : re.compile("^" + re.escape(text).replace(re.escape("{}"), "(.*)") + "$", re.DOTALL) 
+                   for frameType, text in LEGACY_TEXT.items()}
+
+
+def legacyText(frameType, msg):
+    """
+    This function returns the text of a frame as it is sent with protocol 1.
+
+    Parameters
+    ----------
+    frameType : FrameType
+        The type of the frame.
+        
+    msg : String
+        The message of the frame.
+
+    Returns
+    -------
+    String
+        The text shown to the user.
+
+    """
+    if frameType in LEGACY_TEXT:
+        return LEGACY_TEXT[frameType].format(msg)
+    return msg
+
+
+def ackMessage(offers):
+    """
+    This function returns the acknowledgement sent by the server for the given 
+    accepted offers (e.g. PROTOCOL_OFFER.format(PROTOCOL_V2)).
+    """
+    return "::" + " ".join(offers) + "::"
+
+
+def parseAck(text):
+    """
+    This function returns the offers accepted by the server as a set, or None if 
+    the text is not an acknowledgement.
+    """
+    match = ACK_PATTERN.search(text)
+    if not match:
+        return None
+    return set(match.groups()[0].split(" "))
+
+
+@functools.lru_cache(maxsize=1)
+def presetDictionary():
+    """
+    This function returns the preset dictionary of the compressed connections. It 
+    contains the messages of the host (conversationInitiators.txt) and the response 
+    tables of the bots in the client module, joined with the end of message code. 
+    zlib finds the strings at the end of the dictionary with the shortest distances, 
+    so the most common strings are placed last.
+
+    Returns
+    -------
+    bytes
+        The dictionary.
+
+    """
+    # The client module defines the bots. It is imported here, because it imports this module.
+    import client
+    texts = list(client.botResponseTexts())
+    try:
+        with open(INITIATORS_PATH, encoding="utf-8") as initiators:
+            texts.extend("Host: " + line.strip() for line in initiators if line.strip())
+    except OSError:
+        # The dictionary is built without the messages of the host. The checksum in the 
+        # offer prevents compression with a server which has another dictionary.
+        pass
+    texts.extend(LEGACY_TEXT[frameType].format("") for frameType in LEGACY_TEXT)
+    dictionary = END_OF_MSG.join(texts).encode() + END_OF_MSG.encode()
+    return dictionary[-(1 << COMPRESSION_WBITS):]
+
+
+def dictionaryId():
+    """
+    This function returns the checksum of the preset dictionary, which is sent in the offer.
+    """
+    return zlib.adler32(presetDictionary())
+
+
+class StreamCompressor:
+    """
+    This class compresses the data sent on one connection. The frames are 
+    compressed together and the stream is flushed at the end, so the receiver 
+    can decode all frames without waiting for more data. The compressor keeps 
+    its state between the calls, so later messages are compressed with the 
+    help of the earlier messages.
+    """
+    
+    def __init__(self):
+        self.compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, COMPRESSION_WBITS, 
+                                           COMPRESSION_MEM_LEVEL, zdict=presetDictionary())
+        # The number of bytes before and after the compression, and the CPU time used (nanoseconds)
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.cpuTime = 0
+        
+    def compress(self, frames):
+        """
+        This method compresses the given frames and flushes the stream.
+
+        Parameters
+        ----------
+        frames : List
+            The encoded frames (bytes).
+
+        Returns
+        -------
+        bytes
+            The compressed data.
+
+        """
+        startTime = time.thread_time_ns()
+        data = [self.compressor.compress(frame) for frame in frames]
+        data.append(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        data = b"".join(data)
+        self.cpuTime += time.thread_time_ns() - startTime
+        self.bytesIn += sum(map(len, frames))
+        self.bytesOut += len(data)
+        return data
+    
+    
+class StreamDecompressor:
+    """
+    This class decompresses the data received on a compressed connection.
+    """
+    
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(COMPRESSION_WBITS, zdict=presetDictionary())
+        
+    def decompress(self, data):
+        """
+        This method returns the decompressed data. zlib.error is raised if the 
+        data is not valid.
+        """
+        return self.decompressor.decompress(data)
+
+
+def parseLegacy(frame):
+    """
+    This function turns a message received with protocol 1 into a control frame 
+    if the text is one of the control events in LEGACY_TEXT.
+
+    Parameters
+    ----------
+    frame : Frame
+        The frame returned by the protocol 1 decoder.
+
+    Returns
+    -------
+    Frame
+        The control frame, or the given frame if it is a chat message.
+
+    """
+    for frameType, pattern in LEGACY_PATTERNS.items():
+        match = pattern.search(frame.text)
+        if match:
+            return Frame(frameType, frame.sequence, match.groups()[0])
+    return frame
+
+
+class FrameTooLargeError(ValueError):
+    """
+    This exception is raised by the FrameDecoder when a message is longer than
+    the maximum frame size.
+    """
+
+
+class FrameEncoder:
+    """
+    This class encodes messages into protocol 1 frames which can be sent to the 
+    other side of the connection.
+    """
+    # The version of the protocol
+    protocol = PROTOCOL_V1
+
+    def __init__(self, delimiter=END_OF_MSG):
+        # The encoded end of message code
+        self.delimiter = delimiter.encode()
+
+    def encode(self, msg, frameType=FrameType.chat, sequence=0):
+        """
+        This method encodes a message and adds the end of message code. 
+        Control frames are sent as text (see LEGACY_TEXT).
+
+        Parameters
+        ----------
+        msg : String
+            The message that should be sent.
+            
+        frameType : FrameType, optional
+            The type of the frame. The default is FrameType.chat.
+            
+        sequence : int, optional
+            Not sent with protocol 1. The default is 0.
+
+        Returns
+        -------
+        bytes
+            The encoded message.
+
+        """
+        return legacyText(frameType, msg).encode() + self.delimiter
+
+
+class FrameEncoderV2(FrameEncoder):
+    """
+    This class encodes messages into protocol 2 frames (header and message).
+    """
+    # The version of the protocol
+    protocol = PROTOCOL_V2
+    
+    def encode(self, msg, frameType=FrameType.chat, sequence=0):
+        """
+        This method encodes a message and adds the header.
+
+        Parameters
+        ----------
+        msg : String
+            The message that should be sent.
+            
+        frameType : FrameType, optional
+            The type of the frame. The default is FrameType.chat.
+            
+        sequence : int, optional
+            The sequence number of the message. The default is 0.
+
+        Returns
+        -------
+        bytes
+            The encoded message.
+
+        """
+        payload = msg.encode()
+        return HEADER.pack(len(payload), frameType, sequence) + payload
+
+
+class FrameDecoder:
+    """
+    This class splits the received bytes into messages. The bytes are received
+    directly into a preallocated buffer with recv_into (recvFrom), or copied into
+    the buffer (feed) when they are provided by another layer (e.g. asyncio). The
+    position up to which the buffer has been searched for the end of message code
+    is stored, so each byte is only searched once, no matter how many receive calls
+    a long message needs. The buffer is large enough for one message of the maximum
+    size. A longer message raises FrameTooLargeError.
+    """
+    # The maximum number of bytes received with one system call
+    RECV_SIZE = 4096
+    # The maximum size (bytes) of one message, without the end of message code
+    MAX_FRAME_SIZE = 64*1024
+    # The size of the header in front of each message (bytes)
+    HEADER_SIZE = 0
+
+    def __init__(self, delimiter=END_OF_MSG, maxFrameSize=MAX_FRAME_SIZE, recvSize=RECV_SIZE):
+        # The encoded end of message code
+        self.delimiter = delimiter.encode()
+        self.maxFrameSize = maxFrameSize
+        self.recvSize = recvSize
+        # The buffer has space for an incomplete message of the maximum size and one receive call
+        self.buffer = bytearray(self.HEADER_SIZE + maxFrameSize + len(self.delimiter) + recvSize)
+        self.view = memoryview(self.buffer)
+        # The start of the first incomplete message in the buffer
+        self.start = 0
+        # The end of the received bytes in the buffer
+        self.end = 0
+        # The position where the next search for the end of message code starts
+        self.scanned = 0
+
+    def __len__(self):
+        """
+        The number of bytes received which are not part of a complete message.
+        """
+        return self.end - self.start
+
+    def recvFrom(self, sock):
+        """
+        This method receives bytes from the socket directly into the buffer.
+        Exceptions raised by the socket are passed on to the caller.
+
+        Parameters
+        ----------
+        sock : Socket object
+            The socket which has data in its receive buffer.
+
+        Returns
+        -------
+        int
+            The number of bytes received. 0 if the connection is closed.
+
+        """
+        self.makeSpace(self.recvSize)
+        count = sock.recv_into(self.view[self.end:self.end + self.recvSize])
+        self.end += count
+        return count
+
+    def feed(self, data=b"", maxFrames=None):
+        """
+        This method adds the given bytes to the buffer and returns the messages
+        which are complete. Without argument, the bytes received with recvFrom
+        are handled.
+
+        Parameters
+        ----------
+        data : bytes, optional
+            The received bytes. The default is b"".
+            
+        maxFrames : int, optional
+            The maximum number of messages returned. The other complete messages 
+            stay in the buffer and are returned by the next call. The data must then 
+            be at most recvSize bytes. The default is None (no limit).
+
+        Returns
+        -------
+        List
+            The decoded messages (Frame tuples).
+
+        """
+        messages = self.frames(maxFrames)
+        for pos in range(0, len(data), self.recvSize):
+            chunk = data[pos:pos + self.recvSize]
+            self.makeSpace(len(chunk))
+            self.buffer[self.end:self.end + len(chunk)] = chunk
+            self.end += len(chunk)
+            messages.extend(self.frames(None if maxFrames is None else maxFrames - len(messages)))
+        return messages
+
+    def frames(self, maxFrames=None):
+        """
+        This method searches the bytes which have not been searched yet for the end
+        of message code and returns the complete messages.
+
+        Parameters
+        ----------
+        maxFrames : int, optional
+            The maximum number of messages returned. The default is None (no limit).
+
+        Returns
+        -------
+        List
+            The decoded messages (Frame tuples). The messages do not contain the 
+            end of message code.
+
+        """
+        messages = []
+        delimiterSize = len(self.delimiter)
+        while maxFrames is None or len(messages) < maxFrames:
+            index = self.buffer.find(self.delimiter, max(self.scanned, self.start), self.end)
+            if index == -1:
+                # The end of message code can be split between two receive calls.
+                # The last bytes are searched again next time.
+                self.scanned = max(self.start, self.end - delimiterSize + 1)
+                if self.end - self.start >= self.maxFrameSize + delimiterSize:
+                    # The rest of the buffer is one incomplete message
+                    raise FrameTooLargeError(f"A message is larger than {self.maxFrameSize} bytes.")
+                break
+            # A character which can not be decoded is replaced, so one client can not crash the receiver
+            messages.append(Frame(FrameType.chat, 0, str(self.view[self.start:index], "utf-8", "replace")))
+            self.start = index + delimiterSize
+        return messages
+
+    def makeSpace(self, count):
+        """
+        This method moves the incomplete message to the start of the buffer if there
+        are less than count free bytes at the end of the buffer.
+        """
+        if len(self.buffer) - self.end >= count:
+            return
+        rest = self.end - self.start
+        self.buffer[:rest] = self.view[self.start:self.end]
+        self.scanned -= self.start
+        self.start = 0
+        self.end = rest
+        
+    def switchTo(self, decoder):
+        """
+        This method moves the bytes which are not part of a returned message to 
+        the given decoder. It is used when the protocol of the connection changes.
+
+        Parameters
+        ----------
+        decoder : FrameDecoder
+            The decoder of the new protocol.
+
+        Returns
+        -------
+        FrameDecoder
+            The given decoder.
+
+        """
+        rest = self.takeRest()
+        decoder.makeSpace(len(rest))
+        decoder.buffer[decoder.end:decoder.end + len(rest)] = rest
+        decoder.end += len(rest)
+        return decoder
+    
+    def takeRest(self):
+        """
+        This method removes the bytes which are not part of a returned message 
+        from the buffer and returns them.
+        """
+        rest = bytes(self.view[self.start:self.end])
+        self.start = self.end = self.scanned = 0
+        return rest
+
+
+class FrameDecoderV2(FrameDecoder):
+    """
+    This class splits the received bytes into protocol 2 frames. The end of each 
+    message is found from the length in the header, so the message is not searched.
+    """
+    
+    # The size of the header in front of each message (bytes)
+    HEADER_SIZE = HEADER.size
+    
+    def __init__(self, maxFrameSize=FrameDecoder.MAX_FRAME_SIZE, recvSize=FrameDecoder.RECV_SIZE):
+        # Protocol 2 does not use the end of message code
+        FrameDecoder.__init__(self, "", maxFrameSize, recvSize)
+        
+    def frames(self, maxFrames=None):
+        """
+        This method returns the complete frames in the buffer.
+
+        Parameters
+        ----------
+        maxFrames : int, optional
+            The maximum number of messages returned. The default is None (no limit).
+
+        Returns
+        -------
+        List
+            The decoded messages (Frame tuples).
+
+        """
+        messages = []
+        while (maxFrames is None or len(messages) < maxFrames) and self.end - self.start >= HEADER.size:
+            length, frameType, sequence = HEADER.unpack_from(self.buffer, self.start)
+            if length > self.maxFrameSize:
+                # The frame is rejected before the message is received
+                raise FrameTooLargeError(f"A message is larger than {self.maxFrameSize} bytes.")
+            stop = self.start + HEADER.size + length
+            if stop > self.end:
+                # The message is not complete
+                break
+            messages.append(Frame(frameType, sequence, str(self.view[self.start + HEADER.size:stop], "utf-8", "replace")))
+            self.start = stop
+        return messages
+
+
+# The encoder and decoder classes of each version of the protocol
+ENCODERS = {PROTOCOL_V1 : FrameEncoder, PROTOCOL_V2 : FrameEncoderV2}
+DECODERS = {PROTOCOL_V1 : FrameDecoder, PROTOCOL_V2 : FrameDecoderV2}
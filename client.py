@@ -32,6 +32,12 @@ import time
 import enum
 # Importing the random module used to pick a random message for the host bot
 import random
+# The zlib module is imported to catch errors in the compressed data from the server
+import zlib
+# The framing of the messages, shared with the server module
+from chatProtocol import END_OF_MSG, PROTOCOL_V1, PROTOCOL_V2, PROTOCOL_OFFER, COMPRESSION_OFFER, HISTORY_OFFER, RESUME_OFFER, \
+    ENCODERS, DECODERS, FrameEncoder, FrameDecoder, FrameType, FrameTooLargeError, StreamDecompressor, \
+    legacyText, parseLegacy, parseAck, dictionaryId
 
 class Tags(enum.Enum):
     """
@@ -256,14 +262,25 @@ class ChatUser(threading.Thread):
             https://docs.python.org/3/library/threading.html#module-threading
     """
     # End of message code used to identify the end of each message sent between the server and the user
-    END_OF_MSG = "::EOMsg::"
-    # The pattern used to identify a kick message from the host.
-    kickedMessage = re.compile("^Kicked by the host for (.*)")
+    END_OF_MSG = END_OF_MSG
     # A default message displayed if an error with the connection is found
     CONNECTION_STOPPED_MSG = "The connection with the chat server has stopped."
     # Delay set for the user input interaction. All messages the user types within a 
     # given time (GENERATE_DELAY) in seconds after the first message, are acumulated.
     GENERATE_DELAY = 1 # seconds
+    # The version of the protocol offered to the server in the username message
+    PROTOCOL = PROTOCOL_V2
+    # Compressed data from the server is accepted if this flag is set (see chatProtocol)
+    COMPRESSION = True
+    # The number of old messages received when joining the chat. Older messages are 
+    # requested with the /history command. None means the default of the server.
+    HISTORY = 50
+    # The client connects again if the connection is lost and this flag is set. The delay 
+    # before the first attempt is RECONNECT_DELAY seconds, and it is doubled after each 
+    # attempt, up to MAX_RECONNECT_DELAY seconds.
+    RECONNECT = True
+    RECONNECT_DELAY = 1
+    MAX_RECONNECT_DELAY = 30
     
     def __init__(self, dest, port, username):
         threading.Thread.__init__(self)
@@ -293,12 +310,34 @@ class ChatUser(threading.Thread):
         self.port = port
         # The send queue for the client
         self.sendQueue = Queue()
-        # The receive queue of the client
+        # The receive queue of the client. It contains the received messages as Frame tuples.
         self.recvQueue = Queue()
         # The flag used to end the connection with the server and end the client program.
         self.stopApplication = threading.Event()
-        # The rest from the last receive procedure
-        self.data_recv = ""
+        # The decoder containing the bytes received which are not a complete message yet
+        self.decoder = FrameDecoder()
+        # The encoder used to frame the messages sent to the server
+        self.encoder = FrameEncoder()
+        # The version of the protocol used with the server. None until the first message 
+        # from the server is received (see chatProtocol).
+        self.protocol = None
+        # This flag is set when the username message has been sent. No other message is 
+        # sent until the version of the protocol is known.
+        self.handshakeSent = False
+        # The sequence number of the next message sent to the server
+        self.sequence = 0
+        # The decompressor of the data from the server. None if the connection is not compressed.
+        self.decompressor = None
+        # The room of the client (None until the server has sent it) and the sequence number of 
+        # the next message in the room (protocol 2). They are sent when the client resumes.
+        self.room = None
+        self.nextSequence = None
+        # This flag is set while the missed messages are replayed after the client resumed
+        self.isResuming = False
+        # This flag is cleared when the connection is lost (see connectionLost)
+        self.isConnected = True
+        # The delay before the next attempt to connect again
+        self.reconnectDelay = self.RECONNECT_DELAY
         # The rest from the last send procedure
         self.send_rest = ""
         
@@ -339,9 +378,17 @@ class ChatUser(threading.Thread):
         
         while not self.stopApplication.is_set():
             # While the application is not stopped
+            if not self.isConnected:
+                # The connection was lost. Connect again and resume.
+                self.reconnect()
+                if self.isConnected:
+                    # Watch the new socket
+                    self.cliSock.setblocking(0)
+                    socketList = [self.cliSock]
+                continue
             
             # Create the list of sockets for cheking writability
-            writableList = [self.cliSock] if not self.sendQueue.empty() else []
+            writableList = [self.cliSock] if not self.sendQueue.empty() and not self.isNegotiating() else []
             try:
                 # Run the select command to check if the socket has received any data, 
                 # has encountered an error or can send to the server.
@@ -355,9 +402,9 @@ class ChatUser(threading.Thread):
                     # https://medium.com/vaidikkapoor/understanding-non-blocking-i-o-with-python-part-1-ec31a2e2db9b
                     # http://pymotw.com/2/select/ 
             except OSError:
-                # If the select function fails, then end the client program.
-                self.initiateClosure()
-                break
+                # If the select function fails, then the connection is lost.
+                self.connectionLost()
+                continue
             
             if readable and not self.stopApplication.is_set():
                 # If there is data in the receive buffer and the stop falg is not set, 
@@ -370,12 +417,12 @@ class ChatUser(threading.Thread):
                 
             while not self.recvQueue.empty():
                 # Print all messages that were added to the recvQueue.
-                # Remove the end of messsage code
-                print("\n" + self.recvQueue.get().replace(self.END_OF_MSG, ""))
+                frame = self.recvQueue.get()
+                print("\n" + legacyText(frame.frameType, frame.text))
                 
             if error and not self.stopApplication.is_set():
-                # If there is an error with the client, then initiate closure of the program
-                self.initiateClosure()
+                # If there is an error with the client, then the connection is lost
+                self.connectionLost()
             
         
         # The client socket is closed when the while loop is done
@@ -398,14 +445,77 @@ class ChatUser(threading.Thread):
         None.
 
         """
-        self.sendQueue.put(f"{user}")
+        self.sendQueue.put(self.handshakeMessage(user))
         # Print first information to the terminal
         print(f"\nYou have joined the chat with username {user}!\n\n" + 
-              "Loading old messages from the thread.\n" + 
+              "Loading old messages from the thread. Type /history to load older messages.\n" + 
               "----------[Start old messages]----------")
         # Add delay to show the message
         time.sleep(1)
         
+    def handshakeMessage(self, user):
+        """
+        This method returns the username message, which offers the protocol of the client, 
+        the compression and the number of old messages. A client which has been connected 
+        before also asks to resume after the last message it received. A server that does 
+        not support an offer ignores it.
+        """
+        offers = [PROTOCOL_OFFER.format(self.PROTOCOL)]
+        if self.COMPRESSION:
+            offers.append(COMPRESSION_OFFER.format(dictionaryId()))
+        if self.HISTORY is not None:
+            offers.append(HISTORY_OFFER.format(self.HISTORY))
+        if self.room is not None and self.nextSequence is not None:
+            # The client has been connected before. Only the missed messages are requested.
+            offers.append(RESUME_OFFER.format(self.room, self.nextSequence))
+            self.isResuming = True
+        return f"{user} " + " ".join(offers)
+    
+    def isNegotiating(self):
+        """
+        This method returns True while the client waits for the answer to the username message.
+        """
+        return self.handshakeSent and self.protocol is None
+    
+    def negotiateProtocol(self):
+        """
+        This method reads the first message from the server. If it acknowledges the offers 
+        of the client, the decoder and the encoder are changed to the new protocol and the 
+        rest of the data from the server is decompressed if the compression was accepted. 
+        Otherwise the client continues with protocol 1 and the message is returned.
+
+        Returns
+        -------
+        List
+            The first message (Frame tuple) if it is a normal message. Else the messages 
+            which were decompressed after the acknowledgement.
+
+        """
+        firstFrames = self.decoder.frames(maxFrames=1)
+        if len(firstFrames) == 0:
+            # The first message is not complete yet
+            return firstFrames
+        # The server has answered, so the next lost connection starts with the shortest delay
+        self.reconnectDelay = self.RECONNECT_DELAY
+        
+        offers = parseAck(firstFrames[0].text)
+        if offers is not None:
+            # The server accepted the offers. The rest of the received bytes use the new protocol.
+            self.protocol = self.PROTOCOL if PROTOCOL_OFFER.format(self.PROTOCOL) in offers else PROTOCOL_V1
+            self.encoder = ENCODERS[self.protocol]()
+            if COMPRESSION_OFFER.format(dictionaryId()) in offers:
+                # The bytes after the acknowledgement are compressed
+                self.decompressor = StreamDecompressor()
+                rest = self.decoder.takeRest()
+                self.decoder = DECODERS[self.protocol]()
+                return self.decoder.feed(self.decompressor.decompress(rest))
+            self.decoder = self.decoder.switchTo(DECODERS[self.protocol]())
+            return []
+        
+        # The server does not support the offers
+        self.protocol = PROTOCOL_V1
+        return firstFrames
+        
     def generateOutput(self):
         """
         This method contians the loop which runs the user interaction. It takes input 
@@ -451,8 +561,9 @@ class ChatUser(threading.Thread):
     def receiveFromServer(self, cliSock):
         """
         This method executes the receive process of the client connection.
-        It fetches the first 4096 Bytes from the receive buffer and adds it to 
-        the receive queue.
+        It receives up to 4096 bytes directly into the buffer of the decoder and 
+        adds the complete messages to the receive queue. The connection is closed 
+        if a kick event is received.
 
         Parameters
         ----------
@@ -464,45 +575,65 @@ class ChatUser(threading.Thread):
         None.
 
         """
-        # Variable containing the received data
-        cur_recv = ""
-        
+        # The bytes received on a compressed connection, which are decompressed below
+        data = b""
         try:
-            cur_recv = cliSock.recv(4096).decode()
+            if self.decompressor is None:
+                recvCount = self.decoder.recvFrom(cliSock)
+            else:
+                data = cliSock.recv(self.decoder.recvSize)
+                recvCount = len(data)
         except Exception:
             # If the recv method raises an exception, 
-            # then the client program is closed
-            self.initiateClosure()
+            # then the connection is lost
+            self.connectionLost()
             return
-            
-        # Add the received message to the rest from the previous read cycle.
-        self.data_recv += cur_recv
         
-        if len(cur_recv) == 0:
+        if recvCount == 0:
             # If the socket fetched 0 bytes from the receive buffer, 
             # a disconnected connection is indicated.
-            # The connection is therefore closed
+            self.connectionLost()
+            return
+        
+        try:
+            msgList = []
+            if self.protocol is None:
+                # The first message from the server decides the version of the protocol
+                msgList = self.negotiateProtocol()
+            if self.decompressor is not None:
+                data = self.decompressor.decompress(data)
+            # Create a list of all complete messages. The incomplete message stays in the decoder.
+            msgList += self.decoder.feed(data)
+        except (FrameTooLargeError, zlib.error):
+            # The server does not send messages of this size or invalid compressed data. 
+            # The connection is closed.
             self.initiateClosure()
             return
         
-        # Create a list of all received messages
-        msgList = self.data_recv.split(self.END_OF_MSG)
-        # Add the uncompleate message (empty string if there is no rest)
-        self.data_recv = msgList.pop()
+        if self.protocol == PROTOCOL_V1:
+            # The control events are sent as text with protocol 1
+            msgList = [parseLegacy(frame) for frame in msgList]
     
-        for msg in msgList:
+        for frame in msgList:
+            # Keep the room and the sequence number used to resume
+            self.trackSequence(frame)
             # For each message check that it is not a connection end message
-            curKickedMatch = self.kickedMessage.search(msg) 
-            if bool(curKickedMatch):
-                # The server has sent a kick message 
-                reason = curKickedMatch.groups()[0]
-                # The client socket is therefore closed with the reason 
-                # given by the server.
-                self.initiateClosure(reason if reason else " unknown.")
+            if frame.frameType == FrameType.kick:
+                # The server has sent a kick message. The client socket is 
+                # therefore closed with the reason given by the server.
+                self.initiateClosure(frame.text if frame.text else " unknown.")
+            elif frame.frameType == FrameType.ping:
+                # The server checks that the client is alive. The answer is sent with the 
+                # other messages in the send queue.
+                self.sendQueue.put(self.encoder.encode("", FrameType.pong))
+            elif self.isResuming and self.isOwnFrame(frame):
+                # The server does not send the messages of a client to the client itself, so 
+                # they are found among the missed messages. They have been shown already.
+                pass
             else:
                 # If it is a normal message, add it to the receive queue, 
                 # ino order to print it to the user.
-                self.recvQueue.put(msg)
+                self.recvQueue.put(frame)
                     
             
     def sendToServer(self, cliSock):
@@ -521,11 +652,19 @@ class ChatUser(threading.Thread):
         """
         for i in range(self.sendQueue.qsize()):
             # For each message in the send queue at the moment this method is called
+            if self.isNegotiating():
+                # Wait for the answer to the username message before sending other messages
+                return
             
             # Variable for the total sent data for each message. 
             dataSent = 0
-            # The encoded message which should be sent to the server.
-            curMsg = (f"{self.username}: " + self.sendQueue.get() + self.END_OF_MSG).encode()
+            # The encoded message which should be sent to the server. The answers to the 
+            # heartbeats of the server are already encoded.
+            curMsg = self.sendQueue.get()
+            if not isinstance(curMsg, bytes):
+                curMsg = self.encoder.encode(f"{self.username}: " + curMsg, FrameType.chat, self.sequence)
+                self.sequence += 1
+            self.handshakeSent = True
             while dataSent < len(curMsg):
                 # Continue to send the message while the sent data is less than the length of the message.
                 try:
@@ -537,13 +676,105 @@ class ChatUser(threading.Thread):
                     return
                 except OSError:
                     # If the recv method raises an exception other than OSError.BlockingIOError, 
-                    # then the client program is closed.
-                    self.initiateClosure()
+                    # then the connection is lost.
+                    self.connectionLost()
                     return
                 
                 # Add the number of sent bytes to the total
                 dataSent += cur_sent
     
+    def trackSequence(self, frame):
+        """
+        This method updates the room and the sequence number of the next message from a 
+        received frame. The sequence numbers are only sent with protocol 2. Messages sent 
+        only to this client and old messages have lower sequence numbers and are ignored.
+        """
+        if frame.frameType == FrameType.room:
+            self.room, self.nextSequence = frame.text, None
+        elif frame.frameType == FrameType.historyStart:
+            # The replay of the missed messages is complete
+            self.isResuming = False
+            if self.protocol == PROTOCOL_V2:
+                self.nextSequence = frame.sequence
+        elif self.protocol != PROTOCOL_V2:
+            return
+        elif frame.frameType in (FrameType.chat, FrameType.join, FrameType.leave) and \
+                self.nextSequence is not None and frame.sequence >= self.nextSequence:
+            self.nextSequence = frame.sequence + 1
+            
+    def isOwnFrame(self, frame):
+        """
+        This method returns True if the given frame is a message, a join or a leave event 
+        of this client. The usernames are unique in the chat.
+        """
+        if frame.frameType in (FrameType.join, FrameType.leave):
+            return frame.text == self.username
+        return frame.frameType == FrameType.chat and frame.text.startswith(f"{self.username}: ")
+            
+    def connectionLost(self):
+        """
+        This method is called when the connection with the server is lost. The client 
+        connects again (see reconnect) if the RECONNECT flag is set. Otherwise the client 
+        program is closed.
+        """
+        if self.RECONNECT and not self.stopApplication.is_set():
+            self.isConnected = False
+        else:
+            self.initiateClosure()
+            
+    def reconnect(self):
+        """
+        This method connects to the server again after the connection was lost. It waits 
+        for the reconnect delay first, with a random part so that many clients do not 
+        connect at the same time. The delay is doubled for the next attempt. If the 
+        connection is established, the state of the connection is reset and the username 
+        message, which resumes after the last received message, is sent before the 
+        messages typed while the connection was lost. The isConnected flag stays 
+        cleared if the attempt fails.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.cliSock.close()
+        delay = self.reconnectDelay * random.uniform(0.5, 1)
+        self.reconnectDelay = min(self.reconnectDelay * 2, self.MAX_RECONNECT_DELAY)
+        self.showStatus(f"The connection with the chat server was lost. Connecting again in {delay:.1f} seconds.")
+        if self.stopApplication.wait(delay):
+            # The client was closed while waiting
+            return
+        try:
+            self.cliSock = socket.create_connection((self.dest, self.port), timeout=self.MAX_RECONNECT_DELAY)
+        except OSError:
+            return
+        self.cliSock.settimeout(None)
+        
+        # The protocol and the compression are negotiated again
+        self.decoder = FrameDecoder()
+        self.encoder = FrameEncoder()
+        self.protocol = None
+        self.handshakeSent = False
+        self.decompressor = None
+        self.sequence = 0
+        # The username message is sent first
+        oldQueue = self.sendQueue
+        self.sendQueue = Queue()
+        self.sendQueue.put(self.handshakeMessage(self.username))
+        while not oldQueue.empty():
+            msg = oldQueue.get()
+            if not isinstance(msg, bytes):
+                # The answers to the heartbeats of the old connection are dropped
+                self.sendQueue.put(msg)
+        self.isConnected = True
+        self.showStatus("Connected to the chat server again.")
+        
+    def showStatus(self, text):
+        """
+        This method shows a message about the connection to the user.
+        """
+        print("\n" + text)
+        
     def initiateClosure(self, reason=""):
         """
         This method initiates the termination of the client socket. 
@@ -588,6 +819,8 @@ class ChatBot(ChatUser, threading.Thread):
     
         sendInitialMessage(): Add a connect message to the send queue of the 
                               bot (nothing is printed to terminal).
+                              
+        showStatus(): Nothing is printed when the bot connects again.
     
         New Method introduced for bots:
             getBotResponse(): Generates special response. Each bot that inherits 
@@ -598,48 +831,53 @@ class ChatBot(ChatUser, threading.Thread):
     
     # Response delay used to avoid sending all messages sent withing rappid succession
     BOT_RESPONSE_DELAY = 1
+    # The bots only reply to new messages, so they do not receive old messages
+    HISTORY = 0
+    
+    # The response tables are class attributes, so they can be read without creating a bot 
+    # (see botResponseTexts).
+    
+    # Responses sent if the message asks for an opinion        
+    opinionResponses = ["I think it is nice!", 
+                        "I am not sure, try to ask someone else.", 
+                        "I dont`t like it.", 
+                        "Let me make up my mind first!"]
+    
+    generalQuestionResponse = ["I don`t know.", 
+                               "You need to ask someone else!", 
+                               "Give me a moment to find out."]
+    
+    # Responses sent if the message is a statement
+    statementResponses = ["If you say so!", 
+                          "I did not know that.", 
+                          "How can you say something like that.", 
+                          "Are you sure about that?", 
+                          "Can you prove it?"]
+    
+    # Responses when the message is about the weather
+    weatherResponse = ["I do not want to talk about the weather. It is boring and always depressing!", 
+                       "I have the same question.", 
+                       "If you want to talk about the weather, you have to talk to someone else."]
+    
+    # Responses used when the message is about locations
+    locationResponse = ["I am not an expert in geography unfortunatly, " + 
+                        "maybe some one else can help with this?"]
+    
+    # Messages sent if the received message is to too complicated or not classifyed by the MsgAnalysis class
+    generalResponse = ["I am not sure if I understand your message.\n Could you please clarify?",
+                       "Please write in english, so I can understand you!"]
+    
+    # Greetings for response to join messages
+    greetings = ["Hi", "Hello", "A good day to you,", "How are you today"]
     
     def __init__(self, dest, port, username="Simple_Chat_Bot"):
         ChatUser.__init__(self, dest, port, username)
         
-        # Pattern used to match messages that should not be replied to by the bot
-        self.replyFilter = re.compile("^(.*[Bb]ot): " + # Do not reply to bots
-                                      "|[-]+\[Start new messages\][-]+|" + # Do not reply to the separation lines
-                                      "User .*[bB]ot has joined the chat!" + # Do not reply to join messages about bots
-                                      "|Host: User .* left the chat\.") # Do not reply to disconnect messages from the server
-        
-        # Responses sent if the message asks for an opinion        
-        self.opinionResponses = ["I think it is nice!", 
-                                 "I am not sure, try to ask someone else.", 
-                                 "I dont`t like it.", 
-                                 "Let me make up my mind first!"]
-        
-        self.generalQuestionResponse = ["I don`t know.", 
-                                        "You need to ask someone else!", 
-                                        "Give me a moment to find out."]
-        
-        # Responses sent if the message is a statement
-        self.statementResponses = ["If you say so!", 
-                                   "I did not know that.", 
-                                   "How can you say something like that.", 
-                                   "Are you sure about that?", 
-                                   "Can you prove it?"]
-        
-        # Responses when the message is about the weather
-        self.weatherResponse = ["I do not want to talk about the weather. It is boring and always depressing!", 
-                                "I have the same question.", 
-                                "If you want to talk about the weather, you have to talk to someone else."]
-        
-        # Responses used when the message is about locations
-        self.locationResponse = ["I am not an expert in geography unfortunatly, " + 
-                                 "maybe some one else can help with this?"]
-        
-        # Messages sent if the received message is to too complicated or not classifyed by the MsgAnalysis class
-        self.generalResponse = ["I am not sure if I understand your message.\n Could you please clarify?",
-                           "Please write in english, so I can understand you!"]
-        
-        # Greetings for response to join messages
-        self.greetings = ["Hi", "Hello", "A good day to you,", "How are you today"]
+        # Pattern used to match messages that should not be replied to by the bot. The join, leave 
+        # and separator lines are control events, so only messages from other bots are filtered.
+        self.replyFilter = re.compile("^(.*[Bb]ot): ")
+        # Pattern used to match the usernames of bots. Join events about bots are not replied to.
+        self.botUsername = re.compile("[Bb]ot$")
         
         
     def run(self):
@@ -666,6 +904,13 @@ class ChatBot(ChatUser, threading.Thread):
         self.sendToServer(self.cliSock)
         while not self.stopApplication.is_set():
             # While the application is not stopped, run the receive/send process
+            if not self.isConnected:
+                # The connection was lost. Connect again and resume.
+                self.reconnect()
+                if self.isConnected:
+                    # Push the username message to the send buffer
+                    self.sendToServer(self.cliSock)
+                continue
             if not self.stopApplication.is_set():
                 # If the application is running, receive from buffer.
                 
@@ -695,6 +940,12 @@ class ChatBot(ChatUser, threading.Thread):
         # The stopApplication flag is set in order to break the while loop in the main thread 
         self.stopApplication.set()
         
+    def showStatus(self, text):
+        """
+        The bot does not print the state of the connection to the terminal.
+        """
+        pass
+        
         
     def sendInitialMessage(self, botName):
         """
@@ -705,7 +956,7 @@ class ChatBot(ChatUser, threading.Thread):
         botName : String
             The name of the bot which is joining the chat thread.
         """
-        self.sendQueue.put(f"{botName}")
+        self.sendQueue.put(self.handshakeMessage(botName))
             
     def generateResponse(self):
         """
@@ -721,17 +972,26 @@ class ChatBot(ChatUser, threading.Thread):
         """
         # Current message which should be responded to
         curMsg = ""
+        # The username of the user which joined the chat, if the latest replyable message is a join event
+        joinedUser = ""
         while self.recvQueue.qsize() > 0:
             # If the receive queue contains more than one message, 
             # then all messages are dropped except one (the latest replyable message)
-            msg = self.recvQueue.get()
+            frame = self.recvQueue.get()
             
-            if not bool(self.replyFilter.search(msg)):
+            if frame.frameType == FrameType.join and not bool(self.botUsername.search(frame.text)):
+                # Greet users which are not bots
+                joinedUser, curMsg = frame.text, ""
+            elif frame.frameType == FrameType.chat and not bool(self.replyFilter.search(frame.text)):
                 # The message that will be replied to by the bot is set as curent message
-                # if it is not from a bot.
-                curMsg = msg
+                # if it is not from a bot. Other control events are not replied to.
+                joinedUser, curMsg = "", frame.text
         
-        if curMsg:
+        if joinedUser:
+            # If the latest message is a join event then add a greeting and return.
+            self.sendQueue.put(random.choice(self.greetings) + " " + 
+                               joinedUser + random.choice(["!", ".", ""]))
+        elif curMsg:
             # If the there is a current message set then generate a reply.
             # else return without any response generated.
             try:
@@ -744,18 +1004,10 @@ class ChatBot(ChatUser, threading.Thread):
             
             # Call the classify method to add tags to the message
             msgObj.classifyMsg()
-            
-            if Tags.join in msgObj.tags:
-                # If the message is taged as join message then add a 
-                # greeting and return.
-                self.sendQueue.put(random.choice(self.greetings) + " " + 
-                                   msgObj.username + random.choice(["!", ".", ""]))
-                #print(f"Greeting because of: {curMsg}") # Used for debuging
-            else: 
-                # Get the specific response for the bot 
-                response = self.getBotResponse(msgObj)
-                # Send the response
-                self.sendQueue.put(response)
+            # Get the specific response for the bot 
+            response = self.getBotResponse(msgObj)
+            # Send the response
+            self.sendQueue.put(response)
             
     def getBotResponse(self, msgObj):
         """
@@ -943,25 +1195,25 @@ class SportBot(ChatBot):
     and the thread can be started with the method start(). The method initiateClosure 
     can be called to stop the bot.
     """
+    # The unique response to some activities
+    activityReplies = {"tennis" : ["Yes, I love tennis!", "I would like to play tennis."], 
+                       "football" : ["I like football, but I prefere tennis", "I like sport in general," + 
+                                     " but hearing about football now is not cheering me up right now"], 
+                       "drawing" : ["I am a big sports fan, but art is not my cup of tea!", "Please, talk about something else! Maybey we can watch sport?"]}
+    
+    # Opinions used to respond to requests for an opinion about an activity
+    opinionOnActivities = {Tags.sport : ["I love all kind of sport, and I am realy paying a lot of attention to {} at the moment.",  
+                                         "I think that {} is one of the best sports there is!", 
+                                         "I could watch {} all day!", "I could play {} all day."], 
+                           Tags.art : ["I am not very interested in art. Sorry. But we could talk about sports!", "I dont like art.", 
+                                       "I prefere the art of creating the perfect stop-ball in tennis."]} 
+    # Response to weather messages 
+    weatherOpinion = ["I do not care about the weather.", "A true athlete works in any weather!", "The weather is always nice enough in my opinion", 
+                      "There is nothing called bad weather!"]
+    
     def __init__(self, dest, port, username="Sport_Bot"):
         ChatBot.__init__(self, dest, port, username)
         
-        # The unique response to some activities
-        self.activityReplies = {"tennis" : ["Yes, I love tennis!", "I would like to play tennis."], 
-                           "football" : ["I like football, but I prefere tennis", "I like sport in general," + 
-                                         " but hearing about football now is not cheering me up right now"], 
-                           "drawing" : ["I am a big sports fan, but art is not my cup of tea!", "Please, talk about something else! Maybey we can watch sport?"]}
-        
-        # Opinions used to respond to requests for an opinion about an activity
-        self.opinionOnActivities = {Tags.sport : ["I love all kind of sport, and I am realy paying a lot of attention to {} at the moment.",  
-                                             "I think that {} is one of the best sports there is!", 
-                                             "I could watch {} all day!", "I could play {} all day."], 
-                               Tags.art : ["I am not very interested in art. Sorry. But we could talk about sports!", "I dont like art.", 
-                                           "I prefere the art of creating the perfect stop-ball in tennis."]} 
-        # Response to weather messages 
-        self.weatherOpinion = ["I do not care about the weather.", "A true athlete works in any weather!", "The weather is always nice enough in my opinion", 
-                        "There is nothing called bad weather!"]
-        
     def getBotResponse(self, msgObj):
         """
         This method generates a response to the message provided as argument.
@@ -1039,25 +1291,25 @@ class ArtBot(ChatBot):
     can be called to stop the bot.
     """
     
+    # Unique responses to activities for the Artbo
+    activityReplies = {"tennis" : ["Tennis! Sounds interesting. What is it?", "I would like to trie, but you would have to teach me!", "No, I am not interested"], 
+                       "football" : ["No football for me, please!", "I don`t like football. Can we talk about something else?", "Football. Such a pointless activity!"], 
+                       "drawing" : ["Yes, I will never say no to that.", "That is a good idea.", "Perfect, I have practiced my drawing capabilities lately."]}
+    
+    # Responses for requests about opinions on an activity
+    opinionOnActivities = {"football" : ["I do not like football. I think that it is compleatly mental to kick around a ball all day, while you can spend your time crating real art.", 
+                                         "I do not have much symphaty with that sport.", "Lets talk about something relevant!"], 
+                           "tennis" : ["I am not sure yet. I need to try it first.", "It looks like a cool activity. I would like to try it once."], 
+                           "drawing" : ["I love to create art with the pencile.", "It is my faivorit activity.", 
+                                        "With all my hart, i like to paint and draw!"]} 
+    
+    # Response to weather messages.
+    weatherOpinion = ["I like all kinds of weather. Any weather can provide an interesting motive for a drawing.", 
+                      "Let the weather be what it is and live with it!", "I can`t complain. It is nice enough for me!"]
+    
     def __init__(self, dest, port, username="Art_Bot"):
         ChatBot.__init__(self, dest, port, username)
         
-        # Unique responses to activities for the Artbo
-        self.activityReplies = {"tennis" : ["Tennis! Sounds interesting. What is it?", "I would like to trie, but you would have to teach me!", "No, I am not interested"], 
-                           "football" : ["No football for me, please!", "I don`t like football. Can we talk about something else?", "Football. Such a pointless activity!"], 
-                           "drawing" : ["Yes, I will never say no to that.", "That is a good idea.", "Perfect, I have practiced my drawing capabilities lately."]}
-        
-        # Responses for requests about opinions on an activity
-        self.opinionOnActivities = {"football" : ["I do not like football. I think that it is compleatly mental to kick around a ball all day, while you can spend your time crating real art.", 
-                                                  "I do not have much symphaty with that sport.", "Lets talk about something relevant!"], 
-                                    "tennis" : ["I am not sure yet. I need to try it first.", "It looks like a cool activity. I would like to try it once."], 
-                               "drawing" : ["I love to create art with the pencile.", "It is my faivorit activity.", 
-                                           "With all my hart, i like to paint and draw!"]} 
-        
-        # Response to weather messages.
-        self.weatherOpinion = ["I like all kinds of weather. Any weather can provide an interesting motive for a drawing.", 
-                               "Let the weather be what it is and live with it!", "I can`t complain. It is nice enough for me!"]
-        
     def getBotResponse(self, msgObj):
         """
         This method generates a response to the message provided as argument.
@@ -1121,6 +1373,29 @@ class ArtBot(ChatBot):
             return(random.choice(self.generalResponse))
             
             
+def botResponseTexts():
+    """
+    This function returns all responses in the response tables of the bots. The texts 
+    are used in the preset dictionary of the compressed connections (see chatProtocol). 
+    The bots send the responses with their username in front of the text.
+
+    Returns
+    -------
+    List
+        The responses (strings).
+
+    """
+    texts = []
+    for bot, username in [(ChatBot, "Simple_Chat_Bot"), (WeatherBot, "Weather_Bot"), 
+                          (SportBot, "Sport_Bot"), (ArtBot, "Art_Bot")]:
+        for name, table in sorted(vars(bot).items()):
+            # Each table is a list of responses or a dictionary of lists of responses
+            responses = [text for texts in table.values() for text in texts] if isinstance(table, dict) else table
+            if isinstance(responses, list) and all(type(text) == str for text in responses):
+                texts.extend(f"{username}: {text}" for text in responses)
+    return texts
+
+            
 if __name__ == "__main__":
     # Instantiate an argument parser to handle the commandline arguments and creating a help message.
     parser = argparse.ArgumentParser(description="This program starts all chatbots defined, " + 
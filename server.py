@@ -14,15 +14,44 @@ TCP connections from users, receiving messages from users and
 forwarding them to all other users. It also includes generating 
 messages that initiate conversations.
 
-Three classes:
+The framing of the messages (protocol 1 and 2, compression and the control 
+frames) is defined in the chatProtocol module, which is shared with the client.
+
+Classes:
     HostBot class: This class simulates the host user which contians 
     the list of all possible messages that can be sent to the users. It 
     also contains a method to pick a message from the list. Each 
-    SimpleChatServer object does have one HostBot object.
+    ChatRoom object does have one HostBot object.
     
     ChatSocket class: An object of this class represents a client which 
     is connected to the server. Each SimpleChatServer instance can have 
-    several ChatSocket objects associated.
+    several ChatSocket objects associated. The ConnectionRegistry class 
+    finds the clients by socket, file descriptor, username and address.
+    
+    ChatRoom class: An object of this class is one chat room with its own 
+    members, history and host bot. A client is in one room at a time and 
+    changes room with the /join, /leave and /rooms commands.
+    
+    HistoryBuffer and HistoryLog classes: The chat history of a room, kept 
+    in memory (HistoryBuffer) or on disk (HistoryLog). The HistoryLog is 
+    split into LogSegment files, and a LogRegion is a part of a segment 
+    which is sent to a client with os.sendfile.
+    
+    BroadcastLog, SendQueue and OutboundBuffer classes: The messages of a 
+    room are appended once to the BroadcastLog, and each client reads them 
+    with its own cursor. The SendQueue contains the messages only sent to 
+    one client, and the OutboundBuffer the messages which are being sent.
+    
+    TokenBucket, RateLimiter and AdmissionControl classes: They limit the 
+    rate of the messages of each client and address, and the rate of the 
+    new connections from each address.
+    
+    Timer and TimerWheel classes: The timers of the main loop of the server 
+    (e.g. the host messages, the heartbeats and the pending leave messages).
+    
+    LogFileHandler, LogQueueHandler and LogPayload classes: The log file is 
+    written by a separate thread and rotated by the LogFileHandler. The 
+    LogPayload truncates the received messages written to the log.
     
     SimpleChatServer class: This is the controller class of the server 
     side. It contains methods used to listen to incomming connections 
@@ -30,6 +59,16 @@ Three classes:
     is also implemented a small controll pannel, which can be used to 
     manage the chat thread as an administrator.
     
+    AsyncChatServer class: This class inherits from the SimpleChatServer 
+    class and hosts the same chat thread with an asyncio event loop. It 
+    can also be embedded in other asyncio applications.
+    
+    ShardedChatServer and ShardWorkerServer classes: The sharded server 
+    starts several worker processes which share the port (SO_REUSEPORT). 
+    Each worker serves a part of the connections, and the messages are 
+    broadcast to all workers through the parent process, which puts them 
+    in one order.
+    
 If this file is executed, it instantiates the SimpleChatServer class 
 to create an object which host the chat service. You can specify the port 
 that the server should listen on as an argument. The following line starts 
@@ -37,6 +76,14 @@ a server which is listening on port 2020:
 
 python3 server.py --Port 2020
 
+The asyncio version of the server is started with the --Engine option:
+
+python3 server.py --Port 2020 --Engine asyncio
+
+The sharded server is started with the --Workers option (Linux only):
+
+python3 server.py --Port 2020 --Workers 16
+
 on Windows: python server.py --Port 2020
 
 You can see the help text by adding the --help option:
@@ -47,28 +94,61 @@ The argument \"Port\" is optional. The server has default port 2020. The address
 which the server answers on is any address associated with the network interfaces 
 of the end point this program is running on. 
 
-The server creates a new logfile for each day. The file contains log data with timestamps 
-which describe what the server is doing in what order. Some more detailed error messages are 
-displayed if an error occures. The log files will be saved in the logs folder which is in 
-the same folder as the server.py file. The directory is created by the program if it does 
-not exist. 
+The chat history of each room is stored in the History folder, so the history 
+is kept when the server is restarted. The folder is changed with the --HistoryDir 
+option, and the history is only kept in memory with the --NoHistoryFiles option.
+
+The server writes a logfile with timestamps which describe what the server is doing in 
+what order. Some more detailed error messages are displayed if an error occures. The log 
+file is written by a separate thread. A new file is started each day, and the file is 
+rotated when it is larger than --LogMaxBytes bytes. The rotated files are compressed. Only a sample of the received 
+messages is written to the log (--LogPayloadSample). The log files will be saved in the 
+Logs folder in the directory the server is started from. The directory is created by 
+the program if it does not exist. 
 """
 # Importing the socket module 
 import socket
-import select
-# Importing the module used for logging data to a log file
+# Importing the module used to wait for socket events. The DefaultSelector 
+# uses the most efficient mechanism of the platform (epoll on Linux).
+# https://docs.python.org/3/library/selectors.html
+import selectors
+# Importing the module used for logging data to a log file, and the handlers used 
+# to write the log file from a separate thread
 import logging
+import logging.handlers
+# Importing the modules used to compress the rotated log files
+import gzip
+import shutil
+# Importing the module used to truncate the messages written to the log
+import reprlib
 # Importing a module used to implement and run threads
 import threading
+# Importing the module used to run the asyncio version of the server
+import asyncio
+# Importing the module used to start the worker processes of the sharded server
+import multiprocessing
 # Importing a module which parses arguments and adds help information
 # https://docs.python.org/3/library/argparse.html#const
 import argparse
 # Importing the regex library
 import re
 # Importing a Queue datastructure
-from queue import Queue 
+from queue import Queue, SimpleQueue
+# Importing the double ended queue used as ring buffer for the chat history
+from collections import deque, Counter
+# Importing the module used to search the byte totals of the broadcast log
+import bisect
+# Importing the module used to read a part of the chat history
+import itertools
+# Importing the modules used to write and map the index files of the history log
+import struct
+import mmap
 # Importing the random module used to pick a random message for the host bot
 import random
+# Importing the math module used to round the deadlines of the timers
+import math
+# Importing the heap queue used to find the next tick with timers
+import heapq
 
 # Modules for working with time and dates
 import time
@@ -76,53 +156,1417 @@ from datetime import datetime
 # Module used to create directorys which are missing in the application file structure
 import os
 
+# The framing of the messages, shared with the client module
+from chatProtocol import END_OF_MSG, PROTOCOL_V1, PROTOCOL_V2, PROTOCOL_OFFER, COMPRESSION_OFFER, HISTORY_OFFER, RESUME_OFFER, \
+    ENCODERS, DECODERS, FrameDecoder, FrameType, FrameTooLargeError, StreamCompressor, ackMessage, dictionaryId
+
+try:
+    # The resource module is used to raise the limit of open file descriptors. 
+    # It is only available on Unix platforms.
+    import resource
+except ImportError:
+    resource = None
+
 class ChatSocket:
     """
     Objects of this class represents the clients which are connected to the chat service.
     The SimpleChatServer is dependant on this class.
+    
+    The send queue contains messages (bytes) which are encoded with the protocol of the client.
+    Messages sent to several clients are encoded once for each version of the protocol. 
+    The frameOf() method picks the version used by the client. If the client accepts 
+    compressed data, the messages are compressed with the compressor of the client when 
+    they are sent.
     """
     
-    def __init__(self, socketObj, history):
-        # Attribute containing the rest from the last receive procedure
-        self.recvRest = ""
-        # Attribute contianing the last part of the message which could not be sent to the client
-        self.sendRest = ""
+    def __init__(self, socketObj):
+        # The version of the protocol used with the client. It is changed during the username 
+        # handshake if the client offers a newer version.
+        self.protocol = PROTOCOL_V1
+        # The decoder containing the bytes received from the client which are not a complete message yet
+        self.decoder = FrameDecoder()
+        # The compressor of the data sent to the client. None if the connection is not compressed.
+        self.compressor = None
+        # The number of messages at the start of the send queue which are sent without 
+        # compression (the acknowledgement of the offers of the client)
+        self.plainFrames = 0
+        # The outbound buffer contianing the encoded messages which have been taken from the 
+        # send queue and the broadcast log, but have not been sent to the client yet.
+        self.outbound = OutboundBuffer()
         # The username of the user 
         self.username = ""
-        # The send queue containing messages that should be sent to the user.
-        self.sendQueue = Queue()
+        # The send queue containing messages that should only be sent to this user. 
+        # Messages to all users are read from the broadcast log of the server.
+        self.sendQueue = SendQueue()
+        # The room the user is in. None until the user has joined the chat.
+        self.room = None
+        # The offset of the next message in the broadcast log of the room that should be sent to the user
+        self.cursor = 0
+        # The number of old messages sent when the user enters a room. None means the replay 
+        # window of the server. The client can choose the number in the username message.
+        self.replayMessages = None
+        # The sequence number of the oldest message of the room sent to the user. The next 
+        # page of the history command ends before this message.
+        self.historyBefore = 0
         # The reason why the user is getting removed
         self.kickReason = ""
         # A reference to the client socket object is stored
         self.clientSocket = socketObj
-        
-        for i in range(len(history)):
-            # The existing thread messages are added to the send queue.
-            # This way, the client will receive all the messages that were sent 
-            # in the chat before the client joined the chat.
-            self.sendQueue.put(history[i])
-            
-        # Add the start new messages indication to indicate that the 
-        # next messages are sent after the user connected to the server.
-        self.sendQueue.put("------------[Start new messages]------------")
         # Get the port and destination address of the client
         self.destAddress = socketObj.getpeername()
+        # The file descriptor of the socket. It is stored because it is not available 
+        # after the socket is closed.
+        self.fileno = socketObj.fileno()
         # The time stamp of the last received message
         self.lastRecvTime = datetime.now()
-        # Number of received messages. Used to detect a user which sends too 
-        # many messages (spaming). 
-        self.recvCounter = 0
+        # The time (time.monotonic) data was last received from the client, used to find 
+        # connections which are no longer alive (see SimpleChatServer.checkHeartbeat)
+        self.lastRecvMonotonic = time.monotonic()
+        # The time (time.monotonic) until which the server does not read from the client, 
+        # because the client has sent more messages than the rate limit allows
+        self.throttledUntil = 0
         # This Flag is set if the server encounters problems with receiving 
         # or sending to the client.
         self.isBroken = False
+        # This flag is set when the removal of the client has started. The server 
+        # does then no longer receive data from the client.
+        self.isClosing = False
+        # The events (selectors.EVENT_READ/EVENT_WRITE) the socket is currently 
+        # registered for in the selector of the server. 0 means not registered.
+        self.selectorEvents = 0
+        
+    def frameOf(self, frames):
+        """
+        This method returns the message encoded with the protocol of the client, 
+        from a tuple with the message encoded with each version of the protocol.
+        """
+        return frames[self.protocol - 1]
+        
+        
+class ConnectionRegistry:
+    """
+    This class keeps track of the clients (ChatSocket objects) connected to the server. 
+    The clients are indexed by socket object, file descriptor, username and peer address, 
+    so that adding, removing and finding a client does not depend on the number of 
+    connected clients. Iterating over the registry gives the clients in the order they 
+    connected.
+    
+    Usage:
+        Add a client with add() when the connection is accepted and register the username 
+        with setUsername() when it is known. The client is found with one of the get methods 
+        and removed with remove().
+    """
+    
+    def __init__(self):
+        # The clients indexed by socket object. The dictionary keeps the order of insertion.
+        self.bySocket = {}
+        # The clients indexed by the file descriptor of the socket
+        self.byFileno = {}
+        # The clients indexed by username. Each username maps to a dictionary of clients, 
+        # because several clients can use the same username.
+        self.byUsername = {}
+        # The clients indexed by the address and port of the client
+        self.byAddress = {}
+        
+    def __len__(self):
+        return len(self.bySocket)
+    
+    def __iter__(self):
+        # A snapshot is returned, so that clients can be added and removed while iterating
+        return iter(tuple(self.bySocket.values()))
+    
+    def __contains__(self, curChatUser):
+        return self.bySocket.get(curChatUser.clientSocket) is curChatUser
+    
+    def add(self, curChatUser):
+        """
+        This method adds a client to the registry.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client that should be added.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.bySocket[curChatUser.clientSocket] = curChatUser
+        self.byFileno[curChatUser.fileno] = curChatUser
+        self.byAddress[curChatUser.destAddress] = curChatUser
+        if curChatUser.username != "":
+            self.byUsername.setdefault(curChatUser.username, {})[curChatUser] = None
+            
+    def remove(self, curChatUser):
+        """
+        This method removes a client from the registry. Nothing is done if the client 
+        is not in the registry.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client that should be removed.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.bySocket.get(curChatUser.clientSocket) is not curChatUser:
+            return
+        del self.bySocket[curChatUser.clientSocket]
+        if self.byFileno.get(curChatUser.fileno) is curChatUser:
+            del self.byFileno[curChatUser.fileno]
+        if self.byAddress.get(curChatUser.destAddress) is curChatUser:
+            del self.byAddress[curChatUser.destAddress]
+        self.removeUsername(curChatUser)
+        
+    def setUsername(self, curChatUser, username):
+        """
+        This method sets the username of the client and adds the client to the 
+        username index.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which has identified itself.
+            
+        username : String
+            The username of the client.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.removeUsername(curChatUser)
+        curChatUser.username = username
+        self.byUsername.setdefault(username, {})[curChatUser] = None
+        
+    def removeUsername(self, curChatUser):
+        """
+        This method removes the client from the username index.
+        """
+        users = self.byUsername.get(curChatUser.username)
+        if users is not None and curChatUser in users:
+            del users[curChatUser]
+            if len(users) == 0:
+                del self.byUsername[curChatUser.username]
+                
+    def getBySocket(self, cliSock):
+        """
+        This method returns the client which is using the given socket object, 
+        or None if there is no such client.
+        """
+        return self.bySocket.get(cliSock)
+    
+    def getByFileno(self, fileno):
+        """
+        This method returns the client which is using the given file descriptor, 
+        or None if there is no such client.
+        """
+        return self.byFileno.get(fileno)
+    
+    def getByUsername(self, username):
+        """
+        This method returns the first connected client with the given username, 
+        or None if there is no such client.
+        """
+        users = self.byUsername.get(username)
+        if not users:
+            return None
+        return next(iter(users))
+    
+    def getByAddress(self, address):
+        """
+        This method returns the client connected from the given address and port 
+        tuple, or None if there is no such client.
+        """
+        return self.byAddress.get(address)
+    
+        
+class HistoryBuffer:
+    """
+    This class stores the messages which have been sent in the chat thread. The buffer 
+    has a fixed capacity, given as a maximum number of messages and/or a maximum number 
+    of bytes. When the capacity is exceeded, the oldest messages are discarded. The 
+    messages can be appended and read by different threads. The messages are stored 
+    encoded, as they are sent to the clients.
+    
+    Usage:
+        Instantiate the object with the capacity and call append() for each message. 
+        The replay() method returns the newest messages before a sequence number, limited 
+        by number of messages or by age, which are sent to a client when it joins the 
+        chat or requests older messages. The sequence number of a message is the number 
+        of messages appended before it.
+    """
+    
+    def __init__(self, maxMessages=None, maxBytes=None):
+        # The maximum number of messages (None means no limit)
+        self.maxMessages = maxMessages
+        # The maximum total size of the messages in bytes (None means no limit)
+        self.maxBytes = maxBytes
+        # Each entry is a tuple with the time the message was added, the encoded message and its size in bytes
+        self.entries = deque()
+        # The total size of the stored messages in bytes
+        self.totalBytes = 0
+        # The sequence number the next message appended to the buffer will get
+        self.end = 0
+        # Lock used because the host bot and the main thread can use the buffer at the same time
+        self.lock = threading.Lock()
         
+    def __len__(self):
+        return len(self.entries)
+        
+    def append(self, msg, size=None):
+        """
+        This method adds a message to the buffer and discards the oldest messages if 
+        the capacity is exceeded.
+
+        Parameters
+        ----------
+        msg : bytes
+            The encoded message that should be stored.
+            
+        size : int, optional
+            The size of the message in bytes. The default is None (the length of msg).
+
+        Returns
+        -------
+        None.
+
+        """
+        if size is None:
+            size = len(msg)
+        with self.lock:
+            self.entries.append((time.monotonic(), msg, size))
+            self.totalBytes += size
+            self.end += 1
+            while (self.maxMessages is not None and len(self.entries) > self.maxMessages) or \
+                  (self.maxBytes is not None and self.totalBytes > self.maxBytes):
+                # Remove the oldest message until the buffer is within the capacity
+                self.totalBytes -= self.entries.popleft()[2]
+                
+    def restore(self, messages, end):
+        """
+        This method fills the empty buffer with messages which were stored before 
+        (see HistoryLog.read). The oldest messages are discarded if the capacity is exceeded.
+
+        Parameters
+        ----------
+        messages : List
+            Tuples with the time (time.time) the message was stored, the encoded message 
+            and its size in bytes, from the oldest to the newest.
+            
+        end : int
+            The sequence number after the last message.
+
+        Returns
+        -------
+        None.
+
+        """
+        # The times are converted to the clock of the buffer (time.monotonic)
+        offset = time.monotonic() - time.time()
+        with self.lock:
+            for timestamp, msg, size in messages:
+                self.entries.append((timestamp + offset, msg, size))
+                self.totalBytes += size
+            while (self.maxMessages is not None and len(self.entries) > self.maxMessages) or \
+                  (self.maxBytes is not None and self.totalBytes > self.maxBytes):
+                # Remove the oldest message until the buffer is within the capacity
+                self.totalBytes -= self.entries.popleft()[2]
+            self.end = end
+                
+    def replay(self, maxMessages=None, maxSeconds=None, before=None):
+        """
+        This method returns the newest messages in the buffer before the given sequence 
+        number, in the order they were added. The number of messages can be limited by 
+        count and by age.
+
+        Parameters
+        ----------
+        maxMessages : int, optional
+            The maximum number of messages returned. The default is None (no limit).
+            
+        maxSeconds : float, optional
+            Only messages added within the last maxSeconds seconds are returned. 
+            The default is None (no limit).
+            
+        before : int, optional
+            Only messages with a lower sequence number are returned. The default is 
+            None (the end of the buffer).
+
+        Returns
+        -------
+        List, int
+            A list of the encoded messages and the sequence number of the first message.
+
+        """
+        window = []
+        # Messages older than this timestamp are not returned
+        oldest = time.monotonic() - maxSeconds if maxSeconds is not None else None
+        with self.lock:
+            before = self.end if before is None else min(before, self.end)
+            # The number of newer messages which are skipped
+            skip = self.end - before
+            for timestamp, msg, size in itertools.islice(reversed(self.entries), skip, None):
+                # Read the messages from the newest to the oldest
+                if (maxMessages is not None and len(window) >= maxMessages) or \
+                   (oldest is not None and timestamp < oldest):
+                    break
+                window.append(msg)
+        window.reverse()
+        return window, before - len(window)
+    
+        
+class LogRegion:
+    """
+    This class is a part of a segment file of the HistoryLog, containing one or more 
+    whole records. A region is put in the send queue of a client instead of the 
+    messages, so the messages are sent from the file to the socket with os.sendfile 
+    without being copied through Python (see OutboundBuffer.flush). The region keeps 
+    a reference to the file, so the file stays open until the region is sent, even 
+    if the segment has been deleted.
+    """
+    
+    def __init__(self, dataFile, position, size):
+        # The data file of the segment (unbuffered file object)
+        self.dataFile = dataFile
+        # The position of the first record in the file and the size of the region in bytes
+        self.position = position
+        self.size = size
+        
+    def __len__(self):
+        return self.size
+    
+    def fileno(self):
+        return self.dataFile.fileno()
+    
+    def read(self):
+        """
+        This method returns the content of the region as bytes.
+        """
+        if hasattr(os, "pread"):
+            return os.pread(self.fileno(), self.size, self.position)
+        # os.pread is not available on Windows. The file is opened in append mode, 
+        # so moving the position does not change where the records are written.
+        self.dataFile.seek(self.position)
+        return self.dataFile.read(self.size)
+    
+    
+class LogSegment:
+    """
+    This class is one segment of the HistoryLog. The records are appended to a data 
+    file (<first sequence number>.log), and the position, size and time of each record 
+    are written to a fixed size index file (<first sequence number>.idx), which is 
+    memory-mapped. The index is allocated for SEGMENT_MESSAGES entries when the segment 
+    is created, and the unused entries are zero.
+    
+    When a segment is opened, the number of records is found with a binary search in 
+    the index, so opening a segment does not read the data file. Entries whose record 
+    is not complete in the data file (the server stopped between the two writes) are 
+    removed, and the data file is truncated after the last complete record.
+    """
+    # The number of records in one segment
+    SEGMENT_MESSAGES = 1024
+    # An entry of the index: the position and the size of the record in the data file, 
+    # and the time (time.time) the record was appended
+    INDEX_ENTRY = struct.Struct("!IId")
+    
+    def __init__(self, directory, base):
+        # The sequence number of the first record in the segment
+        self.base = base
+        self.dataPath = os.path.join(directory, f"{base:020d}.log")
+        self.indexPath = os.path.join(directory, f"{base:020d}.idx")
+        
+        with open(self.indexPath, "ab+") as indexFile:
+            # The index file is allocated for all entries and mapped to memory
+            indexSize = self.SEGMENT_MESSAGES * self.INDEX_ENTRY.size
+            if os.path.getsize(self.indexPath) != indexSize:
+                indexFile.truncate(indexSize)
+            self.index = mmap.mmap(indexFile.fileno(), indexSize)
+        # The data file is opened without buffering, so each record is written with one system call
+        self.dataFile = open(self.dataPath, "ab+", buffering=0)
+        
+        dataSize = os.fstat(self.dataFile.fileno()).st_size
+        # Find the number of complete records. The complete records are always a prefix of the index.
+        low, high = 0, self.SEGMENT_MESSAGES
+        while low < high:
+            middle = (low + high) // 2
+            position, size, timestamp = self.INDEX_ENTRY.unpack_from(self.index, middle * self.INDEX_ENTRY.size)
+            if size != 0 and position + size <= dataSize:
+                low = middle + 1
+            else:
+                high = middle
+        # The number of records in the segment
+        self.count = low
+        # The number of bytes of the complete records
+        self.size = self.entry(self.count - 1)[0] + self.entry(self.count - 1)[1] if self.count > 0 else 0
+        
+        if self.size != dataSize:
+            # Remove the rest of a record which was not completed
+            self.dataFile.truncate(self.size)
+        end = self.count * self.INDEX_ENTRY.size
+        if self.count < self.SEGMENT_MESSAGES and self.index[end:end + self.INDEX_ENTRY.size] != bytes(self.INDEX_ENTRY.size):
+            # Remove the entries of records which were not written to the data file
+            self.index[end:] = bytes(len(self.index) - end)
+            
+    def __len__(self):
+        return self.count
+    
+    @property
+    def isFull(self):
+        return self.count == self.SEGMENT_MESSAGES
+    
+    def entry(self, number):
+        """
+        This method returns the index entry (position, size, time) of the given record 
+        (counted from the start of the segment).
+        """
+        return self.INDEX_ENTRY.unpack_from(self.index, number * self.INDEX_ENTRY.size)
+    
+    def append(self, record, timestamp):
+        """
+        This method writes the record to the data file and then adds its entry to the index.
+        """
+        self.dataFile.write(record)
+        self.INDEX_ENTRY.pack_into(self.index, self.count * self.INDEX_ENTRY.size, self.size, len(record), timestamp)
+        self.count += 1
+        self.size += len(record)
+        
+    def firstAfter(self, timestamp):
+        """
+        This method returns the number of the first record appended at or after the given time.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[2] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def region(self, first, stop):
+        """
+        This method returns the records from number first up to number stop (not included) as a LogRegion.
+        """
+        position = self.entry(first)[0]
+        return LogRegion(self.dataFile, position, self.entry(stop - 1)[0] + self.entry(stop - 1)[1] - position)
+    
+    @classmethod
+    def readRecords(cls, directory, base):
+        """
+        This method reads the complete records of the segment with the given first 
+        sequence number. The files are only read, so the segment is not repaired.
+
+        Returns
+        -------
+        List
+            Tuples with the time the record was appended and the record (bytes).
+
+        """
+        with open(os.path.join(directory, f"{base:020d}.idx"), "rb") as indexFile:
+            index = indexFile.read()
+        with open(os.path.join(directory, f"{base:020d}.log"), "rb") as dataFile:
+            data = dataFile.read()
+        records = []
+        for number in range(len(index) // cls.INDEX_ENTRY.size):
+            position, size, timestamp = cls.INDEX_ENTRY.unpack_from(index, number * cls.INDEX_ENTRY.size)
+            if size == 0 or position + size > len(data):
+                # The end of the complete records
+                break
+            records.append((timestamp, data[position:position + size]))
+        return records
+    
+    def delete(self):
+        """
+        This method removes the files of the segment. The data file is not closed, because 
+        it can still be used by a LogRegion. It is closed when it is no longer referenced.
+        """
+        self.index.close()
+        os.remove(self.indexPath)
+        os.remove(self.dataPath)
+        
+        
+class HistoryLog:
+    """
+    This class stores the chat history of a room on disk, so the history is kept when 
+    the server is restarted. It has the same methods as the HistoryBuffer. The messages 
+    are appended to a log, which is split into segments (LogSegment) of SEGMENT_MESSAGES 
+    messages. Each message is stored as a protocol 2 frame, with the sequence number of 
+    the message. When the capacity is exceeded, the oldest segment is deleted, so the 
+    log keeps at least the given capacity.
+    
+    When the server is started, the segments in the directory are opened. Only the 
+    memory-mapped indexes are used to find the messages, so no file is read into memory. 
+    The replay() method returns regions of the segment files (LogRegion), which are 
+    sent to the clients with os.sendfile where the framing allows (see 
+    SimpleChatServer.replayFrames).
+    
+    The files are not synchronized to the disk (fsync) after each message. The messages 
+    are kept if the server process stops, but the newest messages can be lost if the 
+    operating system stops.
+    """
+    
+    def __init__(self, directory, maxMessages=None, maxBytes=None):
+        # The directory of the segment files
+        self.directory = directory
+        # The capacity of the log. The oldest segment is deleted when the other segments 
+        # contain maxMessages messages or maxBytes bytes (None means no limit).
+        self.maxMessages = maxMessages
+        self.maxBytes = maxBytes
+        # Lock used because the host bot and the main thread can use the log at the same time
+        self.lock = threading.Lock()
+        
+        os.makedirs(directory, exist_ok=True)
+        # The segments from the oldest to the newest
+        self.segments = [LogSegment(directory, int(name[:-len(".log")])) 
+                         for name in sorted(os.listdir(directory)) if re.search("^[0-9]{20}[.]log$", name)]
+        if len(self.segments) == 0:
+            self.segments.append(LogSegment(directory, 0))
+            
+    def __len__(self):
+        return self.end - self.segments[0].base
+    
+    @property
+    def end(self):
+        """
+        The sequence number the next message appended to the log will get.
+        """
+        return self.segments[-1].base + len(self.segments[-1])
+    
+    @property
+    def totalBytes(self):
+        return sum(segment.size for segment in self.segments)
+    
+    @staticmethod
+    def read(directory):
+        """
+        This method reads the messages stored in the given directory without opening 
+        the log, so the files are not changed. It is used by the shard workers which 
+        keep the history in memory (see ShardWorkerServer).
+
+        Returns
+        -------
+        List, int
+            Tuples with the time (time.time) each message was stored and the protocol 2 
+            frame, from the oldest to the newest, and the sequence number after the last message.
+
+        """
+        records, end = [], 0
+        if not os.path.isdir(directory):
+            return records, end
+        for name in sorted(os.listdir(directory)):
+            if re.search("^[0-9]{20}[.]log$", name):
+                base = int(name[:-len(".log")])
+                segmentRecords = LogSegment.readRecords(directory, base)
+                records.extend(segmentRecords)
+                end = base + len(segmentRecords)
+        return records, end
+    
+    def append(self, msg, size=None):
+        """
+        This method adds a message to the log and deletes the oldest segment if the 
+        capacity is exceeded.
+
+        Parameters
+        ----------
+        msg : tuple
+            The message encoded with each version of the protocol (see 
+            SimpleChatServer.frameMessage). The protocol 2 frame is stored.
+            
+        size : int, optional
+            Not used. The size of the stored frame is used.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            if self.segments[-1].isFull:
+                self.segments.append(LogSegment(self.directory, self.end))
+            self.segments[-1].append(msg[PROTOCOL_V2 - 1], time.time())
+            
+            while len(self.segments) > 1 and \
+                  ((self.maxMessages is not None and self.end - self.segments[1].base >= self.maxMessages) or 
+                   (self.maxBytes is not None and self.totalBytes - self.segments[0].size >= self.maxBytes)):
+                # The other segments contain the capacity of the log
+                self.segments.pop(0).delete()
+                
+    def replay(self, maxMessages=None, maxSeconds=None, before=None):
+        """
+        This method returns the newest messages in the log before the given sequence 
+        number, in the order they were added. The number of messages can be limited 
+        by count and by age.
+
+        Parameters
+        ----------
+        maxMessages : int, optional
+            The maximum number of messages returned. The default is None (no limit).
+            
+        maxSeconds : float, optional
+            Only messages added within the last maxSeconds seconds are returned. 
+            The default is None (no limit).
+            
+        before : int, optional
+            Only messages with a lower sequence number are returned. The default is 
+            None (the end of the log).
+
+        Returns
+        -------
+        List, int
+            A list of LogRegion objects containing the messages, one for each segment, 
+            and the sequence number of the first message.
+
+        """
+        regions = []
+        # Messages older than this timestamp are not returned
+        oldest = time.time() - maxSeconds if maxSeconds is not None else None
+        with self.lock:
+            before = self.end if before is None else min(before, self.end)
+            first = self.segments[0].base
+            if maxMessages is not None:
+                first = max(first, before - maxMessages)
+            for segment in self.segments:
+                start = max(first - segment.base, 0)
+                stop = min(before - segment.base, len(segment))
+                if oldest is not None:
+                    start = max(start, segment.firstAfter(oldest))
+                if start < stop:
+                    if len(regions) == 0:
+                        first = segment.base + start
+                    regions.append(segment.region(start, stop))
+        return regions, first if len(regions) != 0 else before
+    
+    
+class BroadcastLog:
+    """
+    This class is a shared, append-only log of the messages which are broadcast to the 
+    connected clients. Each message gets an offset (its position in the log). Instead of 
+    having a copy of each message in its own queue, each client keeps a cursor, which is 
+    the offset of the next message the client should receive. A slow client simply lags 
+    behind with its cursor. The messages that all clients have received are removed with 
+    the trim() method. The log also keeps the total number of bytes appended, so the 
+    number of bytes a client lags behind can be found without walking the entries.
+    """
+    
+    def __init__(self, offset=0):
+        # The entries of the log. Each entry is a tuple with the encoded message and the 
+        # socket of the client which sent the message (None for the host).
+        self.entries = []
+        # The offset of the first entry in the entries list. It is the end of the 
+        # history log when the history is kept on disk, so the sequence numbers 
+        # continue after a restart.
+        self.offset = offset
+        # The total number of bytes appended to the log at the end of each entry
+        self.byteEnds = []
+        # The total number of bytes of the entries which have been trimmed
+        self.trimmedBytes = 0
+        # Lock used because the host bot and the main thread can append at the same time. 
+        # The server holds the lock while a message is encoded, so the sequence number of 
+        # the message is its offset in the log.
+        self.lock = threading.RLock()
+        
+    def __len__(self):
+        return len(self.entries)
+    
+    @property
+    def end(self):
+        """
+        The offset the next message appended to the log will get.
+        """
+        return self.offset + len(self.entries)
+        
+    def append(self, msg, origin, size=None):
+        """
+        This method appends a message to the log.
+
+        Parameters
+        ----------
+        msg : bytes
+            The encoded message that should be broadcast. The same bytes object 
+            is sent to all clients.
+            
+        origin : Socket object
+            The socket of the client which sent the message. The client does not 
+            receive its own message. None if the message should be sent to all clients.
+            
+        size : int, optional
+            The size of the message in bytes. The default is None (the length of msg).
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            self.entries.append((msg, origin))
+            self.byteEnds.append(self.totalBytes + (len(msg) if size is None else size))
+            
+    @property
+    def totalBytes(self):
+        """
+        The total number of bytes appended to the log.
+        """
+        return self.byteEnds[-1] if self.byteEnds else self.trimmedBytes
+    
+    def bytesAfter(self, cursor):
+        """
+        This method returns the number of bytes from the given offset to the end of the log.
+
+        Parameters
+        ----------
+        cursor : int
+            The offset of a client in the log.
+
+        Returns
+        -------
+        int
+            The number of bytes the client has not received yet.
+
+        """
+        with self.lock:
+            index = cursor - self.offset
+            before = self.byteEnds[index - 1] if index > 0 else self.trimmedBytes
+            return self.totalBytes - before
+        
+    def cursorForBytes(self, maxBytes):
+        """
+        This method returns the lowest offset where at most maxBytes bytes are left 
+        to the end of the log.
+
+        Parameters
+        ----------
+        maxBytes : int
+            The maximum number of bytes after the returned offset.
+
+        Returns
+        -------
+        int
+            The offset in the log.
+
+        """
+        with self.lock:
+            target = self.totalBytes - maxBytes
+            if target <= self.trimmedBytes:
+                return self.offset
+            return self.offset + bisect.bisect_left(self.byteEnds, target) + 1
+            
+    def read(self, cursor, maxEntries=None):
+        """
+        This method returns the entries from the given offset to the end of the log.
+
+        Parameters
+        ----------
+        cursor : int
+            The offset of the first entry that should be returned.
+            
+        maxEntries : int, optional
+            The maximum number of entries returned. The default is None (no limit).
+
+        Returns
+        -------
+        List, int
+            The list of entries (message, origin) and the offset of the first returned entry.
+
+        """
+        with self.lock:
+            # Entries which have been trimmed are skipped
+            start = max(cursor - self.offset, 0)
+            stop = None if maxEntries is None else start + maxEntries
+            return self.entries[start:stop], self.offset + start
+        
+    def trim(self, cursor):
+        """
+        This method removes all entries before the given offset.
+
+        Parameters
+        ----------
+        cursor : int
+            The lowest cursor of the connected clients.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            count = min(cursor - self.offset, len(self.entries))
+            if count > 0:
+                self.trimmedBytes = self.byteEnds[count - 1]
+                del self.entries[:count]
+                del self.byteEnds[:count]
+                self.offset += count
+    
+        
+class SendQueue(Queue):
+    """
+    This class is the queue of the messages which are only sent to one client (e.g. 
+    the replayed history and the replies of the host). It keeps the total size of the 
+    queued messages, which is counted in the backlog limits of the client (see 
+    SimpleChatServer.checkSlowConsumer).
+    """
+    
+    def _init(self, maxsize):
+        Queue._init(self, maxsize)
+        # The total size of the queued messages in bytes
+        self.bytes = 0
+        
+    def _put(self, item):
+        Queue._put(self, item)
+        self.bytes += len(item)
+        
+    def _get(self):
+        item = Queue._get(self)
+        self.bytes -= len(item)
+        return item
+    
+        
+class OutboundBuffer:
+    """
+    This class is the outbound buffer of one client connection. It contains the encoded 
+    messages which have been taken from the send queue and the broadcast log of the server, 
+    but have not been sent yet. The messages are stored by reference, so the bytes objects 
+    shared by all clients are not copied. The number of bytes of the first buffer which 
+    have already been sent is stored as an offset, and the rest is sent through a 
+    memoryview, so a partial send never copies the remaining bytes. The buffer can also 
+    contain regions of the history log files (LogRegion), which are sent with os.sendfile.
+    
+    The buffer has a high and a low watermark. When the size of the buffer reaches the 
+    high watermark, the buffer is paused and the server stops moving messages into it 
+    (the client lags behind in the broadcast log instead). The buffer is resumed when 
+    the size has fallen to the low watermark.
+    """
+    # The size (bytes) at which the buffer is paused
+    HIGH_WATERMARK = 256*1024
+    # The size (bytes) at which a paused buffer is resumed
+    LOW_WATERMARK = 64*1024
+    
+    def __init__(self):
+        # The buffers which have not been sent completely
+        self.buffers = deque()
+        # The number of bytes of the first buffer which have already been sent
+        self.offset = 0
+        # The number of bytes which have not been sent
+        self.size = 0
+        # This flag is set while the size is above the watermarks (see class description)
+        self.isPaused = False
+        
+    def __len__(self):
+        return self.size
+    
+    def append(self, data):
+        """
+        This method adds a bytes-like object at the end of the buffer. The object must not 
+        be changed until it has been sent.
+
+        Parameters
+        ----------
+        data : bytes
+            The data that should be sent.
+
+        Returns
+        -------
+        None.
+
+        """
+        if len(data) == 0:
+            return
+        self.buffers.append(data)
+        self.size += len(data)
+        if self.size >= self.HIGH_WATERMARK:
+            self.isPaused = True
+            
+    def flush(self, cliSock, budget, maxBuffers):
+        """
+        This method sends the data at the start of the buffer to the socket with one 
+        system call. The sendmsg method (scatter/gather) is used where it is available. 
+        On other platforms, the buffers are joined and sent with send. A LogRegion is 
+        sent alone with os.sendfile. The sent bytes are removed from the buffer. 
+        BlockingIOError and other OSErrors raised by the socket are passed on to the caller.
+
+        Parameters
+        ----------
+        cliSock : Socket object
+            The socket the data should be sent to.
+            
+        budget : int
+            The number of bytes that should be sent at most. At least one buffer is 
+            gathered, even if it is larger than the budget.
+            
+        maxBuffers : int
+            The maximum number of buffers gathered in one system call.
+
+        Returns
+        -------
+        int, int
+            The number of bytes sent and the number of bytes that were gathered. If less 
+            bytes were sent than gathered, the outbound buffer of the socket is full.
+
+        """
+        if isinstance(self.buffers[0], LogRegion):
+            # The region is sent from the file to the socket, without copying it through Python
+            region = self.buffers[0]
+            gathered = min(len(region) - self.offset, max(budget, 1))
+            sentBytes = os.sendfile(cliSock.fileno(), region.fileno(), region.position + self.offset, gathered)
+            self.consume(sentBytes)
+            return sentBytes, gathered
+        
+        views = []
+        gathered = 0
+        for buf in self.buffers:
+            if isinstance(buf, LogRegion):
+                # The region is sent with the next call
+                break
+            if len(views) == 0 and self.offset != 0:
+                # Only the rest of the first buffer is sent
+                buf = memoryview(buf)[self.offset:]
+            if len(views) == maxBuffers or (len(views) > 0 and gathered + len(buf) > budget):
+                break
+            views.append(buf)
+            gathered += len(buf)
+            
+        if hasattr(cliSock, "sendmsg"):
+            sentBytes = cliSock.sendmsg(views)
+        else:
+            sentBytes = cliSock.send(b"".join(views))
+        self.consume(sentBytes)
+        return sentBytes, gathered
+    
+    def consume(self, count):
+        """
+        This method removes the given number of bytes from the start of the buffer.
+        """
+        self.size -= count
+        while count > 0:
+            # The number of bytes of the first buffer which are not sent
+            remaining = len(self.buffers[0]) - self.offset
+            if count >= remaining:
+                # The first buffer is sent completely
+                self.buffers.popleft()
+                self.offset = 0
+                count -= remaining
+            else:
+                # The first buffer is partially sent. Store where the next send should start.
+                self.offset += count
+                count = 0
+                
+        if self.isPaused and self.size <= self.LOW_WATERMARK:
+            self.isPaused = False
+    
+
+class TokenBucket:
+    """
+    This class is a token bucket used to limit the rate of the messages received from 
+    a client. The bucket holds at most burst tokens and is refilled with rate tokens per 
+    second. Each message takes one token. A client may therefore send burst messages at 
+    once, and rate messages per second on average. The time is read from the monotonic 
+    clock, so changes of the system clock do not affect the limit.
+    """
+    
+    def __init__(self, rate, burst):
+        # The number of tokens added per second and the capacity of the bucket
+        self.rate = rate
+        self.burst = burst
+        # The number of tokens in the bucket. It is negative if more messages than 
+        # allowed have been taken.
+        self.tokens = burst
+        # The time (time.monotonic) the bucket was refilled last
+        self.lastRefill = time.monotonic()
+        
+    def refill(self, now):
+        """
+        This method adds the tokens for the time since the last refill.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.lastRefill) * self.rate)
+        self.lastRefill = now
+        
+    def consume(self, count, now):
+        """
+        This method takes the given number of tokens from the bucket, also if there 
+        are not enough tokens.
+
+        Parameters
+        ----------
+        count : int
+            The number of messages received.
+            
+        now : float
+            The current time (time.monotonic).
+
+        Returns
+        -------
+        float
+            The number of seconds until the bucket is no longer empty. 0 if the 
+            messages were within the limit.
+
+        """
+        self.refill(now)
+        self.tokens -= count
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    def isFull(self, now):
+        """
+        This method returns True if the bucket would be full after a refill.
+        """
+        return self.tokens + (now - self.lastRefill) * self.rate >= self.burst
+    
+
+class RateLimiter:
+    """
+    This class limits the rate of the messages received by the server. Each client 
+    has a token bucket, and all clients connected from the same address share another 
+    token bucket, so a user can not avoid the limit by opening several connections. 
+    The limits of a user can be overridden by username (see setOverride), which also 
+    exempts the user from the limits of the address. The bucket of an address is 
+    removed when the last client from the address is removed, if the bucket is full. 
+    Otherwise it is kept, so a client which reconnects does not get a full bucket.
+    """
+    
+    def __init__(self, rate, burst, addressRate, addressBurst, overrides=None):
+        # The default limits (messages per second, burst) of a user and of an address
+        self.userLimits = (rate, burst)
+        self.addressLimits = (addressRate, addressBurst)
+        # The limits of users with other limits than the default, by username
+        self.overrides = dict(overrides) if overrides else {}
+        # The bucket of each client (ChatSocket object)
+        self.userBuckets = {}
+        # The bucket of each address (IP address string)
+        self.addressBuckets = {}
+        # The number of clients with a bucket from each address
+        self.addressUsers = Counter()
+        
+    def setOverride(self, username, rate, burst):
+        """
+        This method sets the limits of the user with the given username. The limits are 
+        used for the next messages from the user, also if the user is already connected.
+        """
+        self.overrides[username] = (rate, burst)
+        
+    def consume(self, curChatUser, count):
+        """
+        This method takes the tokens for the given number of messages from the bucket of 
+        the client and the bucket of the address of the client.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which sent the messages.
+            
+        count : int
+            The number of messages received.
+
+        Returns
+        -------
+        float
+            The number of seconds the client has to wait to be within both limits again. 
+            0 if the messages were within the limits.
+
+        """
+        now = time.monotonic()
+        bucket = self.userBuckets.get(curChatUser)
+        if bucket is None:
+            bucket = self.userBuckets[curChatUser] = TokenBucket(*self.userLimits)
+            self.addressUsers[curChatUser.destAddress[0]] += 1
+        if curChatUser.username in self.overrides:
+            # The override is applied when the username is known. The user is not limited 
+            # by the limits of the address.
+            bucket.rate, bucket.burst = self.overrides[curChatUser.username]
+            return bucket.consume(count, now)
+        
+        address = curChatUser.destAddress[0]
+        addressBucket = self.addressBuckets.get(address)
+        if addressBucket is None:
+            addressBucket = self.addressBuckets[address] = TokenBucket(*self.addressLimits)
+        return max(bucket.consume(count, now), addressBucket.consume(count, now))
+    
+    def remove(self, curChatUser):
+        """
+        This method removes the bucket of the given client, and the bucket of its 
+        address if no other client from the address is connected and the bucket is full.
+        """
+        if self.userBuckets.pop(curChatUser, None) is None:
+            # The client has not sent any messages
+            return
+        address = curChatUser.destAddress[0]
+        self.addressUsers[address] -= 1
+        if self.addressUsers[address] == 0:
+            del self.addressUsers[address]
+            if self.addressBuckets[address].isFull(time.monotonic()):
+                del self.addressBuckets[address]
+    
+        
+class AdmissionControl:
+    """
+    This class limits the rate of the new connections from each address, so a storm of 
+    reconnecting clients is spread out over time instead of overflowing the listen backlog. 
+    Each address has a token bucket, and each connection takes one token. A connection 
+    which exceeds the limit is not refused. It is served when the bucket of the address 
+    has a token again, so the connections from a busy address are admitted one at a time 
+    at the rate of the bucket. A connection which would have to wait more than maxDelay 
+    seconds is refused. The buckets which are full are removed every PRUNE_INTERVAL seconds.
+    """
+    # The number of seconds between the removals of the full buckets
+    PRUNE_INTERVAL = 60
+    
+    def __init__(self, rate, burst, maxDelay):
+        # The limits (connections per second, burst) of an address, and the maximum 
+        # number of seconds a connection waits to be admitted
+        self.limits = (rate, burst)
+        self.maxDelay = maxDelay
+        # The bucket of each address (IP address string)
+        self.buckets = {}
+        # The time (time.monotonic) of the next removal of the full buckets
+        self.nextPrune = time.monotonic() + self.PRUNE_INTERVAL
+        
+    def admit(self, address):
+        """
+        This method takes a token from the bucket of the given address for a new connection.
+
+        Parameters
+        ----------
+        address : String
+            The IP address of the client.
+
+        Returns
+        -------
+        float or None
+            The number of seconds until the connection should be served (0 if it is within 
+            the limit), or None if the connection should be refused.
+
+        """
+        now = time.monotonic()
+        if now >= self.nextPrune:
+            # Forget the addresses which have not connected for a while
+            self.buckets = {key : bucket for key, bucket in self.buckets.items() if not bucket.isFull(now)}
+            self.nextPrune = now + self.PRUNE_INTERVAL
+        bucket = self.buckets.get(address)
+        if bucket is None:
+            bucket = self.buckets[address] = TokenBucket(*self.limits)
+        delay = bucket.consume(1, now)
+        if delay > self.maxDelay:
+            # The token is given back, so the refused connection does not delay the next ones
+            bucket.tokens += 1
+            return None
+        return delay
+    
+        
+class Timer:
+    """
+    Objects of this class are the timers of a TimerWheel. The callback of the timer 
+    is called with the given arguments when the timer expires, unless the timer has 
+    been cancelled. The cancel method has the same name as in asyncio.TimerHandle, so 
+    the servers can use the timers of both engines in the same way.
+    """
+    __slots__ = ("wheel", "tick", "callback", "args", "cancelled")
+    
+    def __init__(self, wheel, tick, callback, args):
+        # The wheel of the timer and the tick the timer expires
+        self.wheel = wheel
+        self.tick = tick
+        # The function called when the timer expires and its arguments
+        self.callback = callback
+        self.args = args
+        # The flag is set when the timer has been cancelled or has expired
+        self.cancelled = False
+        
+    def cancel(self):
+        """
+        This method cancels the timer. Nothing is done if the timer has already expired.
+        """
+        if not self.cancelled:
+            self.cancelled = True
+            self.wheel.release(self.tick)
+            
+            
+class TimerWheel:
+    """
+    This class is a hashed timer wheel, which keeps the timers of the main loop of 
+    the server (e.g. the host messages of the rooms, the pending leave messages and 
+    the throttled clients). The time is divided into ticks of TICK seconds, and a 
+    timer is stored in the slot of the tick it expires (the tick modulo SLOTS). A 
+    timer more than one revolution ahead stays in its slot until its revolution comes.
+    
+    Scheduling and cancelling a timer take constant time, and each tick only visits 
+    one slot, so the cost does not depend on the number of timers. A cancelled timer 
+    is removed from its slot when the slot is visited. The ticks with active timers 
+    are kept in a heap, so the next tick is found in logarithmic time. The wheel is not thread safe, 
+    so it must only be used by the thread running the main loop.
+    
+    Usage:
+        The main loop waits at most timeout() seconds for socket events, and then 
+        calls run() to call the callbacks of the expired timers.
+    """
+    # The length of a tick (seconds) and the number of slots of the wheel
+    TICK = 0.05
+    SLOTS = 1024
+    
+    def __init__(self, tick=TICK, slots=SLOTS):
+        self.tick = tick
+        # The timers by slot. Each slot is a list of timers.
+        self.slots = [[] for i in range(slots)]
+        # The next tick to be visited
+        self.currentTick = int(time.monotonic() / tick)
+        # A tick which is not later than the first tick with an active timer. It is the first 
+        # tick with an active timer unless that timer has been cancelled.
+        self.nextTick = self.currentTick
+        # The number of active timers
+        self.count = 0
+        # The number of active timers of each tick which has timers, and a heap of these 
+        # ticks. A tick whose timers have expired or have been cancelled stays in the 
+        # heap until it reaches the top (see findNextTick).
+        self.tickCounts = {}
+        self.tickHeap = []
+        
+    def __len__(self):
+        return self.count
+    
+    def schedule(self, delay, callback, *args):
+        """
+        This method adds a timer which calls the given callback with the given 
+        arguments after the given number of seconds.
+
+        Parameters
+        ----------
+        delay : float
+            The number of seconds until the timer expires.
+            
+        callback : callable
+            The function called when the timer expires.
+
+        Returns
+        -------
+        Timer
+            The timer, which can be cancelled.
+
+        """
+        # The timer expires at the end of the tick of the deadline, and not before the next tick visited
+        tick = max(math.ceil((time.monotonic() + delay) / self.tick), self.currentTick)
+        timer = Timer(self, tick, callback, args)
+        self.slots[tick % len(self.slots)].append(timer)
+        self.count += 1
+        if tick not in self.tickCounts:
+            self.tickCounts[tick] = 0
+            heapq.heappush(self.tickHeap, tick)
+        self.tickCounts[tick] += 1
+        # The next tick of an empty wheel is the current tick
+        self.nextTick = min(self.nextTick, tick) if self.count > 1 else tick
+        return timer
+    
+    def release(self, tick):
+        """
+        This method is called by a timer of the given tick which has expired or has been cancelled.
+        """
+        self.count -= 1
+        self.tickCounts[tick] -= 1
+        if self.tickCounts[tick] == 0:
+            del self.tickCounts[tick]
+    
+    def timeout(self):
+        """
+        This method returns the number of seconds until the first timer expires, or 
+        None if there are no timers.
+        """
+        if self.count == 0:
+            return None
+        # A millisecond is added, so the rounding of the time does not wake up the main loop before the tick
+        return max(0, self.nextTick * self.tick - time.monotonic()) + 0.001
+    
+    def run(self):
+        """
+        This method calls the callbacks of the timers which have expired. The callbacks 
+        may schedule new timers.
+
+        Returns
+        -------
+        None.
+
+        """
+        nowTick = int(time.monotonic() / self.tick)
+        while self.count != 0 and self.currentTick <= nowTick:
+            if self.nextTick > self.currentTick:
+                # Skip the ticks without timers
+                self.currentTick = min(self.nextTick, nowTick + 1)
+                continue
+            tick = self.currentTick
+            # New timers scheduled by the callbacks are put in the following ticks
+            self.currentTick += 1
+            slot = self.slots[tick % len(self.slots)]
+            expired = [timer for timer in slot if timer.tick <= tick]
+            if len(expired) != 0:
+                # The timers of the later revolutions stay in the slot
+                slot[:] = [timer for timer in slot if timer.tick > tick]
+            for timer in expired:
+                if not timer.cancelled:
+                    timer.cancel()
+                    timer.callback(*timer.args)
+            self.findNextTick()
+        if self.count == 0:
+            # The wheel is empty, so the ticks until now do not have to be visited
+            self.currentTick = max(self.currentTick, nowTick + 1)
+            self.nextTick = self.currentTick
+            
+    def findNextTick(self):
+        """
+        This method finds the first tick with an active timer. The ticks without active 
+        timers are removed from the top of the heap.
+        """
+        while len(self.tickHeap) != 0 and self.tickHeap[0] not in self.tickCounts:
+            heapq.heappop(self.tickHeap)
+        self.nextTick = self.tickHeap[0] if len(self.tickHeap) != 0 else self.currentTick
+        
+        
+class ChatRoom:
+    """
+    This class is one chat room of the server. Each room has its own members, chat 
+    history and broadcast log, so a message is only handled for the members of the 
+    room, and the cost of sending a message depends on the size of the room and not 
+    on the number of connected clients. Each room has its own host bot, which sends 
+    messages on its own schedule while the room has members (see 
+    SimpleChatServer.startHostTimer).
+    """
+    
+    def __init__(self, name, historySize=None, historyBytes=None, historyDir=None):
+        # The name of the room, used in the /join command
+        self.name = name
+        if historyDir is None:
+            # The messages which were sent in the room, limited by the capacity of the buffer
+            self.history = HistoryBuffer(historySize, historyBytes)
+            # The log of the messages broadcast to the members. Each member has a cursor in the log.
+            self.broadcastLog = BroadcastLog()
+        else:
+            # The history is kept on disk, in a directory named after the room. The sequence 
+            # numbers of the broadcast log continue after the last message in the history.
+            self.history = HistoryLog(os.path.join(historyDir, name), historySize, historyBytes)
+            self.broadcastLog = BroadcastLog(self.history.end)
+        # The length of the broadcast log at which the log should be trimmed next time
+        self.nextLogTrim = 0
+        # The members which have received all messages in the broadcast log. They are notified 
+        # when a new message is added. The dictionary is used as an ordered set (the values are not used).
+        self.logWaiters = {}
+        # The clients in the room. The dictionary is used as an ordered set (the values are not used).
+        self.members = {}
+        # The host bot of the room (created when the first host message is sent), the 
+        # time (time.monotonic) of the next host message, and the timer of the next host 
+        # message (None while the room has no members)
+        self.hostbot = None
+        self.nextHostMessage = 0
+        self.hostTimer = None
+        
+    def __len__(self):
+        return len(self.members)
+    
         
 class HostBot:
     """
     This class represents the host which is initiating conversations 
-    in the chat thread. The method hostThread in the SimpleChatServer
-    class creates an instance of this class to send messages to all 
-    connected clients.
+    in the chat thread. The host message timer of each room (see 
+    SimpleChatServer.hostTimerExpired) creates an instance of this class 
+    to send messages to the members of the room.
     
     The messages which are sent from the host are saved in the 
     conversationInitiators.txt in the same forlder as the server.py 
@@ -195,56 +1639,320 @@ class HostBot:
             # The current message is then returned.
             return(self.setCurMsg())
         
-        else:
-            return(self.curMsg)
+        else:
+            return(self.curMsg)
+    
+    def setCurMsg(self):
+        """
+        This method sets the current message and stores the start timestamp of 
+        the message.
+
+        Returns
+        -------
+        self.curMsg - String
+            The new message is returned.
+
+        """
+        # A new message is set
+        self.curMsg = random.choice(self.conversationInitiators)
+        # The start time of the message is captured
+        self.msgStartTime = time.time()
+        # Return the new message
+        return(self.curMsg)
+
+class LogFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    This class is the handler which writes the log file of the server. A new log file 
+    is started each day at midnight, and the name of the file contains the date 
+    (the {} in the filename is replaced by the date). The file is rotated when it is 
+    larger than maxBytes bytes. The rotated files are compressed with gzip and numbered 
+    (<filename>.1.gz is the newest). The oldest file of the day is deleted when there 
+    are more than backupCount rotated files.
+    
+    The handler is used by the log thread (see SimpleChatServer.startLogging), so 
+    the rotation and the compression do not delay the threads serving the clients.
+    """
+    # The default size of the log file when it is rotated, and the number of rotated files kept
+    MAX_BYTES = 10*1024*1024
+    BACKUP_COUNT = 14
+    
+    def __init__(self, filename, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT):
+        # The name of the log files, which contains {} where the date is inserted
+        self.filenamePattern = filename
+        super().__init__(self.filenameOfDay(), maxBytes=maxBytes, backupCount=backupCount, encoding="utf-8")
+        # The rotated files are compressed
+        self.namer = self.compressedName
+        self.rotator = self.compressFile
+        # The time (time.time) when the file of the next day is started
+        self.rolloverAt = self.nextMidnight()
+        
+    def filenameOfDay(self):
+        """
+        This method returns the name of the log file of the current day.
+        """
+        return self.filenamePattern.format(datetime.now().date())
+    
+    @staticmethod
+    def nextMidnight():
+        """
+        This method returns the time (time.time) of the next midnight (local time).
+        """
+        now = datetime.now()
+        return datetime(now.year, now.month, now.day).timestamp() + 24*60*60
+        
+    def shouldRollover(self, record):
+        if time.time() >= self.rolloverAt:
+            # A new day has started
+            return True
+        # The file is larger than maxBytes bytes
+        return super().shouldRollover(record)
+    
+    def doRollover(self):
+        if time.time() < self.rolloverAt:
+            # The file is too large. It is compressed and a new file is started.
+            super().doRollover()
+            return
+        # The file of the last day is kept as it is, and the file of the new day is started
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.baseFilename = os.path.abspath(self.filenameOfDay())
+        self.stream = self._open()
+        self.rolloverAt = self.nextMidnight()
+        
+    @staticmethod
+    def compressedName(filename):
+        """
+        This method returns the name of a rotated file (the rotator compresses the file).
+        """
+        return filename + ".gz"
+    
+    @staticmethod
+    def compressFile(source, destination):
+        """
+        This method is the rotator of the handler. It compresses the log file (source) 
+        into the rotated file (destination) and removes the log file.
+        """
+        if not os.path.exists(source):
+            # Nothing has been written since the last rotation
+            return
+        with open(source, "rb") as logFile, gzip.open(destination, "wb") as rotatedFile:
+            shutil.copyfileobj(logFile, rotatedFile)
+        os.remove(source)
+        
+        
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    This class puts the log records in the queue of the log thread. Unlike the 
+    QueueHandler, the messages are not formatted before they are put in the queue, 
+    so the formatting is also done by the log thread. The arguments of a log call 
+    must therefore not be changed after the call.
+    """
+    
+    def prepare(self, record):
+        # The record is passed to the log thread as it is
+        return record
+    
+        
+class LogPayload:
+    """
+    Objects of this class are given to the logging functions instead of the messages 
+    received from a client. The messages are only converted to text when the record is 
+    written by the log thread, and the text is truncated, so the cost of the log entry 
+    does not depend on the size of the messages.
+    """
+    # The representation used for the messages. At most MAX_MESSAGES messages with 
+    # at most MAX_CHARACTERS characters each are included in the log entry.
+    MAX_MESSAGES = 10
+    MAX_CHARACTERS = 200
+    payloadRepr = reprlib.Repr()
+    payloadRepr.maxlist = MAX_MESSAGES
+    payloadRepr.maxtuple = MAX_MESSAGES
+    payloadRepr.maxstring = MAX_CHARACTERS
     
-    def setCurMsg(self):
-        """
-        This method sets the current message and stores the start timestamp of 
-        the message.
-
-        Returns
-        -------
-        self.curMsg - String
-            The new message is returned.
-
-        """
-        # A new message is set
-        self.curMsg = random.choice(self.conversationInitiators)
-        # The start time of the message is captured
-        self.msgStartTime = time.time()
-        # Return the new message
-        return(self.curMsg)
-
+    __slots__ = ("messages",)
+    
+    def __init__(self, messages):
+        # The messages received (a list or a tuple)
+        self.messages = messages
+        
+    def __str__(self):
+        return self.payloadRepr.repr(self.messages)
+    
+        
 class SimpleChatServer:
     """
     The SimpleChatServer class has the task to host and controll one single chat thread.    
     """
 
     # End of message code used to identify the end of each message sent between the server and the user
-    END_OF_MSG = "::EOMsg::"
+    END_OF_MSG = END_OF_MSG
     # Regex pattern used to find the username
     usernamePattern = re.compile(".*: (\S*)")
+    # Regex pattern used to find the version of the protocol offered by the client in the username message
+    protocolPattern = re.compile(" protocol=(\d+)")
+    # Regex pattern used to find the compression offered by the client. It contains the 
+    # checksum of the preset dictionary of the client.
+    compressionPattern = re.compile(" compress=zlib:([0-9a-f]+)")
+    # Regex pattern used to find the number of old messages the client wants when it joins
+    historyPattern = re.compile(" history=(\d+)")
+    # Regex pattern used to find the room and the sequence number sent by a client which resumes
+    resumePattern = re.compile(" resume=([A-Za-z0-9_-]{1,32}):(\d+)")
+    # The versions of the protocol supported by the server
+    PROTOCOLS = (PROTOCOL_V1, PROTOCOL_V2)
+    # Compression is accepted when offered by a client if this flag is set
+    COMPRESSION = True
     # The username of the host
     HOSTBOT_UNAME = "Host"
-    # The time between host messages (seconds)
+    # The time between host messages in each room (seconds)
     HOST_PERIOD = 30
-    # The main part of the kick message
-    KICK_MSG = "Kicked by the host for "
+    # The room of the clients which have not joined another room, and the maximum number of rooms
+    DEFAULT_ROOM = "lobby"
+    MAX_ROOMS = 1000
+    # Regex pattern used to validate the name of a room
+    roomPattern = re.compile("^[A-Za-z0-9_-]{1,32}$")
+    # Regex pattern used to find the room commands sent by the users (/join <room>, /leave and /rooms)
+    roomCommandPattern = re.compile("^[^:]*: /(join|leave|rooms)(?: +(.*?))? *$")
+    # Regex pattern used to find the history command sent by the users (/history [count] [sequence])
+    historyCommandPattern = re.compile("^[^:]*: /history(?: +(\d+))?(?: +(\d+))? *$")
     # The regex pattern used to parse the commands issued by the administrator
     cmdPattern = re.compile("^([^ ]*) {0,1}(.*)$")
     
-    # Constants used in checking for spam by users.
-    # The server kicks a user if the user sends SPAM_MSG_NUMBER messages 
-    # within SPAM_SECONDS.
-    SPAM_MSG_NUMBER = 10
-    SPAM_SECONDS = 4
+    # The rate limits used to stop users from spaming. A user may send RATE_LIMIT_BURST 
+    # messages at once and RATE_LIMIT_PER_SECOND messages per second on average. All 
+    # users connected from the same address share the ADDRESS_RATE_LIMIT limits. 
+    # The RATE_LIMIT_POLICY is applied to a user exceeding one of the limits:
+    #   "kick" - the user is kicked.
+    #   "throttle" - the server stops reading from the user until the user is within 
+    #                the limits again. The user is kicked if the server would stop 
+    #                reading for more than MAX_THROTTLE_SECONDS.
+    RATE_LIMIT_POLICIES = ("kick", "throttle")
+    RATE_LIMIT_POLICY = "kick"
+    RATE_LIMIT_BURST = 10
+    RATE_LIMIT_PER_SECOND = 2.5
+    ADDRESS_RATE_LIMIT_BURST = 40
+    ADDRESS_RATE_LIMIT_PER_SECOND = 10
+    MAX_THROTTLE_SECONDS = 30
+    
+    # The directory where the chat history of the rooms is stored. None means the 
+    # history is only kept in memory.
+    HISTORY_DIR = None
+    # The history log regions are sent with os.sendfile where it is available
+    SENDFILE = hasattr(os, "sendfile")
+    # The capacity of the chat history. The oldest messages are discarded when the history 
+    # contains more than HISTORY_SIZE messages or more than HISTORY_BYTES bytes.
+    HISTORY_SIZE = 1000
+    HISTORY_BYTES = 1024*1024
+    # The number of messages appended to the broadcast log between each time the messages 
+    # received by all clients are removed from the log.
+    LOG_TRIM_INTERVAL = 1024
+    
+    # The replay window. A joining client receives at most the REPLAY_MESSAGES newest messages 
+    # which were sent within the last REPLAY_SECONDS seconds (None means no limit).
+    REPLAY_MESSAGES = 200
+    REPLAY_SECONDS = None
+    # The number of old messages sent for the history command when the user does not 
+    # give a number, and the maximum number of messages in one page
+    HISTORY_PAGE = 50
+    MAX_HISTORY_PAGE = 500
+    # The number of seconds the leave message of a user which lost the connection is 
+    # delayed. If the user resumes within this time, neither leave nor join is sent. 
+    # With several workers (ShardedChatServer) the pending leave messages are kept by 
+    # each worker, so this only works if the kernel gives the new connection to the 
+    # same worker. Otherwise the join is sent at once and the leave after the delay.
+    RESUME_GRACE = 10
+    # The connections are checked every HEARTBEAT_INTERVAL seconds. A protocol 2 client 
+    # which has not sent anything for HEARTBEAT_INTERVAL seconds is sent a ping frame, and 
+    # the connection is closed when nothing has been received for IDLE_TIMEOUT seconds. 
+    # Protocol 1 clients can not answer pings, so their connections are checked with TCP 
+    # keepalive probes instead. 0 turns the checks off.
+    HEARTBEAT_INTERVAL = 15
+    IDLE_TIMEOUT = 45
+    
+    # The limits of the messages waiting to be sent to one client (messages lagging behind in 
+    # the broadcast log and messages in the send queue). The SLOW_CONSUMER_POLICY is applied 
+    # to a client which exceeds one of the limits:
+    #   "drop" - the oldest messages are dropped until the client is within the limits.
+    #   "skip" - all waiting messages are skipped and the client continues from the newest 
+    #            message. The client is told how many messages were skipped.
+    #   "disconnect" - the client is kicked.
+    SLOW_CONSUMER_POLICIES = ("drop", "skip", "disconnect")
+    SLOW_CONSUMER_POLICY = "skip"
+    MAX_BACKLOG_MESSAGES = 10000
+    MAX_BACKLOG_BYTES = 4*1024*1024
+    # The message sent to a client when messages have been skipped
+    SKIPPED_MSG = "{} messages were skipped because you are reading too slowly."
     
-    def __init__(self, port):
+    # The maximum number of bytes sent to one client each time the socket is writable
+    FLUSH_BYTES = 256*1024
+    # The budgets of each client in one iteration of the main loop. At most READ_BUDGET 
+    # bytes are received from the client and at most DISPATCH_BUDGET of its messages are 
+    # handled. The rest is handled in the next iterations, in turn with the other clients 
+    # which are over the budget, so one client sending a flood does not delay the others.
+    READ_BUDGET = 16*1024
+    DISPATCH_BUDGET = 64
+    # The number of entries read from the broadcast log at a time
+    LOG_READ_BATCH = 256
+    # The maximum number of buffers sent with one sendmsg call (IOV_MAX on Linux)
+    MAX_IOV = 1024
+    
+    # The maximum time (seconds) the main thread waits for socket events. Other threads 
+    # wake up the main thread at once when they change its state (see wakeMainLoop).
+    SELECT_TIMEOUT = 10
+    # The minimum number of file descriptors the server tries to make available 
+    # when the hard limit of the process is unlimited.
+    MIN_FILE_LIMIT = 65536
+    # The server socket is bound with SO_REUSEPORT if this flag is set, so several 
+    # processes can listen on the same port (see ShardedChatServer)
+    REUSE_PORT = False
+    # The number of connections the kernel queues until the server accepts them (the 
+    # listen backlog, limited by net.core.somaxconn on Linux), and the maximum number 
+    # of connections accepted each time the server socket is readable
+    LISTEN_BACKLOG = 1024
+    ACCEPT_BATCH = 64
+    # The admission control of the new connections (see AdmissionControl). Each address 
+    # may open CONNECT_BURST connections at once and CONNECT_RATE_PER_SECOND connections 
+    # per second on average. Further connections are served later, and refused if they 
+    # would wait more than MAX_ADMISSION_DELAY seconds.
+    CONNECT_RATE_PER_SECOND = 10
+    CONNECT_BURST = 50
+    MAX_ADMISSION_DELAY = 30
+    
+    # The log file is written by a separate thread (see startLogging). A file is kept 
+    # in LOG_DIR for each day, and it is rotated when it is larger than LOG_MAX_BYTES 
+    # bytes. The LOG_BACKUPS newest rotated files of the day are kept (compressed).
+    LOG_DIR = "./Logs"
+    LOG_LEVEL = "INFO"
+    LOG_MAX_BYTES = LogFileHandler.MAX_BYTES
+    LOG_BACKUPS = LogFileHandler.BACKUP_COUNT
+    # The messages received from the clients are written to the log for one in 
+    # LOG_PAYLOAD_SAMPLE receives (0 means never). The messages are truncated (see LogPayload).
+    LOG_PAYLOAD_SAMPLE = 100
+    
+    def __init__(self, port, historySize=HISTORY_SIZE, historyBytes=HISTORY_BYTES, 
+                 replayMessages=REPLAY_MESSAGES, replaySeconds=REPLAY_SECONDS, 
+                 slowConsumerPolicy=SLOW_CONSUMER_POLICY, maxBacklogMessages=MAX_BACKLOG_MESSAGES, 
+                 maxBacklogBytes=MAX_BACKLOG_BYTES, compression=COMPRESSION, 
+                 rateLimitPolicy=RATE_LIMIT_POLICY, rateLimitPerSecond=RATE_LIMIT_PER_SECOND, 
+                 rateLimitBurst=RATE_LIMIT_BURST, rateLimitOverrides=None, historyDir=HISTORY_DIR, 
+                 logLevel=LOG_LEVEL, logMaxBytes=LOG_MAX_BYTES, logBackups=LOG_BACKUPS, 
+                 logPayloadSample=LOG_PAYLOAD_SAMPLE, heartbeatInterval=HEARTBEAT_INTERVAL, 
+                 idleTimeout=IDLE_TIMEOUT, listenBacklog=LISTEN_BACKLOG, 
+                 connectRatePerSecond=CONNECT_RATE_PER_SECOND, connectBurst=CONNECT_BURST, 
+                 readBudget=READ_BUDGET, dispatchBudget=DISPATCH_BUDGET):
         # Verify that the port provided as argument to the constructor is valid
         if type(port)!=int or port < 0 or port > 65535:
             raise ValueError(f"The provided port {port} is not valid. \
                              Please provide a decimal number between 0 and 65535")
+        if slowConsumerPolicy not in self.SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"The slow consumer policy {slowConsumerPolicy} is not valid. " +
+                             f"Please provide one of {', '.join(self.SLOW_CONSUMER_POLICIES)}")
+        if rateLimitPolicy not in self.RATE_LIMIT_POLICIES:
+            raise ValueError(f"The rate limit policy {rateLimitPolicy} is not valid. " +
+                             f"Please provide one of {', '.join(self.RATE_LIMIT_POLICIES)}")
+        if readBudget < 1 or dispatchBudget < 1:
+            raise ValueError(f"The read budget {readBudget} and the dispatch budget {dispatchBudget} " + 
+                             "must be at least 1.")
         
         # The port is added to the port attribute
         self.port = port
@@ -256,24 +1964,91 @@ class SimpleChatServer:
         self.stopApplication = threading.Event()
         self.stopUserInteraction = threading.Event()
         
-        # The list of all connected users. 
+        # The registry of all connected users. 
         # It should contain instances of the ChatSocket classs
-        self.chatUsers = []
-        # A list containing all messages which were sent since the service started
-        self.history = []
+        self.chatUsers = ConnectionRegistry()
+        # The capacity of the chat history of each room, and the directory where the 
+        # history is stored (None if the history is only kept in memory)
+        self.historySize = historySize
+        self.historyBytes = historyBytes
+        self.historyDir = historyDir
+        # The number of messages and the age in seconds of the messages sent to joining clients
+        self.replayMessages = replayMessages
+        self.replaySeconds = replaySeconds
+        # The chat rooms by name. The default room always exists.
+        self.rooms = {}
+        self.getRoom(self.DEFAULT_ROOM)
+        if historyDir is not None:
+            # Open the rooms which have a history from an earlier run of the server
+            for name in sorted(os.listdir(historyDir)):
+                if self.roomPattern.search(name) and len(self.rooms) < self.MAX_ROOMS:
+                    self.getRoom(name)
+        # The policy and the limits applied to clients which do not read the messages fast enough
+        self.slowConsumerPolicy = slowConsumerPolicy
+        self.maxBacklogMessages = maxBacklogMessages
+        self.maxBacklogBytes = maxBacklogBytes
+        # Compression is accepted when this flag is set
+        self.compression = compression
+        # The rate limiter of the received messages and the policy applied to users exceeding 
+        # the limits. The overrides are given as a dictionary {username : (perSecond, burst)}.
+        self.rateLimitPolicy = rateLimitPolicy
+        self.rateLimiter = RateLimiter(rateLimitPerSecond, rateLimitBurst, self.ADDRESS_RATE_LIMIT_PER_SECOND, 
+                                       self.ADDRESS_RATE_LIMIT_BURST, rateLimitOverrides)
+        # The clients which are throttled, with the timer which ends the throttling (see throttleClient)
+        self.throttledUsers = {}
+        # The number of bytes received from a client and the number of its messages handled in 
+        # one iteration of the main loop, and the clients with received messages left over the 
+        # budget. They are served in the order of the dictionary, which is used as an ordered 
+        # set (see processReceived).
+        self.readBudget = readBudget
+        self.dispatchBudget = dispatchBudget
+        self.carryOver = {}
+        # Counters of the events in the service (e.g. the number of messages dropped for slow clients)
+        self.metrics = Counter()
+        # The options of the log file, and the thread writing the log file (see startLogging)
+        self.logLevel = logLevel
+        self.logMaxBytes = logMaxBytes
+        self.logBackups = logBackups
+        self.logPayloadSample = logPayloadSample
+        self.logListener = None
+        # The listen backlog of the server socket, and the admission control which limits 
+        # the rate of the new connections from each address
+        self.listenBacklog = listenBacklog
+        self.admissionControl = AdmissionControl(connectRatePerSecond, connectBurst, self.MAX_ADMISSION_DELAY)
+        # The time between the checks of the connections, and the time without received data 
+        # after which a connection is closed (see checkHeartbeat)
+        self.heartbeatInterval = heartbeatInterval
+        self.idleTimeout = idleTimeout
+        # The leave messages of the users which lost the connection, by username. Each value 
+        # is a tuple with the room and the timer which sends the message.
+        self.pendingLeaves = {}
+        # The timers of the main loop (host messages, pending leave messages and throttled 
+        # clients). See scheduleTimer.
+        self.timers = TimerWheel()
+        # The encoders used to frame the messages sent to the clients, one for each version of the protocol
+        self.frameEncoders = [ENCODERS[protocol]() for protocol in self.PROTOCOLS]
+        # The socket pair used by other threads to wake up the main loop (created by mainThread), 
+        # the identity of the thread running the main loop, and a flag which is set while a 
+        # wakeup byte has been written and not read yet (see wakeMainLoop)
+        self.wakeupReader = None
+        self.wakeupWriter = None
+        self.loopThreadId = None
+        self.wakeupPending = False
         
-        # List of sockets that should be checked by the select command 
-        self.checkReadable = [] # Select checks if the sockets in this list are readable (does the buffer contain data?)
-        self.checkWritable = [] # Select checks if the socket connections in this list can be used to send.
-        self.checkError = [] # Select checks if the socket connections in the list have errors.
+        # The selector used by the main thread to wait for readable and writable sockets.
+        # Unlike select.select, the selector is not limited to FD_SETSIZE (1024) sockets.
+        self.selector = selectors.DefaultSelector()
         
-        # A list containing references to client sockets which should be closed in the next iteration.
-        self.closeNext = []
+        # The client sockets which should be closed in the next iteration. 
+        # The dictionary is used as an ordered set (the values are not used).
+        self.closeNext = {}
+        # The clients which have new messages in the send queue or have changed state since the 
+        # last iteration of the main thread. Their selector registration is updated by the main thread.
+        # The dictionary is used as an ordered set (the values are not used).
+        self.interestChanged = {}
         # A list containing all sockets that should send a close message to the client and then be removed
         self.finishRemovalList = []
-        
-        # This queue contains the references to each send and receive thread created in the mainThread method
-        self.activeThreads = Queue()
+
         # Defining the commands which can be used to controll the service
         # Each key in the dictionary, command name, have a list with a general description of the command, 
         # Description of the arguments and a reference to the function this command should execute.
@@ -283,6 +2058,11 @@ class SimpleChatServer:
                                 "The command takes two arguments: username of the user (mandatory) " +
                                 "and the reason for the kick (optional). The reason can be given " +
                                 "as a space separated words. Eks: kick User Due to service overload.", self.kickUser],
+                       "metrics" : ["Prints the counters of the service. ", "The command takes no arguments.", self.listMetrics], 
+                       "ratelimit" : ["Sets the rate limit of a user. ", 
+                                      "The command takes three arguments: username of the user, messages per " + 
+                                      "second and the number of messages the user can send at once. " + 
+                                      "Eks: ratelimit User 5 20", self.setRateLimit], 
                        "exit" : ["Stops the chat service. ", "The command takes no arguments.", self.stopService]}
         
         
@@ -297,31 +2077,11 @@ class SimpleChatServer:
         None.
 
         """
-        # Check that a log folder is present in the application directory
-        if not os.path.isdir("./Logs"):
-            # Create the folder if it does not exist
-            os.mkdir("Logs")
-        
-        # Get the current date used in the filename of the log
-        logDay = f"{datetime.now().date().__str__()}"
-        # Definition of the logger used in this program
-        logging.basicConfig(format='%(levelname)s: %(asctime)s: %(message)s', 
-                            filename=f"./Logs/chatServer_{logDay}.log", level=logging.INFO)
+        # Start the thread writing the log file
+        self.startLogging("chatServer_{}.log")
         
-        # Defines the main server socket with the IPv4 address family (AF_INET) 
-        # and the TCP protocol (SOCK_STREAM) as domain and type
-        self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # Binds the server socket to the given port and any address associated to any network card ont he ensystem 
-        # running this program.
-        self.serverSocket.bind(('', self.port))
-        # The server starts listening on the given port. 
-        # The number of unaccepted connections to the server before the server refuses any new connections, is 5.
-        self.serverSocket.listen(5)
-        # The server should be non-blocking
-        self.serverSocket.setblocking(0)
-        # The server socket is added to the check readable list so select can check if there are new connections 
-        # Which the server socket can accept.
-        self.checkReadable.insert(0, self.serverSocket) 
+        # Create the socket listening for new connections
+        self.createServerSocket()
         
         logging.info("Service is listening to incomming connections on port %s.", str(self.port))
         # Print start information about the program and the server
@@ -374,6 +2134,15 @@ class SimpleChatServer:
                             else:
                                 print(f"User {username} was removed!")
                                 
+                    elif cmd == "ratelimit":
+                        try:
+                            # Get the username, the rate and the burst from the argument list
+                            username, rate, burst = arguments[0], float(arguments[1]), int(arguments[2])
+                        except (IndexError, ValueError):
+                            print("Please specify the username, the messages per second and the burst.")
+                        else:
+                            self.cmdSet[cmd][2](username, rate, burst)
+                            print(f"The rate limit of {username} is {rate} messages per second (burst {burst}).")
                     elif cmd == "exit":
                         # If the exit command was issued, then execute the stopService method
                         self.cmdSet[cmd][2]("The service is stopping!") # A constant reason is provided.
@@ -402,14 +2171,88 @@ class SimpleChatServer:
         self.isRunning = False
         print("Service stopped successfully!\n")
         logging.info("Service stoped successfully!")
+        # Write the remaining log records to the file
+        self.stopLogging()
+        
+    def startLogging(self, filename):
+        """
+        This method configures the logger used in this program. The log calls only put 
+        the records in a queue. The records are formatted and written to the log file 
+        by a separate thread (QueueListener), so the file I/O, the formatting and the 
+        rotation of the file do not delay the threads serving the clients. 
+
+        Parameters
+        ----------
+        filename : String
+            The name of the log files in the LOG_DIR folder. The date is inserted 
+            where the name contains {} (see LogFileHandler).
+
+        Returns
+        -------
+        None.
+
+        """
+        # Create the log folder if it does not exist
+        os.makedirs(self.LOG_DIR, exist_ok=True)
+        fileHandler = LogFileHandler(os.path.join(self.LOG_DIR, filename), self.logMaxBytes, self.logBackups)
+        fileHandler.setFormatter(logging.Formatter('%(levelname)s: %(asctime)s: %(message)s'))
+        # The queue between the log calls and the log thread
+        logQueue = SimpleQueue()
+        # Replace the handlers of the root logger (e.g. the handler inherited by a worker process)
+        logging.basicConfig(handlers=[LogQueueHandler(logQueue)], level=self.logLevel, force=True)
+        self.logListener = logging.handlers.QueueListener(logQueue, fileHandler)
+        self.logListener.start()
+        
+    def stopLogging(self):
+        """
+        This method stops the log thread after the records in the queue are written 
+        to the log file.
+        """
+        if self.logListener is not None:
+            self.logListener.stop()
+            self.logListener.handlers[0].close()
+            self.logListener = None
+        
+    def createServerSocket(self):
+        """
+        This method creates the non-blocking server socket which listens for incomming 
+        connections on the port given to the constructor.
+
+        Returns
+        -------
+        None.
+
+        """
+        # Make sure that the process is allowed to hold many client connections
+        self.raiseFileLimit()
+        # Defines the main server socket with the IPv4 address family (AF_INET) 
+        # and the TCP protocol (SOCK_STREAM) as domain and type
+        self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.REUSE_PORT:
+            # The connections to the port are distributed between the sockets bound with SO_REUSEPORT
+            self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # Binds the server socket to the given port and any address associated to any network card ont he ensystem 
+        # running this program.
+        self.serverSocket.bind(('', self.port))
+        # The server starts listening on the given port. 
+        # The number of unaccepted connections to the server before the server refuses any new 
+        # connections is the listen backlog.
+        self.serverSocket.listen(self.listenBacklog)
+        # The server should be non-blocking
+        self.serverSocket.setblocking(0)
         
     def mainThread(self):
         """
         This method has the task of controlling the chat service. It constantly checks for new connections and 
         if existing client sockets have new data in the recevie buffer or if thy are ready to receive messages 
-        from the server. It also checks for errors associated with the connecitons and removes foulty connections 
-        or user that are spaming (sending too many messages in short succession). The design of the handeling of 
-        the sockets are based on the post by Doug Hellmann http://pymotw.com/2/select/.
+        from the server. It also removes foulty connections or user that are spaming (sending too many messages 
+        in short succession). 
+        
+        All socket events are handled inline by this single thread. The sockets are registered in a selector 
+        (epoll on Linux), which returns the sockets that are ready. Accepting, receiving and sending are then 
+        done without starting a thread per event. The design of the handeling of the sockets are based on the 
+        post by Doug Hellmann http://pymotw.com/2/select/ and the documentation of the selectors module 
+        https://docs.python.org/3/library/selectors.html.
 
         Returns
         -------
@@ -417,157 +2260,555 @@ class SimpleChatServer:
 
         """
         
-        # Starts a thread that acts as the hostbot
-        hostbotThread = threading.Thread(target=self.hostbotThread, daemon=True)
-        hostbotThread.start()
+        # The other threads wake up the main loop by writing to the wakeup socket pair
+        self.openWakeup(self.selector)
+        
+        # The server socket is registered so the selector reports new connections which the 
+        # server socket can accept.
+        self.selector.register(self.serverSocket, selectors.EVENT_READ)
 
-        while not self.stopApplication.is_set() and (len(self.checkWritable) > 0 or len(self.checkReadable) > 0):
-            # Continue handling connections while the stopApplication falg is not set and the there are sockets 
-            # that should be checked for readablity or sending
+        while not self.stopApplication.is_set():
+            # Continue handling connections while the stopApplication falg is not set
+            if self.stopUserInteraction.is_set() and self.serverSocket in self.selector.get_map():
+                # The service is stopping. The server socket is unregistered to avoid new connections.
+                self.selector.unregister(self.serverSocket)
             try:
-                # Check if the any socets have data in their inbound buffer, if they have free space in thye 
-                # outbound buffer or if there is any error associated with the socket.
-                # The timeout argument is set to 10 seconds. This means that this function will block for 10 
-                # seconds if no messages are received or sent
-                readable, writable, err = select.select(self.checkReadable, self.checkWritable, self.checkError, 10)
+                # Wait until any socket has data in the inbound buffer or free space in the outbound 
+                # buffer. The method will block for SELECT_TIMEOUT seconds if no messages are received 
+                # or sent, or until the first timer expires.
+                events = self.selector.select(self.selectTimeout())
             except OSError as E:
                 # If the select method raises an OSError, the application is stopped. 
                 logging.error(f"The select function raised the following exception: {E}")
                 
-                readable, writable, err = []
+                events = []
                 
                 print(f"Fatal error in main thread. Program is closing: {E}")
                 # Set both flags to end the loop in main thread and in the user interaction thread
                 self.stopApplication.set()
                 self.stopUserInteraction.set()
                 
-                
-            for client in readable:
-                # For each socket that contains data in the inbound buffer
+            # The clients with messages left over from the last iteration. Clients which go over 
+            # the budget in this iteration are served in the next.
+            carried = list(self.carryOver)
+            for key, mask in events:
+                # For each socket which is ready
+                client = key.fileobj
                 if client is self.serverSocket:
-                    # If the socket is the server socket, then run the accept connection thread
-                    curThread = threading.Thread(target=self.acceptConnection)
-                    curThread.start()
-                    # Add the thread to active threads
-                    self.activeThreads.put(curThread)
-                else:
-                    # The client socket is representing a chat user
-                    # Data is received from the client by starting a receive thread
-                    curThread = threading.Thread(target=self.recvFromClient, args=(client, ))
-                    curThread.start()
-                    # The thread is added to the list of active threads
-                    self.activeThreads.put(curThread)
+                    # If the socket is the server socket, then accept the connection
+                    self.acceptConnection()
+                    continue
+                
+                if callable(key.data):
+                    # Other file objects (e.g. the bus of a shard worker) are registered with their handler
+                    key.data()
+                    continue
+                
+                if mask & selectors.EVENT_READ:
+                    # The client socket has data in the inbound buffer
+                    self.recvFromClient(client)
                     
-            for client in writable:
-                # For each socket which has free space in the send/oubound buffer
-                # Start a send thread to send the messages in the send queue of the client.
-                curThread = threading.Thread(target=self.sendToClient, args=(client, ))
-                curThread.start()
-                # Add the thread to the list of active threads
-                self.activeThreads.put(curThread)
-            
-            # Make sure that all threads are finished before continuing
-            while not self.activeThreads.empty():
-                self.activeThreads.get().join()
+                if mask & selectors.EVENT_WRITE:
+                    # The client socket has free space in the send/oubound buffer.
+                    # Send the messages in the send queue of the client.
+                    self.sendToClient(client)
+                    # Stop watching for writability if the send queue is empty
+                    self.interestChanged[key.data] = None
+            
+            for curChatUser in carried:
+                # Handle the next messages of the clients over the budget, one budget each
+                if curChatUser in self.carryOver and not curChatUser.isClosing \
+                        and curChatUser.clientSocket not in self.closeNext:
+                    self.processReceived(curChatUser)
             
             # The removal of sockets is finished after their last send procedure
             while len(self.finishRemovalList) != 0:
                 self.finishRemoval(self.finishRemovalList.pop())
-            
-            for client in err:
-                # For each socket that encountered an error
-                logging.info("Closing socket due to an error detected by the select function.")                
-                if not client._closed:
-                    # If the client is not already closed, exxecute the remove procedure
-                    self.removeClient(client)
-                    
                 
-            while len(self.closeNext) != 0:
-                # For each socket in the closedNext list remove it from the list and 
-                # save the reference to the object
-                curSocket = self.closeNext.pop()
-                if not curSocket._closed:
-                    # If the socket has not already been closed, close it. 
-                    self.removeClient(curSocket)
+            # Run the timers which have expired (e.g. the host messages and the throttled clients)
+            self.timers.run()
+            # Start the removal of the clients that should be closed
+            self.processCloseNext()
                     
-            # The writable list is rebuilt after every select call
-            self.checkWritable = []
-            for client in self.chatUsers:
-                # Foreach connected chat user, check if it has messages in the send queue
-                if not client.sendQueue.empty():
-                    # If the queue is non empty add the reference to it`s socket object
-                    self.checkWritable.append(client.clientSocket)
+            while len(self.interestChanged) != 0:
+                # Foreach chat user with new messages in the send queue or a new state, 
+                # update the events the socket is watched for.
+                client = self.interestChanged.popitem()[0]
+                if client in self.chatUsers:
+                    self.updateInterest(client)
+        
+        # Stop watching the server socket
+        if self.serverSocket in self.selector.get_map():
+            self.selector.unregister(self.serverSocket)
+        # Close the wakeup socket pair
+        self.closeWakeup(self.selector)
+        
+    def updateInterest(self, curChatUser):
+        """
+        This method registers the socket of the given client in the selector with the 
+        events that should be watched. The socket is watched for received data as long 
+        as the client is not being removed, throttled or over its dispatch budget, and for free space in the 
+        outbound buffer as long as there are messages in the send queue. The selector is only updated 
+        if the events have changed since the last call.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The ChatSocket object of the client that should be watched.
+
+        Returns
+        -------
+        None.
+
+        """
+        events = 0 if curChatUser.isClosing or curChatUser in self.throttledUsers \
+            or curChatUser in self.carryOver else selectors.EVENT_READ
+        if not self.hasPendingOutput(curChatUser) and not curChatUser.isClosing and curChatUser.room is not None:
+            # The client waits for new messages in the broadcast log of its room
+            curChatUser.room.logWaiters[curChatUser] = None
+        if self.hasPendingOutput(curChatUser):
+            # There are messages waiting to be sent. This is checked again after the client 
+            # was added to the waiters, in case another thread added a message in between.
+            events |= selectors.EVENT_WRITE
+        
+        if events == curChatUser.selectorEvents:
+            # Nothing has changed
+            return
+        
+        if curChatUser.selectorEvents == 0:
+            # The socket is not registered yet. The ChatSocket object is stored with the registration.
+            self.selector.register(curChatUser.clientSocket, events, curChatUser)
+        elif events == 0:
+            # The socket should not be watched anymore
+            self.selector.unregister(curChatUser.clientSocket)
+        else:
+            self.selector.modify(curChatUser.clientSocket, events, curChatUser)
+        curChatUser.selectorEvents = events
+        
+    def selectTimeout(self):
+        """
+        This method returns the time the main thread should wait for socket events. 
+        It is shorter than SELECT_TIMEOUT if a timer expires before, and 0 if there 
+        are received messages left over the dispatch budget.
+        """
+        if self.carryOver:
+            return 0
+        timeout = self.timers.timeout()
+        return self.SELECT_TIMEOUT if timeout is None else min(self.SELECT_TIMEOUT, timeout)
+    
+    def scheduleTimer(self, delay, callback, *args):
+        """
+        This method schedules a call of the given callback with the given arguments 
+        in the main loop after the given number of seconds. It must be called by the 
+        thread running the main loop.
+
+        Parameters
+        ----------
+        delay : float
+            The number of seconds until the callback is called.
+            
+        callback : callable
+            The function which is called.
+
+        Returns
+        -------
+        Timer
+            The timer, which can be cancelled with its cancel method.
+
+        """
+        return self.timers.schedule(delay, callback, *args)
+    
+    def resumeThrottled(self, curChatUser):
+        """
+        This method is called by the timer of a throttled client when the client is 
+        within the rate limits again. The messages which were received but not handled 
+        yet are handled first, then the server starts reading from the client again 
+        (the selector registration is updated by the main thread).
+        """
+        if self.throttledUsers.pop(curChatUser, None) is not None:
+            self.carryOver[curChatUser] = None
+            self.interestChanged[curChatUser] = None
+            
+    def startHeartbeat(self, curChatUser):
+        """
+        This method starts the checks of the connection of a new client (see checkHeartbeat), 
+        and turns on TCP keepalive for the socket, which is used to check the connections 
+        of the protocol 1 clients. The keepalive options which are not available on the 
+        platform are skipped.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which has connected.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.heartbeatInterval <= 0:
+            # The checks are turned off
+            return
+        cliSock = curChatUser.clientSocket
+        try:
+            cliSock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                # Send the first probe after HEARTBEAT_INTERVAL seconds without traffic, and close 
+                # the connection after three unanswered probes
+                cliSock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.heartbeatInterval)
+                cliSock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, self.heartbeatInterval // 3))
+                cliSock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+            if hasattr(socket, "TCP_USER_TIMEOUT") and self.idleTimeout > 0:
+                # Close the connection when sent data has not been acknowledged for IDLE_TIMEOUT seconds
+                cliSock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, self.idleTimeout*1000)
+        except OSError as E:
+            logging.warning("Unable to turn on TCP keepalive for %s: %s", curChatUser.destAddress, E)
+        self.scheduleTimer(self.heartbeatInterval, self.checkHeartbeat, curChatUser)
+        
+    def checkHeartbeat(self, curChatUser):
+        """
+        This method is called every HEARTBEAT_INTERVAL seconds for each client. A protocol 2 
+        client which has not sent anything for HEARTBEAT_INTERVAL seconds is sent a ping frame, 
+        which the client answers with a pong frame. The connection is closed as a lost connection 
+        (the user can resume) if nothing has been received for IDLE_TIMEOUT seconds. This also 
+        applies to clients which have not sent their username. The number of closed connections 
+        is counted in the idleReaped metric.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which is checked.
+
+        Returns
+        -------
+        None.
+
+        """
+        if curChatUser.isClosing:
+            # The client is being removed. The checks end.
+            return
+        idle = time.monotonic() - curChatUser.lastRecvMonotonic
+        canPing = curChatUser.protocol == PROTOCOL_V2
+        if self.idleTimeout > 0 and idle >= self.idleTimeout and (canPing or curChatUser.username == ""):
+            # The client has not answered the pings (or has not sent its username)
+            self.metrics["idleReaped"] += 1
+            self.connectionErrorHandling(curChatUser, curChatUser.clientSocket, 
+                                         f"Nothing was received for {idle:.0f} seconds.")
+            self.processCloseNext()
+            return
+        if canPing and idle >= self.heartbeatInterval:
+            # Ask the client to show that it is alive
+            self.metrics["heartbeatPings"] += 1
+            curChatUser.sendQueue.put(self.frameFor(curChatUser, "", FrameType.ping))
+            self.checkSlowConsumer(curChatUser)
+            self.notifyWritable(curChatUser)
+        self.scheduleTimer(self.heartbeatInterval, self.checkHeartbeat, curChatUser)
+            
+    def unregisterClient(self, curChatUser):
+        """
+        This method removes the socket of the given client from the selector. 
+        It must be called before the socket is closed.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The ChatSocket object of the client that should no longer be watched.
+
+        Returns
+        -------
+        None.
+
+        """
+        if curChatUser.selectorEvents != 0:
+            self.selector.unregister(curChatUser.clientSocket)
+            curChatUser.selectorEvents = 0
+        if curChatUser.room is not None:
+            curChatUser.room.logWaiters.pop(curChatUser, None)
+    
+    def raiseFileLimit(self):
+        """
+        This method raises the soft limit of open file descriptors for the process 
+        to the hard limit, so that the server can hold more than the default 1024 
+        connections. Nothing is done on platforms without the resource module.
+
+        Returns
+        -------
+        None.
+
+        """
+        if resource is None:
+            return
+        
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        # The new soft limit. An unlimited hard limit is replaced by MIN_FILE_LIMIT
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, self.MIN_FILE_LIMIT)
+        if soft == resource.RLIM_INFINITY or soft >= target:
+            # The limit is already high enough
+            return
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            logging.info(f"The limit of open file descriptors was raised from {soft} to {target}.")
+        except (ValueError, OSError) as E:
+            logging.warning(f"Unable to raise the limit of open file descriptors: {E}")
+            
+    def processCloseNext(self):
+        """
+        This method starts the removal procedure for each socket in the closeNext list. 
+        Clients that are already removed or being removed are ignored.
+
+        Returns
+        -------
+        None.
+
+        """
+        while len(self.closeNext) != 0:
+            # For each socket in the closedNext list remove it from the list and 
+            # save the reference to the object
+            curSocket = self.closeNext.popitem()[0]
+            curChatUser = self.chatUsers.getBySocket(curSocket)
+            if curChatUser is not None and not curChatUser.isClosing:
+                # If the client is not already removed or being removed, start the removal. 
+                self.removeClient(curSocket)
+                
+    def openWakeup(self, selector):
+        """
+        This method creates the wakeup socket pair used by other threads to wake up the 
+        main loop (see wakeMainLoop). The reading end is registered in the given selector 
+        with its handler. It must be called by the thread running the main loop.
+        """
+        self.loopThreadId = threading.get_ident()
+        self.wakeupReader, wakeupWriter = socket.socketpair()
+        self.wakeupReader.setblocking(False)
+        wakeupWriter.setblocking(False)
+        selector.register(self.wakeupReader, selectors.EVENT_READ, self.drainWakeup)
+        self.wakeupWriter = wakeupWriter
+        
+    def closeWakeup(self, selector):
+        """
+        This method unregisters the wakeup socket pair from the given selector and closes it.
+        """
+        selector.unregister(self.wakeupReader)
+        self.wakeupWriter, wakeupWriter = None, self.wakeupWriter
+        wakeupWriter.close()
+        self.wakeupReader.close()
+        
+    def wakeMainLoop(self):
+        """
+        This method is called by other threads (e.g. the user interaction loop) after 
+        they have changed the state that the main loop acts on, for example by adding 
+        sockets to the closeNext list or messages to a send queue. A byte is written to the 
+        wakeup socket, which is watched by the selector, so the main loop handles the change 
+        at once instead of after SELECT_TIMEOUT seconds. Nothing is done if the method is 
+        called by the main thread, or if a wakeup is already pending.
+
+        Returns
+        -------
+        None.
+
+        """
+        wakeupWriter = self.wakeupWriter
+        if wakeupWriter is None or self.wakeupPending or threading.get_ident() == self.loopThreadId:
+            return
+        self.wakeupPending = True
+        try:
+            wakeupWriter.send(b"\0")
+        except OSError:
+            # The socket buffer is full (the main loop will wake up anyway) or the 
+            # main loop has ended and closed the socket
+            pass
+        
+    def drainWakeup(self):
+        """
+        This method is called by the main loop when the wakeup socket is readable. The 
+        bytes written by wakeMainLoop are discarded. The changes made by the other thread 
+        are handled at the end of the iteration of the main loop.
+        """
+        try:
+            while self.wakeupReader.recv(4096):
+                pass
+        except BlockingIOError:
+            # All bytes are read
+            pass
+        # The flag is cleared after the socket is read, so it is never left set with an empty 
+        # socket. A wakeup skipped while the flag was set is not lost, since the change is 
+        # handled at the end of this iteration. At worst the next wakeup is not needed.
+        self.wakeupPending = False
+    
+    def notifyWritable(self, curChatUser):
+        """
+        This method is called each time a message has been added to the send queue of 
+        a client. The client is marked so that the main thread watches the socket for 
+        writability after the current iteration. The main loop is woken up if the 
+        message was added by another thread.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which has new messages in the send queue.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.interestChanged[curChatUser] = None
+        self.wakeMainLoop()
         
-        # End the hostbot thread
-        hostbotThread.join(1)
+    def startHostTimer(self, room):
+        """
+        This method starts the host message timer of the given room, when a client 
+        enters the room. The first message is sent at once, or HOST_PERIOD seconds after 
+        the last message of the room. Nothing is done if the timer is already running.
+
+        Parameters
+        ----------
+        room : ChatRoom object
+            The room which has members.
+
+        Returns
+        -------
+        None.
+
+        """
+        if room.hostTimer is None:
+            delay = max(0, room.nextHostMessage - time.monotonic())
+            room.hostTimer = self.scheduleTimer(delay, self.hostTimerExpired, room)
+            
+    def hostTimerExpired(self, room):
+        """
+        This method is called by the host message timer of the given room. A message 
+        from the host bot is sent and the timer is started again, as long as the room 
+        has members. The timer of a room without members is started again by 
+        startHostTimer when a client enters the room.
+        """
+        room.hostTimer = None
+        if self.roomHasMembers(room):
+            room.nextHostMessage = time.monotonic() + self.HOST_PERIOD
+            self.sendHostMessage(room)
+            room.hostTimer = self.scheduleTimer(self.HOST_PERIOD, self.hostTimerExpired, room)
+                
+    def roomHasMembers(self, room):
+        """
+        This method returns True if the given room has members.
+        """
+        return len(room) != 0
+            
+    def sendHostMessage(self, room):
+        """
+        This method gets the message set by the HostBot object of the room and 
+        adds it to the history and to the broadcast log of the room.
+
+        Parameters
+        ----------
+        room : ChatRoom object
+            The room the message should be sent to.
+
+        Returns
+        -------
+        None.
+
+        """
+        logging.info("A new message is sent from host in the room %s", room.name)
+        if room.hostbot is None:
+            # An HostBot object is instantiated for the room
+            room.hostbot = HostBot()
+        # Get the current message set by the HostBot object
+        msg = f"\n{self.HOSTBOT_UNAME}: {room.hostbot.getCurMsg()}"
+        # Add the message to the history and broadcast it to all members of the room
+        self.populateSendQueues(msg, None, room=room)
             
-    def hostbotThread(self):
+    def acceptConnection(self):
+        """
+        This method executes the procedure to accept the new connections to the server.
+        It is called by the main thread when the selector reports that the serverSocket 
+        has received connection requests. All waiting connections are accepted, up to 
+        ACCEPT_BATCH connections, so the listen backlog is emptied quickly when many 
+        clients connect at once. The rest is accepted in the next iteration of the main 
+        loop. Each connection is admitted by the admission control of its address, and 
+        served at once or after a delay (see admitConnection), or refused.
+
+        Returns
+        -------
+        None.
+
         """
-        This method is the target of the hostThread object from the main thread 
-        and contains the routin which is run by the hostThread. The routine 
-        instantiates a HostBot object, gets the message set by the HostBot 
-        and puts it in each send queue. This is repeated in a cycle with 
-        the length given by the HOST_PERIOD constant. The thread ends when the 
-        stopApplication flag is set.
+        for i in range(self.ACCEPT_BATCH):
+            try:
+                # Accept the request from the client and obtain the client socket.
+                client, src = self.serverSocket.accept()
+            except BlockingIOError:
+                # All waiting connections are accepted
+                return
+            except ConnectionAbortedError:
+                # The connection request was withdrawn by the client before it was accepted
+                continue
+            except OSError as E:
+                # E.g. the limit of open file descriptors is reached. The connections 
+                # stay in the listen backlog.
+                logging.error("Unable to accept a connection: %s", E)
+                return
+            # Set the socket to non-blocking
+            client.setblocking(0)
+            
+            delay = self.admissionControl.admit(src[0])
+            if delay is None:
+                # The address has opened too many connections
+                self.metrics["admissionRefused"] += 1
+                client.close()
+            elif delay > 0:
+                # The connection is served when the address is within the limit again
+                self.metrics["admissionDelayed"] += 1
+                self.scheduleTimer(delay, self.admitConnection, client, src)
+            else:
+                self.admitConnection(client, src)
         
-        Returns
-        -------
-        None.
-
+    def admitConnection(self, client, src):
         """
-        # An HostBot object is instantiated
-        self.hostbot = HostBot()
-        
-        while not self.stopApplication.is_set():
-            # While the stopApplication flag is not set
-            logging.info("A new message is sent from host")
-            # Get the current message set by the HostBot object
-            msg = f"\n{self.HOSTBOT_UNAME}: {self.hostbot.getCurMsg()}"
-            # Add the message to the thread cache
-            self.history.append(msg)
-
-            for user in self.chatUsers:
-                # Add the message to each send queue
-                user.sendQueue.put(msg)
-            # Put the thread in idle for the given amount of seconds (HOST_PERIOD)
-            time.sleep(self.HOST_PERIOD)
+        This method starts serving a connection which has been accepted and admitted. It 
+        creates a ChatSocket object for the client which is connecting. The saved messages 
+        that were sent before the client was connected are added to the send queue when 
+        the client has sent its username (see joinChat).
+
+        Parameters
+        ----------
+        client : Socket object
+            The socket of the new connection.
             
-    def acceptConnection(self):
-        """
-        This method executes the procedure to accept a new connection to the server.
-        It is called by the main thread and it is asumed that the the serverSocket 
-        has received a connection request. The method also creates a ChatSocket object 
-        for the client which is connecting. The saved messages that were sent before 
-        the client was connected, are added to the send queue.
+        src : tuple
+            The address and the port of the client.
 
         Returns
         -------
         None.
 
         """
-        # Accept the request from the client and obtain the client socket.
-        client, src = self.serverSocket.accept()
-        # Set the socket to non-blocking
-        client.setblocking(0)
-        logging.info(f"New client connection accepted for source {src}.")
+        if self.stopUserInteraction.is_set():
+            # The service is stopping
+            client.close()
+            return
+        logging.info("New client connection accepted for source %s.", src)
         
         # Create the ChatSocket object for the new client/user.
-        curChatSocket = ChatSocket(client, self.history)
+        curChatSocket = ChatSocket(client)
         # Add the client to the list of connected users
-        self.chatUsers.append(curChatSocket)
-        # Add the client socket to the ckeck lists so they can be probed for errors or received data.
-        self.checkReadable.append(client)
-        self.checkError.append(client)
+        self.chatUsers.add(curChatSocket)
+        # Start checking that the connection is alive
+        self.startHeartbeat(curChatSocket)
+        # Register the client socket in the selector so it can be probed for received data.
+        self.updateInterest(curChatSocket)
     
     def sendToClient(self, cliSock):
         """
         This method executes the send procedure for a client socket. The method 
-        assumes that the send buffer of the socket is not full. It tries to send 
-        all messages which are storedd in the send queue for the client at the 
-        moment this method is executed. If the send buffer becomes full during 
-        the procedure, the ppartially sent message is saved and controll returns 
-        to mainloop. The next time this method is called for that particular client, 
-        the rest from the last send procedure is sent first.
+        assumes that the send buffer of the socket is not full. It moves the 
+        messages which are storedd in the send queue for the client and the 
+        messages in the broadcast log after the cursor of the client into the 
+        outbound buffer of the client, until the high watermark of the buffer is 
+        reached. The outbound buffer is then sent by the sendLoop method. If the send 
+        buffer becomes full during the procedure, the messages which were not sent 
+        stay in the outbound buffer and controll returns to mainloop. The next time 
+        this method is called for that particular client, the rest from the last 
+        send procedure is sent first.
 
         Parameters
         ----------
@@ -581,25 +2822,186 @@ class SimpleChatServer:
         """
         # Find the ChatSocket object coresponding to the provided socket object
         curChatUser = self.searchChatUser(cliSock)
+        # Apply the slow consumer policy before more messages are moved into the outbound buffer
+        self.checkSlowConsumer(curChatUser)
         
-        # Send the rest from the last send procedure
-        if curChatUser.sendRest != "":
-            self.sendLoop(curChatUser, cliSock, curChatUser.sendRest)
+        outbound = curChatUser.outbound
+        while not outbound.isPaused and self.hasPendingOutput(curChatUser, outbound=False):
+            # Add the messages in the send queue and the messages broadcast since the last 
+            # send procedure, a batch at a time
+            for data in self.takeOutput(curChatUser, self.LOG_READ_BATCH):
+                outbound.append(data)
+                
+        # Send the messages
+        self.sendLoop(curChatUser, cliSock)
+            
+    def takeOutput(self, curChatUser, maxEntries):
+        """
+        This method takes a batch of messages which should be sent to the given client. 
+        The messages in the send queue are taken first, followed by the messages in the 
+        broadcast log after the cursor of the client. The messages are already encoded, 
+        and the messages from the broadcast log are shared with the other clients. The 
+        messages are compressed if the connection is compressed.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which the messages should be sent to.
+            
+        maxEntries : int
+            The maximum number of messages taken from the send queue, and the maximum 
+            number of entries read from the broadcast log.
+
+        Returns
+        -------
+        List
+            A list of bytes objects which should be sent to the client.
+
+        """
+        frames = []
+        while len(frames) < maxEntries and not curChatUser.sendQueue.empty():
+            frames.append(curChatUser.sendQueue.get())
+        if curChatUser.sendQueue.empty():
+            frames.extend(self.readBroadcastLog(curChatUser, maxEntries))
+            
+        if curChatUser.compressor is None or len(frames) == 0:
+            return frames
+        # The acknowledgement is sent before the compressed data
+        plainFrames = frames[:curChatUser.plainFrames]
+        curChatUser.plainFrames = 0
+        return plainFrames + [self.compressFrames(curChatUser, frames[len(plainFrames):])]
+    
+    def compressFrames(self, curChatUser, frames):
+        """
+        This method compresses the given frames with the compressor of the client and 
+        adds the size before and after the compression and the CPU time used to the metrics.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which the frames should be sent to.
+            
+        frames : List
+            The encoded frames (bytes).
+
+        Returns
+        -------
+        bytes
+            The compressed data.
+
+        """
+        compressor = curChatUser.compressor
+        bytesIn, bytesOut, cpuTime = compressor.bytesIn, compressor.bytesOut, compressor.cpuTime
+        data = compressor.compress(frames)
+        self.metrics["compressionBytesIn"] += compressor.bytesIn - bytesIn
+        self.metrics["compressionBytesOut"] += compressor.bytesOut - bytesOut
+        self.metrics["compressionCpuNanoseconds"] += compressor.cpuTime - cpuTime
+        return data
+            
+    def readBroadcastLog(self, curChatUser, maxEntries=None):
+        """
+        This method returns the messages in the broadcast log of the room after the cursor 
+        of the given client, except the messages sent by the client itself. The cursor is 
+        moved past the returned messages.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which the messages should be sent to.
+            
+        maxEntries : int, optional
+            The maximum number of log entries read. The default is None (no limit).
+
+        Returns
+        -------
+        List
+            A list of bytes objects containing the encoded messages.
+
+        """
+        if curChatUser.room is None:
+            # The client has not joined the chat yet (see joinChat)
+            return []
+        entries, start = curChatUser.room.broadcastLog.read(curChatUser.cursor, maxEntries)
+        curChatUser.cursor = start + len(entries)
+        return [curChatUser.frameOf(msg) for msg, origin in entries if origin is not curChatUser.clientSocket]
+    
+    def checkSlowConsumer(self, curChatUser):
+        """
+        This method applies the slow consumer policy to the given client if the messages 
+        waiting to be sent to the client exceed the backlog limits. Each action is 
+        counted in the metrics of the server.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which should be checked.
+
+        Returns
+        -------
+        None.
+
+        """
+        if curChatUser.isClosing or curChatUser.kickReason or curChatUser.room is None:
+            # The client is already being removed (or kicked) or has not joined the chat yet
+            return
+        broadcastLog = curChatUser.room.broadcastLog
+        end = broadcastLog.end
+        lagMessages = end - curChatUser.cursor
+        # The messages in the send queue are counted in both limits
+        queuedMessages = curChatUser.sendQueue.qsize()
+        queuedBytes = curChatUser.sendQueue.bytes
+        lagBytes = broadcastLog.bytesAfter(curChatUser.cursor)
+        if lagMessages + queuedMessages <= self.maxBacklogMessages and \
+                lagBytes + queuedBytes <= self.maxBacklogBytes:
+            return
         
-        for i in range(curChatUser.sendQueue.qsize()):
-            sendMsg = curChatUser.sendQueue.get()
-            #logging.info(f"Sending \"{sendMsg}\" to {curChatUser.username} {curChatUser.destAddress}")
-            msg = (sendMsg + self.END_OF_MSG).encode()
-            # Send the message
-            self.sendLoop(curChatUser, cliSock, msg)
+        if self.slowConsumerPolicy == "disconnect" or queuedMessages > self.maxBacklogMessages or \
+                queuedBytes > self.maxBacklogBytes:
+            # The messages in the send queue are only sent to this client and can not be 
+            # dropped, so the client is also disconnected if they alone exceed the limits
+            logging.warning("User %s %s is disconnected with %d messages (%d bytes) waiting.", 
+                            curChatUser.username, curChatUser.destAddress, lagMessages + queuedMessages, 
+                            lagBytes + queuedBytes)
+            curChatUser.kickReason = "not reading the messages fast enough."
+            self.closeNext[curChatUser.clientSocket] = None
+            self.wakeMainLoop()
+            self.metrics["slowConsumerDisconnects"] += 1
+        elif self.slowConsumerPolicy == "skip":
+            # Continue from the end of the log and tell the client how many messages it missed
+            curChatUser.cursor = end
+            curChatUser.sendQueue.put(self.frameFor(curChatUser, f"{self.HOSTBOT_UNAME}: " + self.SKIPPED_MSG.format(lagMessages)))
+            self.metrics["slowConsumerSkips"] += 1
+            self.metrics["messagesSkipped"] += lagMessages
+        else:
+            # Move the cursor forward until both limits are respected
+            # (the room left for the log is what the send queue does not already use)
+            newCursor = max(end - (self.maxBacklogMessages - queuedMessages), 
+                            broadcastLog.cursorForBytes(self.maxBacklogBytes - queuedBytes))
+            dropped = newCursor - curChatUser.cursor
+            if dropped > 0:
+                curChatUser.cursor = newCursor
+                self.metrics["slowConsumerDrops"] += 1
+                self.metrics["messagesDropped"] += dropped
+    
+    def hasPendingOutput(self, curChatUser, outbound=True):
+        """
+        This method returns True if there is data that should be sent to the given client. 
+        The outbound buffer is ignored if outbound is False.
+        """
+        return (outbound and len(curChatUser.outbound) != 0) or not curChatUser.sendQueue.empty() or \
+            (curChatUser.room is not None and curChatUser.cursor < curChatUser.room.broadcastLog.end)
 
-    def sendLoop(self, curChatUser, cliSock, msg):
+    def sendLoop(self, curChatUser, cliSock):
         """
-        This method is called by the sendToClient metohd. It executes the send procedure 
-        with a while loop in order to send the message provided as argument to this method.
-        The method returns if the send buffer becomes full for the given client. Closure of 
-        the connection is initiated if and exception is raised while trying to send data to 
-        the client.
+        This method is called by the sendToClient metohd. It sends the outbound buffer 
+        of the client. Several messages are gathered and sent with one system call 
+        (scatter/gather), so the number of system calls does not grow with the number 
+        of messages. At most FLUSH_BYTES bytes are sent each time the method is called, 
+        so that one client with many messages does not delay the others. The method 
+        returns if the send buffer becomes full for the given client. The outbound 
+        buffer keeps the exact position where the next send procedure should continue. 
+        Closure of the connection is initiated if and exception is raised while trying 
+        to send data to the client.
 
         Parameters
         ----------
@@ -608,39 +3010,37 @@ class SimpleChatServer:
             
         cliSock : Socket object
             A reference to the client object for the client that the data should be set to.
-            
-        msg : String
-            The message which should be sent to the client. Should be encoded and contain an 
-            end of message code to indicate the end of the message.
 
         Returns
         -------
         None.
 
         """
-        msgLen = len(msg)
-        totalSentBytes = 0
-        while totalSentBytes < msgLen: 
-            # Continue sending the current message until every byte is sent, 
+        # The number of bytes that can still be sent in this send procedure
+        budget = self.FLUSH_BYTES
+        while len(curChatUser.outbound) != 0 and budget > 0: 
+            # Continue sending until every message is sent, the budget is used, 
             # the send buffer is full or an exception is raised
             try:
-                sentBytes = cliSock.send(msg[totalSentBytes:])
+                sentBytes, gathered = curChatUser.outbound.flush(cliSock, budget, self.MAX_IOV)
             except BlockingIOError:
-                # The socket would block
-                # The buffer is full. Store the last part of the message and return to mainloop
-                curChatUser.sendRest = msg[(totalSentBytes + sentBytes):]
+                # The socket would block. The buffer is full, return to mainloop
                 return
             except OSError as E:
                 # If any other OS exceptions were raised, then end the connection
                 self.connectionErrorHandling(curChatUser, cliSock, str(E))
                 return
             
-            # Add the number of sent bytes to the total 
-            totalSentBytes += sentBytes
+            budget -= sentBytes
+            if sentBytes < gathered:
+                # The outbound buffer of the socket is full. Return to mainloop and 
+                # continue when the socket is writable again
+                return
             
     def recvFromClient(self, cliSock):
         """
-        This method reads the content of the receive buffer of the given client socket.
+        This method reads the content of the receive buffer of the given client socket, 
+        up to the read budget of the client (READ_BUDGET).
         A reference to the client socket must be provided as argument to this method.
 
         Parameters
@@ -656,75 +3056,126 @@ class SimpleChatServer:
         # The reference to the ChatSocket object coresponding to the client socket is obtained
         curChatUser = self.searchChatUser(cliSock)
         
-        logging.info(f"Receiving from client {curChatUser.destAddress}")
+        logging.debug("Receiving from client %s", curChatUser.destAddress)
 
-        # Extracts the rest of the previous reception. This variable contains 
-        # a non empty string whenever the previous reception received a portion of the next message 
-        # in the same process.
-        data_recv = curChatUser.recvRest
-        # Definition of a variable for the new data
-        cur_recv = ""
+        decoder = curChatUser.decoder
+        received = 0
+        # Receive until the budget is used, the receive buffer of the socket is empty or the 
+        # decoder has no space for another receive call (an incomplete message of the maximum size)
+        while received < self.readBudget and len(decoder) <= decoder.maxFrameSize:
+            try:
+                # Read from the buffer of the client socket directly into the buffer of the decoder
+                recvCount = decoder.recvFrom(cliSock)
+            except BlockingIOError:
+                # The receive buffer of the socket is empty
+                break
+            except OSError as E:
+                # If an OS exception is raised, log the error and endd the connection
+                self.connectionErrorHandling(curChatUser, cliSock, str(E))
+                return
+                
+            if recvCount == 0:
+                if received == 0:
+                    # If the recv method returned nothing, then the connection is closed.
+                    # The data that was sent before an EOMsg was found will be dropped
+                    self.connectionErrorHandling(curChatUser, cliSock)
+                    return
+                # The messages received before are handled first. The socket is 
+                # readable again in the next iteration.
+                break
+            
+            received += recvCount
+            if recvCount < decoder.recvSize:
+                # The receive buffer of the socket is empty
+                break
         
-        try:
-            # Read from the buffer of the client socket
-            cur_recv = cliSock.recv(4096).decode()
-        except OSError as E:
-            # If an OS exception is raised, log the error and endd the connection
-            self.connectionErrorHandling(curChatUser, cliSock, str(E))
-            return
+        # Handle the messages contained in the received data
+        self.processReceived(curChatUser)
+        
+    def processReceived(self, curChatUser, data=b""):
+        """
+        This method handles data received from a client. The data is split into 
+        messages by the decoder of the client. The first message of a client must 
+        contain the username. The other messages are forwarded to all other clients. 
+        Clients that are sending too many messages in short succession or messages 
+        larger than the maximum frame size are removed.
+        
+        At most DISPATCH_BUDGET messages are handled in one call. If there may be more, 
+        the client is added to carryOver and the next messages are handled in the next 
+        iteration of the main loop. Nothing more is received from the client until then.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The ChatSocket object of the client which sent the data.
             
-        if len(cur_recv) == 0:
-            # If the recv method returned nothing, then the connection is closed.
-            # The data that was sent before an EOMsg was found will be dropped
-            self.connectionErrorHandling(curChatUser, cliSock)
+        data : bytes, optional
+            The data received from the client. The default is b"" (the data has been 
+            received directly into the decoder).
+
+        Returns
+        -------
+        None.
+
+        """
+        # The socket of the client, which should not receive its own messages
+        cliSock = curChatUser.clientSocket
+        # Any data received shows that the connection is alive (see checkHeartbeat)
+        curChatUser.lastRecvMonotonic = time.monotonic()
+        
+        try:
+            # Take the complete messages received, up to the budget. Incomplete messages and 
+            # the messages over the budget stay in the decoder.
+            frames = curChatUser.decoder.feed(data, self.dispatchBudget)
+        except FrameTooLargeError as E:
+            logging.warning("User %s %s: %s", curChatUser.username, curChatUser.destAddress, E)
+            # A reason for the removal is provided
+            curChatUser.kickReason = f"sending a message larger than {curChatUser.decoder.maxFrameSize} bytes."
+            # The removal is initiated
+            self.closeNext[curChatUser.clientSocket] = None
             return
         
-        # The received data is added to the data from the previous receive procedure
-        data_recv = data_recv + cur_recv
+        # The client is moved to the end of the carry-over set if the budget is used up, 
+        # so the clients over the budget are served in turn.
+        wasCarried = curChatUser in self.carryOver
+        self.carryOver.pop(curChatUser, None)
+        if len(frames) == self.dispatchBudget:
+            self.metrics["dispatchCarryOvers"] += 1
+            self.carryOver[curChatUser] = None
+        if wasCarried != (curChatUser in self.carryOver):
+            # Stop or start receiving from the client
+            self.interestChanged[curChatUser] = None
         
-        logging.info(f"Data received: {data_recv}")
+        # Create a list of the messages. The answers to the heartbeats (pong frames) are not messages.
+        msgList = [frame.text.replace("\n", "") for frame in frames if frame.frameType != FrameType.pong]
+        if len(msgList) == 0:
+            # No message is complete yet
+            return
         
-        # Cleaning up the received data and create a list of all messages 
-        # contained in the received bytes.
-        msgList = data_recv.replace("\n", "").split(self.END_OF_MSG)
-        #logging.info(f"The msgList for {curChatUser.username}:" + str(msgList))
+        self.metrics["receivedBatches"] += 1
+        if self.logPayloadSample and self.metrics["receivedBatches"] % self.logPayloadSample == 0:
+            # The messages are only written to the log for a sample of the receives. The 
+            # messages are copied, since the list is changed before the log thread formats them.
+            logging.info("Data received from %s: %s", curChatUser.destAddress, LogPayload(tuple(msgList)))
         
-        # Determine if the use is spaming (10 messages within a second)
-        if (datetime.now() - curChatUser.lastRecvTime).seconds <= self.SPAM_SECONDS:
-            # increment the counter with the number of messages in the message list if 
-            # they were received within the given number of seconds after the first receive (self.SPAM_SECONDS)
-            curChatUser.recvCounter += len(msgList)
-            logging.info(f"Number of receptions for {curChatUser.username}: {str(curChatUser.recvCounter)}")
-            if curChatUser.recvCounter >= self.SPAM_MSG_NUMBER:
-                # User is spaming SPAM_MSG_NUMBER messages in SPAM_SECONDS seconds
+        # The time stamp is shown in the list of connections
+        curChatUser.lastRecvTime = datetime.now()
+        # Determine if the user is spaming (sending more messages than the rate limits allow)
+        delay = self.rateLimiter.consume(curChatUser, len(msgList))
+        if delay > 0:
+            if self.rateLimitPolicy == "kick" or delay > self.MAX_THROTTLE_SECONDS:
                 # The user will as a result be removed
-                logging.warning(f"User {curChatUser.username} sent {self.SPAM_MSG_NUMBER} messages within {self.SPAM_SECONDS} seconds. " + 
-                                "The user will be kicked for this! Type 1")
+                logging.warning("User %s %s exceeded the rate limit. The user will be kicked for this!", 
+                                curChatUser.username, curChatUser.destAddress)
+                self.metrics["rateLimitKicks"] += 1
                 # A reason for the removal is provided
-                curChatUser.kickReason = "sending too many messages at the same time"
+                curChatUser.kickReason = "sending too many messages in rapid succession."
                 # The removal is initiated
-                self.closeNext.append(curChatUser.clientSocket)
+                self.closeNext[curChatUser.clientSocket] = None
                 return
-        elif len(msgList) > self.SPAM_MSG_NUMBER:
-            # The user has sent too many messages (more than SPAM_MSG_NUMBER)
-            # The user is removed
-            logging.warning(f"User {curChatUser.username} sent {self.SPAM_MSG_NUMBER} in rappid succession." + 
-                            "The user will be kicked for this! Type 2")
-            # A reason for the removal is provided
-            curChatUser.kickReason = "Sending too many messages in rapid succession!"
-            # The removal is initiated
-            self.closeNext.append(curChatUser.clientSocket)
-            return
-        else:        
-            # Adding a new timestamp for the last receive time attribute:
-            curChatUser.lastRecvTime = datetime.now()
-            # Reset counter
-            curChatUser.recvCounter = 0
+            # The received messages are handled, but the next messages are read after the delay
+            self.throttleClient(curChatUser, delay)
             
-        # The last message in the msgList is stored (emplty string, if the last messsage is complete)
-        curChatUser.recvRest = msgList.pop()
-        
-
         if curChatUser.username == "":
             # If there is no username registered for the socket, then 
             # the message must be the first message (connection message), 
@@ -739,45 +3190,527 @@ class SimpleChatServer:
             if not bool(usernameMatch):
                 # If the first message was not identified as the the connection message, 
                 # then remove the connection.
-                logging.info(f"The client {curChatUser.destAddress} did not provide a valid connection message.")
+                logging.info("The client %s did not provide a valid connection message.", curChatUser.destAddress)
                 # A reason for the removal is provided
                 curChatUser.kickReason = "not providing a valid username for identification."
                 # The removal is initiated
-                self.closeNext.append(curChatUser.clientSocket)
+                self.closeNext[curChatUser.clientSocket] = None
                 return
                 
-            # Extract the username from the match object
-            curChatUser.username = usernameMatch.groups()[0]
-            # Send a join message to all clients
-            self.populateSendQueues(f"User {curChatUser.username} has joined the chat!", cliSock)
+            # Find the version of the protocol offered by the client
+            protocolMatch = self.protocolPattern.search(usernameMsg)
+            protocol = int(protocolMatch.groups()[0]) if protocolMatch else PROTOCOL_V1
+            # Find the checksum of the dictionary if the client offered compression
+            compressionMatch = self.compressionPattern.search(usernameMsg)
+            dictionary = int(compressionMatch.groups()[0], 16) if compressionMatch else None
+            # Find the number of old messages the client wants
+            historyMatch = self.historyPattern.search(usernameMsg)
+            history = int(historyMatch.groups()[0]) if historyMatch else None
+            # Find the room and the sequence number if the client resumes after a lost connection
+            resumeMatch = self.resumePattern.search(usernameMsg)
+            resume = (resumeMatch.groups()[0], int(resumeMatch.groups()[1])) if resumeMatch else None
+            # Extract the username from the match object and add the client to the chat
+            self.joinChat(curChatUser, usernameMatch.groups()[0], protocol, dictionary, history, resume)
             
         for msg in msgList:
             # For each message in the msgList 
-            self.populateSendQueues(msg, cliSock)
+            roomCommand = self.roomCommandPattern.search(msg)
+            historyCommand = self.historyCommandPattern.search(msg)
+            if bool(roomCommand):
+                # The message is a room command, which is not forwarded to the other users
+                self.processRoomCommand(curChatUser, *roomCommand.groups())
+            elif bool(historyCommand):
+                # The user requests older messages
+                self.processHistoryCommand(curChatUser, *historyCommand.groups())
+            else:
+                self.populateSendQueues(msg, cliSock, room=curChatUser.room)
+    
+    def throttleClient(self, curChatUser, delay):
+        """
+        This method stops reading from the given client for the given number of seconds. 
+        The received data stays in the receive buffer of the socket, so a client which 
+        continues to send is slowed down by TCP flow control.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which exceeded the rate limits.
+            
+        delay : float
+            The number of seconds until the client is within the rate limits again.
+
+        Returns
+        -------
+        None.
+
+        """
+        logging.info("User %s %s is throttled for %.2f seconds.", curChatUser.username, curChatUser.destAddress, delay)
+        self.metrics["rateLimitThrottles"] += 1
+        curChatUser.throttledUntil = time.monotonic() + delay
+        self.throttledUsers[curChatUser] = self.scheduleTimer(delay, self.resumeThrottled, curChatUser)
+        # The messages left over the dispatch budget are handled when the throttling ends
+        self.carryOver.pop(curChatUser, None)
+        self.interestChanged[curChatUser] = None
+        
+    def setRateLimit(self, username, rate, burst):
+        """
+        This method overrides the rate limit of the user with the given username.
+
+        Parameters
+        ----------
+        username : String
+            The username of the user.
+            
+        rate : float
+            The number of messages the user can send per second on average.
+            
+        burst : int
+            The number of messages the user can send at once.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.rateLimiter.setOverride(username, rate, burst)
+        logging.info(f"The rate limit of {username} is set to {rate} messages per second (burst {burst}).")
+        
+    def joinChat(self, curChatUser, username, protocol=PROTOCOL_V1, dictionary=None, history=None, resume=None):
+        """
+        This method adds a client to the chat when it has sent its username. If the 
+        client offered a version of the protocol which is supported by the server, or 
+        compression with the same preset dictionary as the server, the offers are 
+        acknowledged (with protocol 1) and used for the rest of the connection. The 
+        replay window, which is the largest transfer to a client, is therefore sent 
+        compressed. If the client chose the number of old messages it wants, the number 
+        (at most MAX_HISTORY_PAGE) is acknowledged and used instead of the replay window. 
+        The client enters the default room (see enterRoom).
+        
+        A client which lost the connection resumes with the room and the sequence number 
+        of the next message it has not received. If the room exists and the sequence 
+        number is not after the end of the room, the resume is acknowledged and the client 
+        only gets the messages it has missed. If the leave message of the user has not 
+        been sent yet (see leaveRoom), no leave or join message is sent.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which sent its username.
+            
+        username : String
+            The username of the client.
+            
+        protocol : int, optional
+            The version of the protocol offered by the client. The default is PROTOCOL_V1.
+            
+        dictionary : int, optional
+            The checksum of the preset dictionary of the client if it offered 
+            compression. The default is None.
+            
+        history : int, optional
+            The number of old messages the client wants when it enters a room. 
+            The default is None (the replay window of the server).
+            
+        resume : tuple, optional
+            The name of the room and the sequence number sent by a client which resumes. 
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        offers = []
+        if protocol != PROTOCOL_V1 and protocol in self.PROTOCOLS:
+            offers.append(PROTOCOL_OFFER.format(protocol))
+        if self.compression and dictionary == dictionaryId():
+            offers.append(COMPRESSION_OFFER.format(dictionary))
+        if history is not None:
+            curChatUser.replayMessages = min(history, self.MAX_HISTORY_PAGE)
+            offers.append(HISTORY_OFFER.format(curChatUser.replayMessages))
+        room = self.rooms[self.DEFAULT_ROOM]
+        resumeFrom = None
+        if resume is not None and resume[0] in self.rooms and resume[1] <= self.rooms[resume[0]].broadcastLog.end:
+            # The sequence numbers of the room are known (a room which is kept in memory 
+            # starts from 0 again when the server is restarted)
+            room, resumeFrom = self.rooms[resume[0]], resume[1]
+            offers.append(RESUME_OFFER.format(*resume))
+            
+        if len(offers) != 0:
+            # Acknowledge the offers. The following messages use the new protocol and are compressed.
+            curChatUser.sendQueue.put(self.frameFor(curChatUser, ackMessage(offers)))
+            curChatUser.plainFrames = curChatUser.sendQueue.qsize()
+            if PROTOCOL_OFFER.format(protocol) in offers:
+                curChatUser.protocol = protocol
+                curChatUser.decoder = curChatUser.decoder.switchTo(DECODERS[protocol]())
+            if dictionary is not None and COMPRESSION_OFFER.format(dictionary) in offers:
+                curChatUser.compressor = StreamCompressor()
+            
+        self.chatUsers.setUsername(curChatUser, username)
+        # The leave message of an earlier connection of the user, which has not been sent yet
+        pendingRoom = self.takePendingLeave(username)
+        # The user is still a member of the room for the other users
+        isSilent = resumeFrom is not None and pendingRoom is room
+        if pendingRoom is not None and not isSilent:
+            # The user did not resume in the same room. The leave message is sent now.
+            self.populateSendQueues(username, None, FrameType.leave, pendingRoom)
+        if resumeFrom is not None:
+            self.metrics["resumes"] += 1
+        self.enterRoom(curChatUser, room, resumeFrom, announce=not isSilent)
+        
+    def getRoom(self, name):
+        """
+        This method returns the room with the given name. The room is created if it 
+        does not exist.
+        """
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = ChatRoom(name, self.historySize, self.historyBytes, self.historyDir)
+            room.nextLogTrim = self.LOG_TRIM_INTERVAL
+        return room
+        
+    def enterRoom(self, curChatUser, room, resumeFrom=None, announce=True):
+        """
+        This method adds a client to the given room. The name of the room and the replay 
+        window of the history of the room (or the number of messages chosen by the client) 
+        are added to the send queue, followed by the start new messages line, and a join 
+        message is sent to the members of the room. A client which resumes after a lost 
+        connection only gets the messages from the given sequence number.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which enters the room. It must not be in another room.
+            
+        room : ChatRoom object
+            The room.
+            
+        resumeFrom : int, optional
+            The sequence number of the first message the client has not received. 
+            The default is None (the client gets the replay window).
+            
+        announce : bool, optional
+            The join message is not sent if this flag is False. The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        curChatUser.sendQueue.put(self.frameFor(curChatUser, room.name, FrameType.room))
+        replayMessages = self.replayMessages if curChatUser.replayMessages is None else curChatUser.replayMessages
+        # The replayed messages are counted in the backlog limits of the client (see 
+        # checkSlowConsumer), so the replay uses at most half of the message limit
+        replayLimit = self.maxBacklogMessages // 2
+        with room.broadcastLog.lock:
+            # The history and the cursor are read together, so no message is sent twice or lost
+            if resumeFrom is None:
+                history, curChatUser.historyBefore = room.history.replay(min(replayMessages, replayLimit), self.replaySeconds)
+            else:
+                # Only the messages the client has missed (as far as they are in the history)
+                history, curChatUser.historyBefore = room.history.replay(min(room.broadcastLog.end - resumeFrom, replayLimit))
+            curChatUser.cursor = room.broadcastLog.end
+            curChatUser.room = room
+            room.members[curChatUser] = None
+        for item in history:
+            # The existing thread messages (the replay window of the history) are added 
+            # to the send queue. This way, the client will receive the messages that were 
+            # sent in the room before the client joined the room. The messages are 
+            # already encoded, so the same bytes object is shared by all clients.
+            for data in self.replayFrames(curChatUser, item):
+                curChatUser.sendQueue.put(data)
+        # Add the start new messages indication to indicate that the next messages are sent 
+        # after the user entered the room. It contains the sequence number of the next message.
+        curChatUser.sendQueue.put(self.frameFor(curChatUser, "", FrameType.historyStart, curChatUser.cursor))
+        # The replayed messages are counted in the backlog limits of the client
+        self.checkSlowConsumer(curChatUser)
+        self.notifyWritable(curChatUser)
+        
+        if announce:
+            # Send a join message to the members of the room
+            self.populateSendQueues(curChatUser.username, curChatUser.clientSocket, FrameType.join, room)
+        # The host bot of the room sends messages while the room has members
+        self.startHostTimer(room)
+        
+    def replayFrames(self, curChatUser, item):
+        """
+        This method returns the data sent to the given client for an item of the replay 
+        window of the history. The items of a history kept on disk are regions of the 
+        history log, which contain protocol 2 frames. A region is sent with os.sendfile 
+        if the client uses protocol 2 without compression. Otherwise the region is read, 
+        and the frames are encoded again for a protocol 1 client.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which the history is sent to.
+            
+        item : tuple or LogRegion object
+            A message encoded with each version of the protocol (HistoryBuffer) or a 
+            region of the history log (HistoryLog).
+
+        Returns
+        -------
+        List
+            The data (bytes or LogRegion objects) that should be added to the send queue.
+
+        """
+        if not isinstance(item, LogRegion):
+            return [curChatUser.frameOf(item)]
+        if curChatUser.protocol == PROTOCOL_V2 and curChatUser.compressor is None and self.SENDFILE:
+            self.metrics["historySendfileBytes"] += len(item)
+            return [item]
+        data = item.read()
+        if curChatUser.protocol == PROTOCOL_V2:
+            # The frames are compressed together with the other messages
+            return [data]
+        frames = DECODERS[PROTOCOL_V2](maxFrameSize=len(data)).feed(data)
+        return [self.frameFor(curChatUser, frame.text, FrameType(frame.frameType)) for frame in frames]
+        
+    def leaveRoom(self, curChatUser, deferred=False):
+        """
+        This method removes a client from its room, and sends a leave message to the 
+        other members of the room. Nothing is done if the client is not in a room. If 
+        deferred is True (the connection was lost), the leave message is sent after 
+        RESUME_GRACE seconds, unless the user resumes before (see sendPendingLeave).
+        """
+        room = curChatUser.room
+        if room is None:
+            return
+        if deferred and curChatUser.username != "":
+            # A pending leave message of an earlier connection with the same username is 
+            # replaced. It is sent at once if that connection was in another room.
+            previousRoom = self.takePendingLeave(curChatUser.username)
+            if previousRoom is not None and previousRoom is not room:
+                self.populateSendQueues(curChatUser.username, None, FrameType.leave, previousRoom)
+            # The entry is a list [room, timer], which is given to the timer so the 
+            # callback can check that the entry has not been replaced
+            pending = [room, None]
+            pending[1] = self.scheduleTimer(self.RESUME_GRACE, self.sendPendingLeave, curChatUser.username, pending)
+            self.pendingLeaves[curChatUser.username] = pending
+        else:
+            self.populateSendQueues(curChatUser.username, curChatUser.clientSocket, FrameType.leave, room)
+        with room.broadcastLog.lock:
+            room.members.pop(curChatUser, None)
+            room.logWaiters.pop(curChatUser, None)
+            curChatUser.room = None
+            
+    def takePendingLeave(self, username):
+        """
+        This method removes the pending leave message of the given user and returns the 
+        room of the message. None is returned if the user has no pending leave message.
+        """
+        pending = self.pendingLeaves.pop(username, None)
+        if pending is None:
+            return None
+        room, timer = pending
+        timer.cancel()
+        return room
     
-    def populateSendQueues(self, msg, cliSock):
+    def sendPendingLeave(self, username, pending):
+        """
+        This method is called by the timer of a pending leave message, when the user 
+        lost the connection RESUME_GRACE seconds ago and has not resumed. The leave 
+        message is sent to the members of the room.
         """
-        This method is adding a message to the send queues of each client socket, 
-        except the socket given as argument to this method (cliSock). The message 
-        is provided as argument (msg).
+        if self.pendingLeaves.get(username) is not pending:
+            # The message has been taken or replaced by a newer pending leave message
+            return
+        room, timer = self.pendingLeaves.pop(username)
+        self.populateSendQueues(username, None, FrameType.leave, room)
+            
+    def processRoomCommand(self, curChatUser, command, name=None):
+        """
+        This method executes a room command sent by a user:
+            /join <room> - the user leaves the current room and enters the given room. 
+                           The room is created if it does not exist.
+            /leave - the user goes back to the default room.
+            /rooms - the names of the rooms are sent to the user.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which sent the command.
+            
+        command : String
+            The name of the command (join, leave or rooms).
+            
+        name : String, optional
+            The name of the room given to the join command. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        if command == "rooms":
+            reply = "Rooms: " + ", ".join(f"{room.name} ({len(room)})" for room in list(self.rooms.values()))
+        elif command == "join" and (name is None or not bool(self.roomPattern.search(name))):
+            reply = "Please give a room name of at most 32 letters, digits, _ or -. Eks: /join sports"
+        elif command == "join" and name not in self.rooms and len(self.rooms) >= self.MAX_ROOMS:
+            reply = f"The room {name} could not be created, because there are too many rooms."
+        else:
+            room = self.getRoom(self.DEFAULT_ROOM if command == "leave" else name)
+            if room is curChatUser.room:
+                reply = f"You are already in the room {room.name}."
+            else:
+                self.leaveRoom(curChatUser)
+                self.enterRoom(curChatUser, room)
+                return
+        curChatUser.sendQueue.put(self.frameFor(curChatUser, f"{self.HOSTBOT_UNAME}: {reply}"))
+        self.checkSlowConsumer(curChatUser)
+        self.notifyWritable(curChatUser)
+        
+    def processHistoryCommand(self, curChatUser, count=None, before=None):
+        """
+        This method sends a page of old messages of the room to a user which sent the 
+        command /history [count] [sequence]. The page contains the newest messages before 
+        the sequence number, or before the oldest message sent to the user if no sequence 
+        number is given. The page is followed by a history page frame, which contains 
+        the sequence number of the first message in the page, so the user can request 
+        the next page.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The client which sent the command.
+            
+        count : String, optional
+            The number of messages (at most MAX_HISTORY_PAGE). The default is None (HISTORY_PAGE).
+            
+        before : String, optional
+            The sequence number. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        room = curChatUser.room
+        count = self.HISTORY_PAGE if count is None else min(int(count), self.MAX_HISTORY_PAGE)
+        # The page is counted in the backlog limits of the client (see checkSlowConsumer)
+        count = min(count, self.maxBacklogMessages // 2)
+        before = curChatUser.historyBefore if before is None else int(before)
+        history, first = room.history.replay(count, None, before)
+        for item in history:
+            for data in self.replayFrames(curChatUser, item):
+                curChatUser.sendQueue.put(data)
+        curChatUser.sendQueue.put(self.frameFor(curChatUser, str(first), FrameType.historyPage))
+        curChatUser.historyBefore = min(curChatUser.historyBefore, first)
+        self.metrics["historyPages"] += 1
+        # The page is counted in the backlog limits of the client
+        self.checkSlowConsumer(curChatUser)
+        self.notifyWritable(curChatUser)
+        
+    def populateSendQueues(self, msg, cliSock, frameType=FrameType.chat, room=None):
+        """
+        This method is broadcasting a message to each member of the room, except the 
+        socket given as argument to this method (cliSock). The message is provided 
+        as argument (msg). The message is appended once to the shared broadcast log 
+        of the room, so the cost does not depend on the number of clients. Only the 
+        members which had received all previous messages are notified. The other 
+        members will find the message when they are writable again. The slow consumer 
+        policy is applied to these members at once, so a client whose socket never 
+        becomes writable is handled as well.
         
         Parameters
         ----------
         cliSock : Socket
-            Client socket which should not receive the message.
+            Client socket which should not receive the message. None if all clients 
+            should receive the message.
             
         msg : String
-            The message that should be forwarded to all clients.
+            The message that should be forwarded to all clients. For a control 
+            frame, the field of the event (e.g. the username).
+            
+        frameType : FrameType, optional
+            The type of the frame. The default is FrameType.chat.
+            
+        room : ChatRoom object, optional
+            The room the message is sent to. The default is None (the default room).
+        
+        """
+        if room is None:
+            room = self.rooms[self.DEFAULT_ROOM]
+        with room.broadcastLog.lock:
+            # The message is encoded once for each version of the protocol. All clients using 
+            # the same version are sent the same bytes object. The sequence number of the 
+            # message is its offset in the broadcast log of the room.
+            frames = self.frameMessage(msg, frameType, room.broadcastLog.end)
+            # The size of a message is counted as its size with protocol 1
+            size = len(frames[0])
+            # Add the message to the chat history
+            room.history.append(frames, size)
+            # Add the message to the broadcast log
+            room.broadcastLog.append(frames, cliSock, size)
+        
+        for member in list(room.members):
+            if member not in room.logWaiters:
+                # The member is behind, so the new message may exceed its backlog limits
+                self.checkSlowConsumer(member)
         
+        while len(room.logWaiters) != 0:
+            # Notify the members waiting for new messages
+            self.notifyWritable(room.logWaiters.popitem()[0])
+            
+        if len(room.broadcastLog) >= room.nextLogTrim:
+            # Remove the messages which all members have received
+            self.trimBroadcastLog(room)
+            
+    def frameMessage(self, msg, frameType=FrameType.chat, sequence=0):
+        """
+        This method encodes a message with each version of the protocol, so that 
+        it can be sent to the clients.
+
+        Parameters
+        ----------
+        msg : String
+            The message that should be sent.
+            
+        frameType : FrameType, optional
+            The type of the frame (protocol 2). The default is FrameType.chat.
+            
+        sequence : int, optional
+            The sequence number of the message (protocol 2). The default is 0.
+
+        Returns
+        -------
+        tuple
+            The encoded message (bytes) for each version of the protocol. 
+            The frameOf() method of ChatSocket picks the version of a client.
+
+        """
+        return tuple(encoder.encode(msg, frameType, sequence) for encoder in self.frameEncoders)
+    
+    def frameFor(self, curChatUser, msg, frameType=FrameType.chat, sequence=0):
+        """
+        This method encodes a message which is only sent to the given client.
+        """
+        return self.frameEncoders[curChatUser.protocol - 1].encode(msg, frameType, sequence)
+    
+    def trimBroadcastLog(self, room):
+        """
+        This method removes the messages which have been read by all members of the 
+        room from the broadcast log of the room. It is called each time LOG_TRIM_INTERVAL 
+        messages have been added, so the cost of finding the lowest cursor is shared by 
+        many messages. The slow consumer policy is applied when the messages are added 
+        (see populateSendQueues), so a client which does not read cannot make the log 
+        grow without limit.
+
+        Parameters
+        ----------
+        room : ChatRoom object
+            The room whose broadcast log should be trimmed.
+
+        Returns
+        -------
+        None.
+
         """
-        # Add the message to the chat history
-        self.history.append(msg)
-        for user in self.chatUsers:
-            # For each client socket check that the socket is not the socket 
-            # provided as argument to this method.
-            if user.clientSocket != cliSock:     
-                # Add the message in the send queue
-                user.sendQueue.put(msg)
+        members = list(room.members)
+        # Clients which enter the room get their cursor when they enter
+        room.broadcastLog.trim(min((user.cursor for user in members), default=room.broadcastLog.end))
+        room.nextLogTrim = len(room.broadcastLog) + self.LOG_TRIM_INTERVAL
                 
     def connectionErrorHandling(self, curChatUser, cliSock, E=""):
         """
@@ -801,11 +3734,11 @@ class SimpleChatServer:
         """
         if not curChatUser.isBroken:
             # Check fi the error has already been registered
-            logging.warning(f"The connection with the client {curChatUser.username} {curChatUser.destAddress} has ended. {E}")
+            logging.warning("The connection with the client %s %s has ended. %s", curChatUser.username, curChatUser.destAddress, E)
             # Set the isBroken flag to indicate that the connection is broken.
             curChatUser.isBroken = True
             # Add the socket ot the close next list so that it will be removed
-            self.closeNext.append(cliSock)
+            self.closeNext[cliSock] = None
                 
     def removeClient(self, cliSock):
         """
@@ -825,25 +3758,31 @@ class SimpleChatServer:
         """
         # Obtian the ChatSocket object for the client
         curChatUser = self.searchChatUser(cliSock)
-        logging.info(f"The connection to {curChatUser.username} {curChatUser.destAddress} is closing.")
-        # Send a message to all other users informing that the user is no longer active
-        self.populateSendQueues(f"{self.HOSTBOT_UNAME}: User {curChatUser.username} left the chat.", cliSock)
-        # Remove socket from the list of readable sockets to avoid receiving from the client
-        self.checkReadable.remove(cliSock)
-        # The socket is also removed from the list for error checking
-        self.checkError.remove(cliSock)
+        logging.info("The connection to %s %s is closing.", curChatUser.username, curChatUser.destAddress)
+        # Send a message to the other users in the room informing that the user is no longer active. 
+        # If the connection was lost, the message is delayed, so the user can resume.
+        self.leaveRoom(curChatUser, deferred=curChatUser.isBroken)
+        # Stop receiving from the client. The socket is only watched for writability 
+        # until the disconnect message has been sent.
+        curChatUser.isClosing = True
+        self.interestChanged[curChatUser] = None
         
         if not curChatUser.isBroken:
             # The connection is not jet terminated
             # Add the disconnect message to the sendQueue of the client
-            disconnectMessage = self.KICK_MSG + curChatUser.kickReason
-            curChatUser.sendQueue.put(disconnectMessage)
+            curChatUser.sendQueue.put(self.frameFor(curChatUser, curChatUser.kickReason, FrameType.kick))
+            self.notifyWritable(curChatUser)
             # Add the socket to the list of sockets which are in the removal process
             self.finishRemovalList.append(cliSock) 
         else:
             # The connection is broken
             # Finish the removal
             self.chatUsers.remove(curChatUser)
+            self.rateLimiter.remove(curChatUser)
+            if curChatUser in self.throttledUsers:
+                self.throttledUsers.pop(curChatUser).cancel()
+            self.carryOver.pop(curChatUser, None)
+            self.unregisterClient(curChatUser)
             cliSock.close()
     
     def finishRemoval(self, cliSock):
@@ -858,9 +3797,15 @@ class SimpleChatServer:
             A reference to the client socket object that should be closed and removed.
             
         """
+        curChatUser = self.searchChatUser(cliSock)
         # Remove the ChatSocket objecct from chatUser list
-        self.chatUsers.remove(self.searchChatUser(cliSock))
-        # Close the socket
+        self.chatUsers.remove(curChatUser)
+        self.rateLimiter.remove(curChatUser)
+        if curChatUser in self.throttledUsers:
+            self.throttledUsers.pop(curChatUser).cancel()
+        self.carryOver.pop(curChatUser, None)
+        # Stop watching the socket and close it
+        self.unregisterClient(curChatUser)
         cliSock.close()
         
     def listConnections(self):
@@ -869,23 +3814,41 @@ class SimpleChatServer:
         and prints the list to the terminal.
         """
         # Creating the column titles
-        outString = "{:>15}{:>20}{:>30}\n".format("Username", "IPv4 Address/Port", "Time last received")
-        outString += "{:>15}{:>20}{:>30}\n".format("--------", "--------", "--------")
+        outString = "{:>15}{:>15}{:>20}{:>30}\n".format("Username", "Room", "IPv4 Address/Port", "Time last received")
+        outString += "{:>15}{:>15}{:>20}{:>30}\n".format("--------", "--------", "--------", "--------")
         
         for connection in self.chatUsers:
-            # For each object in the chatUsers list 
+            # For each object in the chatUsers registry 
             # Get the port and address that the client socket is conected to (address and port of the client)
             portAndAddress = str(connection.destAddress[0]) + ":" + str(connection.destAddress[1])
             # Get the username of the client
             username = connection.username
             # Get the date and time of the last received message.
             lastReceived = str(connection.lastRecvTime)
+            # Get the name of the room of the client
+            roomName = connection.room.name if connection.room is not None else ""
             # Add the line for the current client 
-            outString += f"{username:>15}{portAndAddress:>20}{lastReceived:>30}\n"
+            outString += f"{username:>15}{roomName:>15}{portAndAddress:>20}{lastReceived:>30}\n"
         
         # print the list of conencted users.
         print(outString)
         
+    def listMetrics(self):
+        """
+        This method prints the counters of the service to the terminal.
+        """
+        outString = "{:>30}{:>15}\n".format("Counter", "Value")
+        outString += "{:>30}{:>15}\n".format("--------", "--------")
+        for name, value in sorted(self.metrics.items()):
+            outString += f"{name:>30}{value:>15}\n"
+        if self.metrics["compressionBytesOut"] != 0:
+            # The ratio between the size before and after compression, and the CPU time per MB compressed
+            ratio = self.metrics["compressionBytesIn"] / self.metrics["compressionBytesOut"]
+            cpuCost = self.metrics["compressionCpuNanoseconds"] / 1e6 / (self.metrics["compressionBytesIn"] / 1e6)
+            outString += f"{'compressionRatio':>30}{ratio:>15.2f}\n"
+            outString += f"{'compressionMsPerMB':>30}{cpuCost:>15.2f}\n"
+        print(outString)
+        
     def kickUser(self, username, reason=""):
         """
         This method is used to manualy disconnect a user from the server.
@@ -904,19 +3867,21 @@ class SimpleChatServer:
             The method returns True if the username was found and is beeing removed.
             It returns False if the username was not found.
         """
-        for user in self.chatUsers:
-            # For each client in the list of connected users
-            if user.username == username:
-                # If the username was found then add the reason
-                user.kickReason = reason
-                # Add the socket to the closeNext list to initiate the remove procedure
-                self.closeNext.append(user.clientSocket)
-                
-                logging.info(f"User {username} is removed by admin with the following reason: {user.kickReason}")
-                # Return true to confirm that the client is removed
-                return True
-        # If the user was not recognised, then return false
-        return False
+        # Find the client with the given username
+        user = self.chatUsers.getByUsername(username)
+        if user is None:
+            # If the user was not recognised, then return false
+            return False
+        
+        # If the username was found then add the reason
+        user.kickReason = reason
+        # Add the socket to the closeNext list to initiate the remove procedure
+        self.closeNext[user.clientSocket] = None
+        self.wakeMainLoop()
+        
+        logging.info(f"User {username} is removed by admin with the following reason: {user.kickReason}")
+        # Return true to confirm that the client is removed
+        return True
     
     def listCommands(self):
         """
@@ -977,14 +3942,13 @@ class SimpleChatServer:
         print("Service is shutting down.")
         print("    Removing active connections.", end="\r")
         logging.info("The service is stoping due to an \"exit\" command issued by admin.")
-        # Remove the server socket from the check receivable list to avoid new connections
-        self.checkReadable.pop(0)
+        # The main thread stops accepting new connections when the stopUserInteraction flag is set
         
         # Add all sockets to the close next list and add the reason for the disconection.
         for curChatUser in self.chatUsers:
             curChatUser.kickReason = reason
-            if not curChatUser.clientSocket in self.closeNext:
-                self.closeNext.append(curChatUser.clientSocket)
+            self.closeNext[curChatUser.clientSocket] = None
+        self.wakeMainLoop()
                     
         while len(self.chatUsers) > 0:
             # Wait until all connections are removed
@@ -995,6 +3959,7 @@ class SimpleChatServer:
         logging.info("Stop procedure status: All connections are removed!")
         # Set the stopApplication flag in order to stop the main thread
         self.stopApplication.set()
+        self.wakeMainLoop()
     
     def waitIndication(self):
         """
@@ -1030,14 +3995,795 @@ class SimpleChatServer:
         ChatSocket object corresponding to the given client socket
 
         """
-        for user in self.chatUsers:
-            if user.clientSocket == cliSock:
-                # Return the ChatSocket object that corresponds to the cliSock object
-                return(user)
+        # Look up the ChatSocket object that corresponds to the cliSock object
+        user = self.chatUsers.getBySocket(cliSock)
+        if user is None:
+            # The user was not found
+            raise Exception("The user was not found in the chatUser list.")
+        return(user)
+
+class AsyncChatServer(SimpleChatServer):
+    """
+    The AsyncChatServer class hosts the same chat thread as the SimpleChatServer class, 
+    but the connections are handled by an asyncio event loop instead of the selector loop. 
+    Each client is served by one reader task and one writer task. The writer task waits 
+    for the transport buffer to drain before more messages are written (backpressure). 
+    The messages are framed with END_OF_MSG, so the ChatUser and ChatBot clients work 
+    with both servers.
+    
+    Usage:
+        The server is started with the startService method like the SimpleChatServer. 
+        The service can also be embedded in another asyncio application by awaiting 
+        the serve coroutine. It runs until the stopApplication flag is set (see 
+        stopService) or the task is cancelled.
+    """
+    # The transports of asyncio only take bytes, so the history log regions are read
+    SENDFILE = False
+    
+    def __init__(self, port, **kwargs):
+        # The keyword arguments are the same as for the SimpleChatServer class
+        SimpleChatServer.__init__(self, port, **kwargs)
+        # The event loop running the service. It is set when the service is started.
+        self.loop = None
+        # The asyncio server object accepting the connections
+        self.asyncServer = None
+        # The server socket is created by the serve method if it is not created by startService
+        self.serverSocket = None
+        
+    def mainThread(self):
+        """
+        This method is the target of the main thread started by the startService method. 
+        It runs the serve coroutine in a new event loop until the service is stopped.
+
+        Returns
+        -------
+        None.
+
+        """
+        asyncio.run(self.serve())
+        
+    async def serve(self):
+        """
+        This coroutine accepts connections until the stopApplication flag is set. The 
+        connections are accepted with asyncio.start_server, which calls handleClient for 
+        each new client.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.loop = asyncio.get_running_loop()
+        # The event used to stop the service from the user interaction thread
+        self.stopEvent = asyncio.Event()
+        if self.serverSocket is None:
+            # The service is embedded in another application
+            self.createServerSocket()
+        
+        self.asyncServer = await asyncio.start_server(self.handleClient, sock=self.serverSocket, 
+                                                      backlog=self.listenBacklog)
+        try:
+            # The flag could have been set before the event loop was started
+            self.processWakeup()
+            await self.stopEvent.wait()
+        finally:
+            # Stop accepting connections
+            self.asyncServer.close()
+            self.loop = None
+            
+    def scheduleTimer(self, delay, callback, *args):
+        """
+        This method schedules the callback with the timers of the event loop, which 
+        can also be cancelled. See SimpleChatServer.scheduleTimer.
+        """
+        return self.loop.call_later(delay, callback, *args)
+            
+    async def handleClient(self, reader, writer):
+        """
+        This coroutine is called by the asyncio server for each new connection. It creates 
+        the ChatSocket object for the client, starts the writer task and receives data from 
+        the client until the connection is closed.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            The stream used to receive data from the client.
+            
+        writer : asyncio.StreamWriter
+            The stream used to send data to the client.
+
+        Returns
+        -------
+        None.
+
+        """
+        # The socket object of the connection, used to identify the client
+        cliSock = writer.get_extra_info("socket")
+        delay = self.admissionControl.admit(writer.get_extra_info('peername')[0])
+        if delay is None:
+            # The address has opened too many connections
+            self.metrics["admissionRefused"] += 1
+            writer.transport.abort()
+            return
+        if delay > 0:
+            # The connection is served when the address is within the limit again
+            self.metrics["admissionDelayed"] += 1
+            await asyncio.sleep(delay)
+            if self.stopUserInteraction.is_set():
+                writer.transport.abort()
+                return
+        logging.info("New client connection accepted for source %s.", writer.get_extra_info('peername'))
+        
+        # Create the ChatSocket object for the new client/user.
+        curChatUser = ChatSocket(cliSock)
+        curChatUser.writer = writer
+        # The event used to wake up the writer task when there are new messages in the send queue
+        curChatUser.wakeEvent = asyncio.Event()
+        curChatUser.wakeEvent.set()
+        self.chatUsers.add(curChatUser)
+        # Start checking that the connection is alive
+        self.startHeartbeat(curChatUser)
+        writerTask = asyncio.create_task(self.writeToClient(curChatUser))
+        
+        while not curChatUser.isClosing:
+            try:
+                cur_recv = await reader.read(FrameDecoder.RECV_SIZE)
+            except OSError as E:
+                if not curChatUser.isClosing:
+                    self.connectionErrorHandling(curChatUser, cliSock, str(E))
+                break
+            
+            if len(cur_recv) == 0:
+                # The connection is closed by the client or by the writer task
+                if not curChatUser.isClosing:
+                    self.connectionErrorHandling(curChatUser, cliSock)
+                break
+            
+            # Handle the received messages
+            self.processReceived(curChatUser, cur_recv)
+            # Start the removal of clients that were kicked while handling the messages
+            self.processCloseNext()
+            
+            while not curChatUser.isClosing:
+                if curChatUser in self.throttledUsers:
+                    # The client exceeded the rate limits. The next data is handled after the delay.
+                    await asyncio.sleep(max(0, curChatUser.throttledUntil - time.monotonic()))
+                elif curChatUser in self.carryOver:
+                    # The client sent more messages than the dispatch budget. The other 
+                    # clients are served before the next messages are handled.
+                    await asyncio.sleep(0)
+                    self.processReceived(curChatUser)
+                    self.processCloseNext()
+                else:
+                    break
+            
+        # Start the removal of this client
+        self.processCloseNext()
+        await writerTask
+        
+    async def writeToClient(self, curChatUser):
+        """
+        This coroutine sends the messages in the send queue of the given client. It waits 
+        until the client is notified about new messages (notifyWritable). After writing 
+        the messages, drain is awaited so that a slow client does not fill the memory with 
+        buffered data. The connection is closed when the removal of the client has started 
+        and all messages are sent.
+
+        Parameters
+        ----------
+        curChatUser : ChatSocket object
+            The ChatSocket object of the client.
+
+        Returns
+        -------
+        None.
+
+        """
+        writer = curChatUser.writer
+        # The transport pauses the writer task (drain) with the same watermarks as the selector server
+        writer.transport.set_write_buffer_limits(OutboundBuffer.HIGH_WATERMARK, OutboundBuffer.LOW_WATERMARK)
+        try:
+            while not curChatUser.isBroken:
+                # The event is cleared before the queue is emptied, so that no notification is lost
+                curChatUser.wakeEvent.clear()
+                self.checkSlowConsumer(curChatUser)
+                frames = self.takeOutput(curChatUser, curChatUser.sendQueue.qsize() + self.LOG_READ_BATCH)
+                # The messages are handed to the transport together, so they can be sent with one system call
+                writer.writelines(frames)
+                # Wait until the outbound buffer is below the high water mark
+                await writer.drain()
+                
+                if curChatUser.isClosing and curChatUser.sendQueue.empty():
+                    # The disconnect message has been sent
+                    break
+                
+                if not self.hasPendingOutput(curChatUser):
+                    # Wait for new messages in the send queue or in the broadcast log of the room
+                    if curChatUser.room is not None:
+                        curChatUser.room.logWaiters[curChatUser] = None
+                    await curChatUser.wakeEvent.wait()
+        except OSError as E:
+            # The connection is broken
+            self.connectionErrorHandling(curChatUser, curChatUser.clientSocket, str(E))
+            self.processCloseNext()
+        finally:
+            # Finish the removal of the client
+            self.chatUsers.remove(curChatUser)
+            self.rateLimiter.remove(curChatUser)
+            if curChatUser in self.throttledUsers:
+                self.throttledUsers.pop(curChatUser).cancel()
+            self.carryOver.pop(curChatUser, None)
+            if curChatUser.room is not None:
+                curChatUser.room.logWaiters.pop(curChatUser, None)
+            if curChatUser.isBroken:
+                # The data buffered for a lost connection is discarded
+                writer.transport.abort()
+            else:
+                writer.close()
+            
+    def notifyWritable(self, curChatUser):
+        """
+        This method wakes up the writer task of the given client. See SimpleChatServer.notifyWritable.
+        """
+        curChatUser.wakeEvent.set()
+        
+    def wakeMainLoop(self):
+        """
+        This method is called from the user interaction thread. It schedules processWakeup 
+        in the event loop. See SimpleChatServer.wakeMainLoop.
+        """
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self.processWakeup)
+            except RuntimeError:
+                # The event loop is already closed
+                pass
+            
+    def processWakeup(self):
+        """
+        This method is run in the event loop after the user interaction thread has changed 
+        the state of the service. It starts the removal of kicked clients and stops the 
+        service if the stop flags are set.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.stopUserInteraction.is_set() and self.asyncServer.is_serving():
+            # The service is stopping. Stop accepting new connections
+            self.asyncServer.close()
+        
+        self.processCloseNext()
+        
+        if self.stopApplication.is_set():
+            self.stopEvent.set()
+        
+    def removeClient(self, cliSock):
+        """
+        This method starts the removal of the connection with a client. A message is 
+        sent to the other users and the disconnect message is added to the send queue 
+        of the client. The writer task closes the connection when the disconnect message 
+        has been sent, or immediately if the connection is broken.
+
+        Parameters
+        ----------
+        cliSock : Socket object
+            A reference to the client socket object that should be closed and removed.
+
+        Returns
+        -------
+        None.
+
+        """
+        curChatUser = self.searchChatUser(cliSock)
+        logging.info("The connection to %s %s is closing.", curChatUser.username, curChatUser.destAddress)
+        # Send a message to the other users in the room informing that the user is no longer active. 
+        # If the connection was lost, the message is delayed, so the user can resume.
+        self.leaveRoom(curChatUser, deferred=curChatUser.isBroken)
+        curChatUser.isClosing = True
+        
+        if not curChatUser.isBroken:
+            # Add the disconnect message to the sendQueue of the client
+            curChatUser.sendQueue.put(self.frameFor(curChatUser, curChatUser.kickReason, FrameType.kick))
+        self.notifyWritable(curChatUser)
+        
+        
+class ShardWorkerServer(SimpleChatServer):
+    """
+    The ShardWorkerServer class is one worker process of the ShardedChatServer. It serves 
+    the connections which the kernel gives to its server socket (SO_REUSEPORT). The 
+    messages from its clients are not added to the broadcast log directly. They are 
+    published on the bus to the parent process, which sends every message to all workers 
+    in the same order. Each worker therefore has the same history and broadcast log as 
+    a single server would have.
+    
+    If the history is kept on disk, only the worker HISTORY_OWNER writes the history 
+    files. The other workers keep the history in memory. They read the files when they 
+    are started, before the owner is started (see ShardedChatServer.createServerSocket), 
+    so their history and sequence numbers continue from the same messages.
+    
+    The records on the bus are tuples sent with multiprocessing connections:
+        ("ready",) - worker to parent: the server socket of the worker is listening.
+        ("publish", msg, frameType, origin, room) - worker to parent: a message that should be broadcast.
+        ("broadcast", msg, frameType, origin, room) - parent to workers: the next message in the room.
+        ("command", name, arguments, request) - parent to workers: a command of the administrator. 
+            If request is not None, the parent waits for the result of the command.
+        ("result", request, result) - worker to parent: the result of a command.
+    The origin is a tuple (worker index, token). The token identifies the socket of the 
+    client which sent the message, so the worker can skip it when the message returns.
+    """
+    # The server sockets of the workers share the port
+    REUSE_PORT = True
+    # The number of the worker which writes the history files
+    HISTORY_OWNER = 0
+    
+    def __init__(self, port, index, busConnection, **kwargs):
+        historyDir = kwargs.get("historyDir")
+        if index != self.HISTORY_OWNER:
+            # The history is kept in memory
+            kwargs["historyDir"] = None
+        # The keyword arguments are the same as for the SimpleChatServer class
+        SimpleChatServer.__init__(self, port, **kwargs)
+        if historyDir is not None and index != self.HISTORY_OWNER and os.path.isdir(historyDir):
+            # Load the history of the rooms from the files of the owner
+            for name in sorted(os.listdir(historyDir)):
+                if self.roomPattern.search(name) and (name in self.rooms or len(self.rooms) < self.MAX_ROOMS):
+                    self.loadHistory(self.getRoom(name), os.path.join(historyDir, name))
+        # The number of the worker and the connection to the parent process
+        self.index = index
+        self.busConnection = busConnection
+        # The records which should be sent to the parent process. They are sent by their 
+        # own thread (see sendToParent), so a slow parent does not stop the main loop.
+        self.busQueue = Queue()
+        # The sockets of the clients which sent the messages that have not returned from 
+        # the bus yet, by token
+        self.pendingOrigins = {}
+        # The token of the next message published
+        self.nextToken = 0
+        
+    def mainThread(self):
+        """
+        This method registers the bus in the selector, starts the thread sending the 
+        records to the parent process and runs the main loop of the SimpleChatServer class.
+        """
+        senderThread = threading.Thread(target=self.sendToParent, daemon=True)
+        senderThread.start()
+        self.selector.register(self.busConnection, selectors.EVENT_READ, self.processBus)
+        SimpleChatServer.mainThread(self)
+        # Stop the sender thread when the records in the queue are sent
+        self.busQueue.put(None)
+        senderThread.join()
+        
+    def sendToParent(self):
+        """
+        This method sends the records in the queue to the parent process until None is taken from the queue.
+        """
+        while True:
+            record = self.busQueue.get()
+            if record is None:
+                return
+            try:
+                self.busConnection.send(record)
+            except OSError as E:
+                # The parent process has stopped. The records are dropped.
+                logging.error(f"Worker {self.index}: The records could not be sent to the parent process: {E}")
+        
+    def loadHistory(self, room, directory):
+        """
+        This method fills the history of the given room with the messages stored in the 
+        given directory. The broadcast log of the room continues after the last message. 
+        It is called before the worker has clients.
+        """
+        records, end = HistoryLog.read(directory)
+        messages = []
+        for timestamp, record in records:
+            # The frames are encoded again with each version of the protocol
+            frame = DECODERS[PROTOCOL_V2](maxFrameSize=len(record)).feed(record)[0]
+            frames = self.frameMessage(frame.text, FrameType(frame.frameType), frame.sequence)
+            messages.append((timestamp, frames, len(frames[0])))
+        room.history.restore(messages, end)
+        room.broadcastLog = BroadcastLog(end)
+        
+    def startHostTimer(self, room):
+        """
+        The host messages are sent by the parent process, so the worker does not run host bots.
+        """
+        pass
+    
+    def populateSendQueues(self, msg, cliSock, frameType=FrameType.chat, room=None):
+        """
+        This method publishes a message on the bus. The message is added to the broadcast 
+        log of the room when it is received back from the parent process (see processBus). 
+        See SimpleChatServer.populateSendQueues for the parameters.
+        """
+        origin = None
+        if cliSock is not None:
+            origin = (self.index, self.nextToken)
+            self.pendingOrigins[self.nextToken] = cliSock
+            self.nextToken += 1
+        roomName = room.name if room is not None else self.DEFAULT_ROOM
+        self.busQueue.put(("publish", msg, int(frameType), origin, roomName))
+        
+    def processBus(self):
+        """
+        This method handles the records received from the parent process. The worker 
+        is stopped if the connection to the parent process is closed.
+
+        Returns
+        -------
+        None.
+
+        """
+        try:
+            while self.busConnection.poll():
+                record = self.busConnection.recv()
+                if record[0] == "broadcast":
+                    msg, frameType, origin, roomName = record[1:]
+                    cliSock = None
+                    if origin is not None and origin[0] == self.index:
+                        # The message was sent by a client of this worker
+                        cliSock = self.pendingOrigins.pop(origin[1])
+                    # The room is created if it does not exist in this worker yet, so all workers have the same rooms
+                    SimpleChatServer.populateSendQueues(self, msg, cliSock, FrameType(frameType), self.getRoom(roomName))
+                elif record[0] == "command":
+                    name, arguments, request = record[1:]
+                    result = self.cmdSet[name][2](*arguments)
+                    if request is not None:
+                        # The parent waits for the result
+                        self.busQueue.put(("result", request, result))
+        except (EOFError, OSError):
+            # The parent process has stopped
+            logging.error(f"Worker {self.index}: The connection to the parent process is closed.")
+            self.selector.unregister(self.busConnection)
+            self.stopService("The service is stopping!")
+        
+    def listConnections(self):
+        """
+        This method prints the connections of the worker. See SimpleChatServer.listConnections.
+        """
+        print(f"\nWorker {self.index}:")
+        SimpleChatServer.listConnections(self)
+        
+    def listMetrics(self):
+        """
+        This method prints the counters of the worker. See SimpleChatServer.listMetrics.
+        """
+        print(f"\nWorker {self.index}:")
+        SimpleChatServer.listMetrics(self)
+        
+    def stopService(self, reason=""):
+        """
+        This method removes all connections of the worker and stops the main loop when 
+        they are removed. The waiting is done in another thread, because the connections 
+        are removed by the main thread.
+        """
+        self.stopUserInteraction.set()
+        logging.info(f"Worker {self.index} is stopping.")
+        for curChatUser in self.chatUsers:
+            curChatUser.kickReason = reason
+            self.closeNext[curChatUser.clientSocket] = None
+        threading.Thread(target=self.waitForRemoval, daemon=True).start()
+        
+    def waitForRemoval(self):
+        """
+        This method waits until all connections are removed and stops the main loop.
+        """
+        while len(self.chatUsers) > 0:
+            time.sleep(0.1)
+        self.stopApplication.set()
+        self.wakeMainLoop()
+        
+        
+def runShardWorker(index, port, options, busConnection):
+    """
+    This function is the target of the worker processes of the ShardedChatServer. It 
+    creates the ShardWorkerServer object and runs its main loop until the service is stopped.
+
+    Parameters
+    ----------
+    index : int
+        The number of the worker.
+        
+    port : int
+        The port shared by the workers.
+        
+    options : dict
+        The keyword arguments of the SimpleChatServer class.
+        
+    busConnection : multiprocessing.connection.Connection
+        The connection to the parent process.
+
+    Returns
+    -------
+    None.
+
+    """
+    server = ShardWorkerServer(port, index, busConnection, **options)
+    # Each worker writes its own log file
+    server.startLogging(f"chatServer_worker{index}_{{}}.log")
+    server.createServerSocket()
+    # Tell the parent that the worker accepts connections
+    busConnection.send(("ready",))
+    server.isRunning = True
+    server.mainThread()
+    server.serverSocket.close()
+    server.isRunning = False
+    server.stopLogging()
+    
+    
+class ShardedChatServer(SimpleChatServer):
+    """
+    The ShardedChatServer class hosts the chat thread with several worker processes, so 
+    the service is not limited to one CPU core. The workers listen on the same port with 
+    SO_REUSEPORT, and the kernel distributes the new connections between them. Each 
+    worker (ShardWorkerServer) serves its connections like a SimpleChatServer.
+    
+    The parent process is the bus between the workers. It receives the messages published 
+    by the workers and sends each message to all workers. The messages are put in one 
+    order by the parent, so the chat history is the same in all workers and has the same 
+    order as with a single server. The parent also runs the host bots of the rooms and 
+    the user interaction loop, and forwards the commands of the administrator to the 
+    workers. The parent counts the members of each room from the join and leave 
+    messages, so the host bots only send messages to rooms with members.
+    
+    Usage:
+        The server is started with the startService method like the SimpleChatServer. 
+        The workers are started when the server socket is created. SO_REUSEPORT is only 
+        available on Linux and some other Unix platforms.
+    """
+    # The server socket of the parent reserves the port for the workers
+    REUSE_PORT = True
+    # The default number of worker processes
+    WORKERS = 4
+    # The number of seconds the parent waits for the results of a command from the workers
+    COMMAND_TIMEOUT = 2
+    # The workers are started with a new interpreter (spawn), not forked. A forked worker 
+    # could inherit a lock held by another thread of the parent (e.g. the log thread).
+    START_METHOD = "spawn"
+    
+    def __init__(self, port, workers=WORKERS, **kwargs):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise ValueError("The sharded server requires SO_REUSEPORT, which is not available on this platform.")
+        if type(workers) != int or workers < 1:
+            raise ValueError(f"The number of workers {workers} is not valid. Please provide a positive integer.")
+        # The keyword arguments are the same as for the SimpleChatServer class. The history 
+        # is kept by the workers, so the parent does not store it.
+        SimpleChatServer.__init__(self, port, **dict(kwargs, historyDir=None))
+        # The keyword arguments given to the workers
+        self.workerOptions = kwargs
+        self.workers = workers
+        # The worker processes, the connections to the workers and the queues of the 
+        # records which should be sent to each worker
+        self.workerProcesses = []
+        self.busConnections = []
+        self.busQueues = []
+        # The lock used to add a record to all queues, so all workers get the records in the same order
+        self.busLock = threading.Lock()
+        # The results of the commands sent to the workers, by request number, and the 
+        # condition used to wait for them (see forwardCommand)
+        self.commandResults = {}
+        self.resultsCondition = threading.Condition()
+        self.nextRequest = 0
+        # The number of members in each room, counted for each worker, so the members of 
+        # a worker which stops can be dropped
+        self.roomMembers = [Counter() for index in range(workers)]
+        
+    def createServerSocket(self):
+        """
+        This method binds the socket of the parent to the port without listening, so the 
+        port is reserved (and a port chosen by the system is known), and starts the workers. 
+        It returns when all workers are listening.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.raiseFileLimit()
+        self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.serverSocket.bind(('', self.port))
+        self.port = self.serverSocket.getsockname()[1]
+        
+        context = multiprocessing.get_context(self.START_METHOD)
+        workerConnections = []
+        for index in range(self.workers):
+            busConnection, workerConnection = context.Pipe()
+            self.workerProcesses.append(context.Process(target=runShardWorker, daemon=True, 
+                                                        args=(index, self.port, self.workerOptions, workerConnection)))
+            self.busConnections.append(busConnection)
+            self.busQueues.append(Queue())
+            workerConnections.append(workerConnection)
+            
+        # The worker writing the history files is started after the other workers have 
+        # read the files, so the files are not changed while they are read
+        owner = ShardWorkerServer.HISTORY_OWNER
+        for group in ([index for index in range(self.workers) if index != owner], [owner]):
+            for index in group:
+                self.workerProcesses[index].start()
+                # The parent does not use the end of the worker
+                workerConnections[index].close()
+            for index in group:
+                # Wait until the worker listens, so the service accepts connections when this method returns
+                try:
+                    self.busConnections[index].recv()
+                except EOFError:
+                    raise OSError(f"The worker {index} could not be started.")
+            
+    def mainThread(self):
+        """
+        This method runs the bus. It receives the records published by the workers and 
+        adds them to the queues of all workers. Each queue is sent by its own thread, so 
+        a worker which is slow to read does not stop the bus. The host message timers 
+        of the rooms are run by the same loop. The loop ends when the stopApplication 
+        flag is set.
+
+        Returns
+        -------
+        None.
+
+        """
+        senderThreads = [threading.Thread(target=self.sendToWorker, args=(index,), daemon=True) 
+                         for index in range(self.workers)]
+        for thread in senderThreads:
+            thread.start()
+            
+        busSelector = selectors.DefaultSelector()
+        for index, busConnection in enumerate(self.busConnections):
+            # The connection is registered with the number of its worker
+            busSelector.register(busConnection, selectors.EVENT_READ, index)
+        # The wakeup socket pair is used when the service is stopped (see stopService)
+        self.openWakeup(busSelector)
+            
+        # The loop also ends when all workers have stopped (only the wakeup socket is registered)
+        while not self.stopApplication.is_set() and len(busSelector.get_map()) > 1:
+            for key, mask in busSelector.select(self.selectTimeout()):
+                if callable(key.data):
+                    # The wakeup socket
+                    key.data()
+                    continue
+                try:
+                    record = key.fileobj.recv()
+                except (EOFError, OSError):
+                    # The worker has stopped. Its clients are no longer members of the rooms.
+                    busSelector.unregister(key.fileobj)
+                    self.roomMembers[key.data].clear()
+                    continue
+                if record[0] == "result":
+                    request, result = record[1:]
+                    with self.resultsCondition:
+                        if request in self.commandResults:
+                            self.commandResults[request].append(result)
+                            self.resultsCondition.notify_all()
+                elif record[0] == "publish":
+                    msg, frameType, origin, roomName = record[1:]
+                    self.publish(("broadcast", msg, frameType, origin, roomName))
+                    if frameType in (FrameType.join, FrameType.leave):
+                        # Count the members of the room for the host bot
+                        room = self.getRoom(roomName)
+                        self.roomMembers[key.data][roomName] += 1 if frameType == FrameType.join else -1
+                        if frameType == FrameType.join:
+                            self.startHostTimer(room)
+            # Send the host messages which are due
+            self.timers.run()
+                    
+        self.closeWakeup(busSelector)
+        busSelector.close()
+        for busQueue in self.busQueues:
+            # Stop the sender threads
+            busQueue.put(None)
+        
+    def sendToWorker(self, index):
+        """
+        This method sends the records in the queue of the given worker until None is taken from the queue.
+        """
+        busQueue = self.busQueues[index]
+        busConnection = self.busConnections[index]
+        while True:
+            record = busQueue.get()
+            if record is None:
+                return
+            try:
+                busConnection.send(record)
+            except OSError as E:
+                # The worker has stopped. The records are dropped.
+                logging.error(f"The records could not be sent to worker {index}: {E}")
+            
+    def publish(self, record):
+        """
+        This method adds a record to the queues of all workers.
+        """
+        with self.busLock:
+            for busQueue in self.busQueues:
+                busQueue.put(record)
+                
+    def populateSendQueues(self, msg, cliSock, frameType=FrameType.chat, room=None):
+        """
+        This method broadcasts a message from the parent (the host bot) to the members 
+        of the room in all workers. See SimpleChatServer.populateSendQueues.
+        """
+        roomName = room.name if room is not None else self.DEFAULT_ROOM
+        self.publish(("broadcast", msg, int(frameType), None, roomName))
+        
+    def roomHasMembers(self, room):
+        """
+        This method returns True if the given room has members in any worker.
+        """
+        return any(members[room.name] > 0 for members in self.roomMembers)
+        
+    def forwardCommand(self, name, *arguments, wait=False):
+        """
+        This method sends a command of the administrator to all workers. The workers 
+        print the results to the terminal.
+
+        Parameters
+        ----------
+        name : String
+            The name of the command (a key of cmdSet).
             
-        # The user was not found
-        raise Exception("The user was not found in the chatUser list.")
+        arguments : 
+            The arguments of the command.
+            
+        wait : bool, optional
+            If True, the method waits at most COMMAND_TIMEOUT seconds for the results 
+            from the running workers. The default is False.
+
+        Returns
+        -------
+        List
+            The results received from the workers (empty if wait is False).
 
+        """
+        if not wait:
+            self.publish(("command", name, arguments, None))
+            return []
+        with self.resultsCondition:
+            request = self.nextRequest
+            self.nextRequest += 1
+            self.commandResults[request] = []
+        self.publish(("command", name, arguments, request))
+        workers = sum(process.is_alive() for process in self.workerProcesses)
+        with self.resultsCondition:
+            self.resultsCondition.wait_for(lambda: len(self.commandResults[request]) >= workers, self.COMMAND_TIMEOUT)
+            return self.commandResults.pop(request)
+        
+    def listConnections(self):
+        self.forwardCommand("listConnections")
+        
+    def listMetrics(self):
+        self.forwardCommand("metrics")
+        
+    def kickUser(self, username, reason=""):
+        """
+        This method asks all workers to kick the user with the given username. True is 
+        returned if a worker has found the user.
+        """
+        return any(self.forwardCommand("kick", username, reason, wait=True))
+    
+    def setRateLimit(self, username, rate, burst):
+        self.forwardCommand("ratelimit", username, rate, burst)
+        
+    def stopService(self, reason=""):
+        """
+        This method stops the workers and the bus. See SimpleChatServer.stopService.
+        """
+        self.stopUserInteraction.set()
+        print("Service is shutting down.")
+        print("    Stopping the workers.", end="\r")
+        logging.info("The service is stoping due to an \"exit\" command issued by admin.")
+        self.forwardCommand("exit", reason)
+        for process in self.workerProcesses:
+            while process.is_alive():
+                # Wait until the worker has removed its connections
+                self.waitIndication()
+            process.join()
+        print("[OK] Stopping the workers.")
+        self.stopApplication.set()
+        self.wakeMainLoop()
+        
+        
 if __name__=="__main__":
     
     #Handle command line argument
@@ -1046,11 +4792,116 @@ if __name__=="__main__":
     parser.add_argument('-p', '--Port', nargs='?', default=2020, metavar="PORT",
                         type=int, help="The port number that the server listens on. " +
                         "\nAn integer between 0 and 65535. Default: 2020")
+    # Define the commandline argument used to select the implementation of the event loop
+    parser.add_argument('-e', '--Engine', nargs='?', default="selectors", metavar="ENGINE",
+                        choices=["selectors", "asyncio"], help="The event loop used to handle " +
+                        "the connections: selectors or asyncio. Default: selectors")
+    # Define the commandline arguments for the capacity of the chat history and the replay window
+    parser.add_argument('--HistorySize', nargs='?', default=SimpleChatServer.HISTORY_SIZE, metavar="MESSAGES", 
+                        type=int, help="The maximum number of messages kept in the chat history. " + 
+                        f"Default: {SimpleChatServer.HISTORY_SIZE}")
+    parser.add_argument('--HistoryBytes', nargs='?', default=SimpleChatServer.HISTORY_BYTES, metavar="BYTES", 
+                        type=int, help="The maximum size of the chat history in bytes. " + 
+                        f"Default: {SimpleChatServer.HISTORY_BYTES}")
+    parser.add_argument('--HistoryDir', nargs='?', default="./History", metavar="DIRECTORY", 
+                        help="The directory where the chat history is stored, so it is kept when the " + 
+                        "server is restarted. Default: ./History")
+    parser.add_argument('--NoHistoryFiles', action='store_const', const=None, dest='HistoryDir', 
+                        help="Only keep the chat history in memory.")
+    parser.add_argument('--ReplayMessages', nargs='?', default=SimpleChatServer.REPLAY_MESSAGES, metavar="MESSAGES", 
+                        type=int, help="The number of old messages sent to a joining client. " + 
+                        f"Default: {SimpleChatServer.REPLAY_MESSAGES}")
+    parser.add_argument('--ReplaySeconds', nargs='?', default=SimpleChatServer.REPLAY_SECONDS, metavar="SECONDS", 
+                        type=float, help="Only messages sent within the given number of seconds are " + 
+                        "sent to a joining client. Default: no limit")
+    # Define the commandline arguments for the handling of clients which do not read fast enough
+    parser.add_argument('--SlowConsumerPolicy', nargs='?', default=SimpleChatServer.SLOW_CONSUMER_POLICY, metavar="POLICY", 
+                        choices=SimpleChatServer.SLOW_CONSUMER_POLICIES, help="What is done when the messages waiting " + 
+                        "for a client exceed the backlog limits: drop (the oldest messages), skip (to the newest " + 
+                        f"message) or disconnect. Default: {SimpleChatServer.SLOW_CONSUMER_POLICY}")
+    parser.add_argument('--MaxBacklogMessages', nargs='?', default=SimpleChatServer.MAX_BACKLOG_MESSAGES, metavar="MESSAGES", 
+                        type=int, help="The maximum number of messages waiting to be sent to one client. " + 
+                        f"Default: {SimpleChatServer.MAX_BACKLOG_MESSAGES}")
+    parser.add_argument('--MaxBacklogBytes', nargs='?', default=SimpleChatServer.MAX_BACKLOG_BYTES, metavar="BYTES", 
+                        type=int, help="The maximum number of bytes waiting to be sent to one client. " + 
+                        f"Default: {SimpleChatServer.MAX_BACKLOG_BYTES}")
+    # Define the commandline arguments for the rate limits of the users
+    parser.add_argument('--RateLimitPolicy', nargs='?', default=SimpleChatServer.RATE_LIMIT_POLICY, metavar="POLICY", 
+                        choices=SimpleChatServer.RATE_LIMIT_POLICIES, help="What is done when a user sends more " + 
+                        f"messages than the rate limit allows: kick or throttle. Default: {SimpleChatServer.RATE_LIMIT_POLICY}")
+    parser.add_argument('--RateLimitPerSecond', nargs='?', default=SimpleChatServer.RATE_LIMIT_PER_SECOND, metavar="MESSAGES", 
+                        type=float, help="The number of messages a user can send per second on average. " + 
+                        f"Default: {SimpleChatServer.RATE_LIMIT_PER_SECOND}")
+    parser.add_argument('--RateLimitBurst', nargs='?', default=SimpleChatServer.RATE_LIMIT_BURST, metavar="MESSAGES", 
+                        type=int, help="The number of messages a user can send at once. " + 
+                        f"Default: {SimpleChatServer.RATE_LIMIT_BURST}")
+    # Define the commandline argument used to start the sharded server
+    parser.add_argument('-w', '--Workers', nargs='?', default=1, metavar="WORKERS", type=int, 
+                        help="The number of worker processes sharing the port. More than one worker " + 
+                        "requires the selectors engine and SO_REUSEPORT (Linux). Default: 1")
+    # Define the commandline argument used to turn off compression
+    parser.add_argument('--NoCompression', action='store_false', dest='Compression', 
+                        help="Do not compress the data sent to clients which offer compression.")
+    # Define the commandline arguments for the handling of new connections
+    parser.add_argument('--ListenBacklog', nargs='?', default=SimpleChatServer.LISTEN_BACKLOG, metavar="CONNECTIONS", 
+                        type=int, help="The number of connections waiting to be accepted before new connections " + 
+                        f"are refused by the kernel. Default: {SimpleChatServer.LISTEN_BACKLOG}")
+    parser.add_argument('--ConnectRatePerSecond', nargs='?', default=SimpleChatServer.CONNECT_RATE_PER_SECOND, 
+                        metavar="CONNECTIONS", type=float, help="The number of new connections served per second from " + 
+                        f"one address on average. Default: {SimpleChatServer.CONNECT_RATE_PER_SECOND}")
+    parser.add_argument('--ConnectBurst', nargs='?', default=SimpleChatServer.CONNECT_BURST, metavar="CONNECTIONS", 
+                        type=int, help="The number of new connections served at once from one address. Further " + 
+                        f"connections are served later. Default: {SimpleChatServer.CONNECT_BURST}")
+    # Define the commandline arguments for the budgets of each client in one iteration of the main loop
+    parser.add_argument('--ReadBudget', nargs='?', default=SimpleChatServer.READ_BUDGET, metavar="BYTES", 
+                        type=int, help="The number of bytes received from one client at a time before the " + 
+                        f"other clients are served. Default: {SimpleChatServer.READ_BUDGET}")
+    parser.add_argument('--DispatchBudget', nargs='?', default=SimpleChatServer.DISPATCH_BUDGET, metavar="MESSAGES", 
+                        type=int, help="The number of messages from one client handled at a time before the " + 
+                        f"other clients are served. Default: {SimpleChatServer.DISPATCH_BUDGET}")
+    # Define the commandline arguments for the checks of the connections
+    parser.add_argument('--HeartbeatInterval', nargs='?', default=SimpleChatServer.HEARTBEAT_INTERVAL, metavar="SECONDS", 
+                        type=int, help="A client which has not sent anything for the given number of seconds is " + 
+                        f"sent a heartbeat (0 turns the checks off). Default: {SimpleChatServer.HEARTBEAT_INTERVAL}")
+    parser.add_argument('--IdleTimeout', nargs='?', default=SimpleChatServer.IDLE_TIMEOUT, metavar="SECONDS", 
+                        type=int, help="The connection of a client which has not sent anything for the given number " + 
+                        f"of seconds is closed (0 means never). Default: {SimpleChatServer.IDLE_TIMEOUT}")
+    # Define the commandline arguments for the log file
+    parser.add_argument('--LogLevel', nargs='?', default=SimpleChatServer.LOG_LEVEL, metavar="LEVEL", 
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="The lowest level of the " + 
+                        f"messages written to the log file. Default: {SimpleChatServer.LOG_LEVEL}")
+    parser.add_argument('--LogMaxBytes', nargs='?', default=SimpleChatServer.LOG_MAX_BYTES, metavar="BYTES", 
+                        type=int, help="The log file is rotated when it is larger than the given number of bytes. " + 
+                        f"Default: {SimpleChatServer.LOG_MAX_BYTES}")
+    parser.add_argument('--LogBackups', nargs='?', default=SimpleChatServer.LOG_BACKUPS, metavar="FILES", 
+                        type=int, help="The number of rotated log files which are kept. " + 
+                        f"Default: {SimpleChatServer.LOG_BACKUPS}")
+    parser.add_argument('--LogPayloadSample', nargs='?', default=SimpleChatServer.LOG_PAYLOAD_SAMPLE, metavar="N", 
+                        type=int, help="The received messages are written to the log for one in N receives " + 
+                        f"(0 means never). Default: {SimpleChatServer.LOG_PAYLOAD_SAMPLE}")
     # Parse the given arguments
     args = parser.parse_args()
     
+    if args.Workers > 1 and args.Engine != "selectors":
+        parser.error("The sharded server requires the selectors engine.")
+    
     # Instantiate a server object and start the server.
-    server = SimpleChatServer(args.Port)
+    options = dict(historySize=args.HistorySize, historyBytes=args.HistoryBytes, 
+                   replayMessages=args.ReplayMessages, replaySeconds=args.ReplaySeconds, 
+                   slowConsumerPolicy=args.SlowConsumerPolicy, maxBacklogMessages=args.MaxBacklogMessages, 
+                   maxBacklogBytes=args.MaxBacklogBytes, compression=args.Compression, 
+                   rateLimitPolicy=args.RateLimitPolicy, rateLimitPerSecond=args.RateLimitPerSecond, 
+                   rateLimitBurst=args.RateLimitBurst, historyDir=args.HistoryDir, logLevel=args.LogLevel, 
+                   logMaxBytes=args.LogMaxBytes, logBackups=args.LogBackups, logPayloadSample=args.LogPayloadSample, 
+                   heartbeatInterval=args.HeartbeatInterval, idleTimeout=args.IdleTimeout, 
+                   listenBacklog=args.ListenBacklog, connectRatePerSecond=args.ConnectRatePerSecond, 
+                   connectBurst=args.ConnectBurst, readBudget=args.ReadBudget, 
+                   dispatchBudget=args.DispatchBudget)
+    if args.Workers > 1:
+        server = ShardedChatServer(args.Port, workers=args.Workers, **options)
+    else:
+        engines = {"selectors" : SimpleChatServer, "asyncio" : AsyncChatServer}
+        server = engines[args.Engine](args.Port, **options)
     server.startService()
     
     
\ No newline at end of file